@@ -0,0 +1,537 @@
+"""
+Offline end-to-end benchmark: runs main.py (scan -> InvoiceProcessor ->
+result store -> Excel export) over a synthetic corpus with a local stand-in
+for the Gemini client, so throughput can be measured without API calls.
+
+    python benchmark.py --files 500 --xml_ratio 0.6 --latency_ms 800 --rate_429 0.02
+    python benchmark.py --files 2000 --lines 200 --json bench.json -- --workers 32 --rpm 600
+
+Arguments after "--" are passed to main.py as they are.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import contextlib
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+from PIL import Image
+
+import main as app
+from processor import InvoiceProcessor
+from result_store import ResultStore
+from manifest import Manifest
+from utils import calculate_nit_verification_digit
+
+INVOICE_NS = "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+ATTACHED_NS = "urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2"
+NAMESPACES = (
+    'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+    'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" '
+    'xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2"'
+)
+CITIES = ["Bogotá", "Medellín", "Cali", "Barranquilla", "Bucaramanga"]
+ITEMS = ["Servicios de aseo", "Mantenimiento", "Compra papelería", "Arrendamiento", "Transporte"]
+
+
+# --- Synthetic DIAN UBL 2.1 corpus -------------------------------------------
+
+def _supplier(rng: random.Random) -> Dict:
+    nit = str(rng.randint(800000000, 999999999))
+    return {
+        "nit": nit,
+        "dv": calculate_nit_verification_digit(nit),
+        "name": f"PROVEEDOR {rng.randint(1, 9999)} S.A.S.",
+        "city": rng.choice(CITIES),
+        "phone": f"60{rng.randint(10000000, 99999999)}",
+    }
+
+
+def invoice_xml(number: str, rng: random.Random, lines: int = 5, padding_kb: int = 0) -> str:
+    """
+    A UBL 2.1 Invoice as issued to the DIAN: extensions (with padding_kb of
+    filler standing in for the signature), header, supplier, totals and
+    `lines` InvoiceLine elements.
+    """
+    supplier = _supplier(rng)
+    cufe = hashlib.sha384(f"{number}-{supplier['nit']}".encode()).hexdigest()
+    issue = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+    amounts = [round(rng.uniform(1000, 500000), 2) for _ in range(max(lines, 1))]
+    base = round(sum(amounts), 2)
+    tax = round(base * 0.19, 2)
+    total = round(base + tax, 2)
+
+    filler = ""
+    if padding_kb:
+        blob = hashlib.sha256(number.encode()).hexdigest()
+        filler = (blob * (padding_kb * 1024 // len(blob) + 1))[:padding_kb * 1024]
+
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<Invoice xmlns="{INVOICE_NS}" {NAMESPACES}>',
+        f"<ext:UBLExtensions><ext:UBLExtension><ext:ExtensionContent>{filler}</ext:ExtensionContent></ext:UBLExtension></ext:UBLExtensions>",
+        "<cbc:UBLVersionID>UBL 2.1</cbc:UBLVersionID>",
+        "<cbc:CustomizationID>10</cbc:CustomizationID>",
+        "<cbc:ProfileID>DIAN 2.1: Factura Electrónica de Venta</cbc:ProfileID>",
+        f"<cbc:ID>{number}</cbc:ID>",
+        f'<cbc:UUID schemeName="CUFE-SHA384">{cufe}</cbc:UUID>',
+        f"<cbc:IssueDate>{issue}</cbc:IssueDate>",
+        f"<cbc:DueDate>{issue[:8]}28</cbc:DueDate>",
+        "<cbc:InvoiceTypeCode>01</cbc:InvoiceTypeCode>",
+        "<cbc:DocumentCurrencyCode>COP</cbc:DocumentCurrencyCode>",
+        f"<cbc:LineCountNumeric>{len(amounts)}</cbc:LineCountNumeric>",
+        "<cac:AccountingSupplierParty><cac:Party>",
+        "<cac:PhysicalLocation><cac:Address>",
+        f"<cbc:CityName>{supplier['city']}</cbc:CityName>",
+        f"<cac:AddressLine><cbc:Line>Calle {rng.randint(1, 200)} # {rng.randint(1, 99)}-{rng.randint(1, 99)}</cbc:Line></cac:AddressLine>",
+        "</cac:Address></cac:PhysicalLocation>",
+        "<cac:PartyTaxScheme>",
+        f"<cbc:RegistrationName>{escape(supplier['name'])}</cbc:RegistrationName>",
+        f'<cbc:CompanyID schemeID="{supplier["dv"]}" schemeName="31">{supplier["nit"]}</cbc:CompanyID>',
+        "</cac:PartyTaxScheme>",
+        f"<cac:Contact><cbc:Telephone>{supplier['phone']}</cbc:Telephone></cac:Contact>",
+        "</cac:Party></cac:AccountingSupplierParty>",
+        "<cac:AccountingCustomerParty><cac:Party><cac:PartyTaxScheme>",
+        "<cbc:RegistrationName>CLIENTE S.A.S.</cbc:RegistrationName><cbc:CompanyID>900123456</cbc:CompanyID>",
+        "</cac:PartyTaxScheme></cac:Party></cac:AccountingCustomerParty>",
+        f'<cac:TaxTotal><cbc:TaxAmount currencyID="COP">{tax:.2f}</cbc:TaxAmount></cac:TaxTotal>',
+        "<cac:LegalMonetaryTotal>",
+        f'<cbc:LineExtensionAmount currencyID="COP">{base:.2f}</cbc:LineExtensionAmount>',
+        f'<cbc:TaxExclusiveAmount currencyID="COP">{base:.2f}</cbc:TaxExclusiveAmount>',
+        f'<cbc:TaxInclusiveAmount currencyID="COP">{total:.2f}</cbc:TaxInclusiveAmount>',
+        f'<cbc:PayableAmount currencyID="COP">{total:.2f}</cbc:PayableAmount>',
+        "</cac:LegalMonetaryTotal>",
+    ]
+    for i, amount in enumerate(amounts, start=1):
+        out.append(
+            f'<cac:InvoiceLine><cbc:ID>{i}</cbc:ID><cbc:InvoicedQuantity unitCode="94">1</cbc:InvoicedQuantity>'
+            f'<cbc:LineExtensionAmount currencyID="COP">{amount:.2f}</cbc:LineExtensionAmount>'
+            f'<cac:TaxTotal><cbc:TaxAmount currencyID="COP">{amount * 0.19:.2f}</cbc:TaxAmount></cac:TaxTotal>'
+            f"<cac:Item><cbc:Description>{rng.choice(ITEMS)}</cbc:Description></cac:Item>"
+            f'<cac:Price><cbc:PriceAmount currencyID="COP">{amount:.2f}</cbc:PriceAmount></cac:Price></cac:InvoiceLine>'
+        )
+    out.append("</Invoice>")
+    return "\n".join(out)
+
+
+def attached_document_xml(number: str, rng: random.Random, lines: int = 5, padding_kb: int = 0) -> str:
+    """The DIAN AttachedDocument container, with the Invoice as CDATA in its Description."""
+    inner = invoice_xml(number, rng, lines, padding_kb)
+    return "\n".join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<AttachedDocument xmlns="{ATTACHED_NS}" {NAMESPACES}>',
+        "<cbc:UBLVersionID>UBL 2.1</cbc:UBLVersionID>",
+        "<cbc:CustomizationID>Documentos adjuntos</cbc:CustomizationID>",
+        f"<cbc:ID>AD-{number}</cbc:ID>",
+        "<cac:Attachment><cac:ExternalReference>",
+        "<cbc:MimeCode>text/xml</cbc:MimeCode><cbc:EncodingCode>UTF-8</cbc:EncodingCode>",
+        f"<cbc:Description><![CDATA[{inner}]]></cbc:Description>",
+        "</cac:ExternalReference></cac:Attachment>",
+        f"<cac:ParentDocumentLineReference><cbc:LineID>1</cbc:LineID><cac:DocumentReference><cbc:ID>{number}</cbc:ID></cac:DocumentReference></cac:ParentDocumentLineReference>",
+        "</AttachedDocument>",
+    ])
+
+
+def _document(path: str, seed: int, side: int):
+    """A small unique scan-like image (PDF or JPEG, no text layer)."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (side, int(side * 1.3)), (255, 255, 255))
+    pixels = image.load()
+    for _ in range(200):
+        pixels[rng.randrange(image.width), rng.randrange(image.height)] = (rng.randrange(256), 0, 0)
+    image.save(path, "PDF" if path.endswith(".pdf") else "JPEG")
+
+
+def generate_corpus(directory: str, files: int, xml_ratio: float = 0.5, attached_ratio: float = 0.5,
+                    lines: int = 5, padding_kb: int = 0, image_side: int = 600,
+                    folders: int = 1, seed: int = 1) -> Dict[str, int]:
+    """
+    Writes `files` invoices into directory (spread over `folders` subfolders):
+    a share xml_ratio gets a companion XML (AttachedDocument for
+    attached_ratio of them, plain Invoice otherwise), the rest are scans that
+    need Vision. Returns counts per kind.
+    """
+    rng = random.Random(seed)
+    counts = {"xml": 0, "vision": 0}
+    for n in range(files):
+        folder = os.path.join(directory, f"lote_{n % folders:03d}") if folders > 1 else directory
+        os.makedirs(folder, exist_ok=True)
+        number = f"FE{100000 + n}"
+        if rng.random() < xml_ratio:
+            _document(os.path.join(folder, f"{number}.pdf"), seed * 1000003 + n, image_side)
+            build = attached_document_xml if rng.random() < attached_ratio else invoice_xml
+            with open(os.path.join(folder, f"{number}.xml"), "w", encoding="utf-8") as f:
+                f.write(build(number, rng, lines, padding_kb))
+            counts["xml"] += 1
+        else:
+            extension = ".pdf" if rng.random() < 0.5 else ".jpg"
+            _document(os.path.join(folder, f"scan_{n:06d}{extension}"), seed * 1000003 + n, image_side)
+            counts["vision"] += 1
+    return counts
+
+
+# --- Local Gemini stand-in ------------------------------------------------------
+
+class FakeRateLimitError(Exception):
+    """Looks like the SDK's 429 to rate_limiter.is_rate_limit_error."""
+    code = 429
+
+
+class FakeGenAI:
+    """
+    Stand-in for genai.Client with the surface VisionSkill uses (models /
+    files on .aio). Each generate_content call sleeps latency_ms
+    (+/- jitter_ms), fails with a 429 with probability rate_429, and returns
+    malformed JSON with probability malformed_rate. Batched requests get
+    one object per "DOCUMENTO <n>" marker.
+    """
+
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 200, rate_429: float = 0.0,
+                 malformed_rate: float = 0.0, retry_delay: float = 1.0, upload_ms: float = 300,
+                 seed: int = 1):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_429 = rate_429
+        self.malformed_rate = malformed_rate
+        self.retry_delay = retry_delay
+        self.upload = upload_ms / 1000
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.documents = 0
+        self.rate_limited = 0
+        self.malformed = 0
+        self.uploads = 0
+        self.latencies: List[float] = []
+
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self._generate),
+            files=SimpleNamespace(upload=self._upload, get=self._get_async, delete=self._delete),
+        )
+
+    async def _generate(self, model: str, contents: list, config=None):
+        started = time.perf_counter()
+        delay, response = self._answer(contents)
+        await asyncio.sleep(delay)
+        self.latencies.append(time.perf_counter() - started)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def _answer(self, contents: list):
+        self.calls += 1
+        delay = max(0.0, self.rng.uniform(self.latency - self.jitter, self.latency + self.jitter))
+        if self.rng.random() < self.rate_429:
+            self.rate_limited += 1
+            return 0.05, FakeRateLimitError(
+                f"429 RESOURCE_EXHAUSTED. Please retry in {self.retry_delay}s. "
+                f"{{'retryDelay': '{self.retry_delay}s'}}"
+            )
+
+        markers = [c for c in contents if isinstance(c, str) and c.startswith("DOCUMENTO ")]
+        self.documents += max(len(markers), 1)
+        if self.rng.random() < self.malformed_rate:
+            self.malformed += 1
+            return delay, self._response('{"proveedor_nombre": "PROVEEDOR, "total": ', markers)
+
+        if markers:
+            items = []
+            for i, marker in enumerate(markers, start=1):
+                item = self._invoice()
+                item.update(documento=i, archivo=marker.split("archivo: ", 1)[1])
+                items.append(item)
+            return delay, self._response(json.dumps(items, ensure_ascii=False), markers)
+        return delay, self._response(json.dumps(self._invoice(), ensure_ascii=False), markers)
+
+    def _response(self, text: str, markers: list):
+        # Rough usage_metadata: ~258 tokens per image page plus the prompt, ~4 chars per output token
+        prompt, output = 600 + 258 * max(len(markers), 1), len(text) // 4
+        usage = SimpleNamespace(prompt_token_count=prompt, candidates_token_count=output,
+                                total_token_count=prompt + output)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def _invoice(self) -> Dict:
+        rng = self.rng
+        nit = str(rng.randint(800000000, 999999999))
+        base = rng.randint(10000, 5000000)
+        return {
+            "proveedor_nombre": f"PROVEEDOR {rng.randint(1, 9999)} S.A.S.",
+            "proveedor_nit": f"{nit}-{calculate_nit_verification_digit(nit)}",
+            "proveedor_direccion": f"Calle {rng.randint(1, 200)} # {rng.randint(1, 99)}-{rng.randint(1, 99)}",
+            "proveedor_telefono": f"60{rng.randint(10000000, 99999999)}",
+            "proveedor_ciudad": rng.choice(CITIES),
+            "factura_numero": f"FV{rng.randint(1000, 99999)}",
+            "fecha_emision": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "fecha_vencimiento": None,
+            "descripcion_general": rng.choice(ITEMS),
+            "moneda": "COP",
+            "base_imponible": f"{base:,}".replace(",", "."),
+            "impuestos": f"{int(base * 0.19):,}".replace(",", "."),
+            "total": f"{int(base * 1.19):,}".replace(",", "."),
+            "cufe": None,
+        }
+
+    def _remote_file(self, name: str):
+        return SimpleNamespace(name=name, uri=f"https://fake.invalid/{name}", mime_type="image/png",
+                               state=SimpleNamespace(name="ACTIVE"))
+
+    async def _upload(self, file=None, config=None):
+        self.uploads += 1
+        await asyncio.sleep(self.upload)
+        return self._remote_file(f"files/fake-{self.uploads}")
+
+    async def _get_async(self, name: str):
+        return self._remote_file(name)
+
+    async def _delete(self, name: str):
+        return None
+
+
+# --- Stage probes ---------------------------------------------------------------
+
+class StageProbe:
+    """
+    Times selected methods during the run by wrapping them on their class
+    (restored afterwards), so the application code is measured unmodified.
+    """
+
+    STAGES = [
+        ("local", InvoiceProcessor, "_process_local"),
+        ("xml_lane", InvoiceProcessor, "process_xml_lane"),
+        ("vision_file", InvoiceProcessor, "process_file"),
+        ("vision_batch", InvoiceProcessor, "process_batch"),
+        ("zip_member", InvoiceProcessor, "process_member"),
+        ("persist", ResultStore, "append"),
+        ("manifest", Manifest, "record"),
+        ("export", ResultStore, "export_excel"),
+    ]
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {stage: [] for stage, _, _ in self.STAGES}
+        self._originals = []
+
+    def __enter__(self):
+        for stage, owner, name in self.STAGES:
+            original = getattr(owner, name)
+            self._originals.append((owner, name, original))
+            setattr(owner, name, self._wrap(stage, original))
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original in self._originals:
+            setattr(owner, name, original)
+
+    def _wrap(self, stage: str, func):
+        samples = self.samples[stage]
+        if asyncio.iscoroutinefunction(func):
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - started)
+        else:
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - started)
+        return timed
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0..100), None for no samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Peak resident memory of this process and of its (finished) children, e.g. the XML pool."""
+    if resource is None:
+        return {"self": None, "children": None}
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+# --- Runner ---------------------------------------------------------------------
+
+async def run_benchmark(args, main_args: List[str]) -> Dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="facturas_bench_")
+    input_dir = os.path.join(workdir, "input")
+    output_file = os.path.join(workdir, "bench.xlsx")
+    if not args.keep_corpus and os.path.exists(input_dir):
+        shutil.rmtree(input_dir)
+
+    started = time.perf_counter()
+    if os.path.exists(input_dir):
+        corpus = {"xml": None, "vision": None}
+    else:
+        corpus = generate_corpus(input_dir, args.files, args.xml_ratio, args.attached_ratio,
+                                 args.lines, args.padding_kb, args.image_side, args.folders, args.seed)
+    corpus_seconds = time.perf_counter() - started
+
+    client = FakeGenAI(args.latency_ms, args.jitter_ms, args.rate_429, args.malformed_rate,
+                       args.retry_delay, args.upload_ms, args.seed)
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    argv = ["--input_dir", input_dir, "--output_file", output_file, "--reset", "--no_cache",
+            "--no_archive", "--rpm", str(args.rpm), "--concurrency", str(args.concurrency)] + main_args
+
+    log = sys.stdout if args.verbose else io.StringIO()
+    with StageProbe() as probe, contextlib.redirect_stdout(log):
+        started = time.perf_counter()
+        await app.main(argv, client=client)
+        elapsed = time.perf_counter() - started
+
+    state_dir = os.path.join(workdir, ".facturas_state")
+    store = ResultStore(os.path.join(state_dir, "results.sqlite"))
+    rows = store.count()
+    successful = len([r for r in store.records() if str(r.get("estado") or "").startswith("EXITOSO")])
+    store.close()
+    store_bytes = sum(os.path.getsize(os.path.join(state_dir, name)) for name in os.listdir(state_dir)
+                      if name.startswith("results.sqlite"))
+    xlsx_bytes = os.path.getsize(output_file) if os.path.exists(output_file) else 0
+    # Instrumentation of the run itself (telemetry.py): tokens, 429s, retries
+    summary_path = os.path.join(state_dir, "metrics", "summary.json")
+    telemetry = None
+    if os.path.exists(summary_path):
+        with open(summary_path, encoding="utf-8") as f:
+            telemetry = json.load(f)
+
+    stages = {}
+    for stage, samples in probe.samples.items():
+        if samples:
+            stages[stage] = {
+                "count": len(samples),
+                "total_s": sum(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+            }
+    if client.latencies:
+        stages["gemini_call"] = {
+            "count": len(client.latencies),
+            "total_s": sum(client.latencies),
+            "p50_ms": percentile(client.latencies, 50) * 1000,
+            "p95_ms": percentile(client.latencies, 95) * 1000,
+        }
+
+    persist = stages.get("persist", {})
+    export = stages.get("export", {})
+    report = {
+        "files": args.files,
+        "corpus": corpus,
+        "corpus_seconds": corpus_seconds,
+        "elapsed_s": elapsed,
+        "files_per_s": rows / elapsed if elapsed else None,
+        "rows": rows,
+        "successful": successful,
+        "gemini": {
+            "calls": client.calls,
+            "documents": client.documents,
+            "rate_limited": client.rate_limited,
+            "malformed": client.malformed,
+            "uploads": client.uploads,
+        },
+        "stages": stages,
+        "persistence": {
+            "store_bytes": store_bytes,
+            "xlsx_bytes": xlsx_bytes,
+            "append_ms_per_row": persist.get("total_s", 0) * 1000 / rows if rows else None,
+            "export_s": export.get("total_s"),
+            "export_us_per_xlsx_kb": export.get("total_s", 0) * 1e6 / (xlsx_bytes / 1024) if xlsx_bytes else None,
+        },
+        "telemetry": telemetry,
+        "peak_rss_mb": peak_rss_mb(),
+        "workdir": workdir,
+        "args": vars(args),
+        "main_args": argv,
+    }
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def print_report(report: Dict):
+    g = report["gemini"]
+    print(f"Files: {report['rows']} rows ({report['successful']} successful) in {report['elapsed_s']:.2f}s "
+          f"-> {report['files_per_s']:.1f} files/s")
+    print(f"Corpus: {report['corpus']} generated in {report['corpus_seconds']:.1f}s")
+    print(f"Gemini stand-in: {g['calls']} calls for {g['documents']} documents, {g['rate_limited']} x 429, "
+          f"{g['malformed']} malformed, {g['uploads']} uploads")
+    print(f"{'stage':<14}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<14}{s['count']:>8}{s['total_s']:>10.2f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}")
+    p = report["persistence"]
+    append = f"{p['append_ms_per_row']:.3f} ms/row" if p["append_ms_per_row"] is not None else "n/a"
+    export = f"{p['export_s']:.2f}s" if p["export_s"] is not None else "n/a"
+    print(f"Persistence: store {p['store_bytes'] / 1024:.0f} KB ({append}), "
+          f"Excel {p['xlsx_bytes'] / 1024:.0f} KB (export {export})")
+    t = report["telemetry"]
+    if t:
+        c = t["counters"]
+        print(f"Telemetry: {t['tokens']['total']} tokens, {c.get('retries', 0)} retries, "
+              f"{c.get('json_failed', 0)} unparsable answers")
+    rss = report["peak_rss_mb"]
+    if rss["self"] is not None:
+        print(f"Peak RSS: {rss['self']:.0f} MB (XML pool processes: {rss['children']:.0f} MB)")
+
+
+def main():
+    argv = sys.argv[1:]
+    main_args = []
+    if "--" in argv:
+        index = argv.index("--")
+        argv, main_args = argv[:index], argv[index + 1:]
+
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark (synthetic corpus, fake Gemini)")
+    parser.add_argument("--files", type=int, default=200, help="Invoices in the synthetic corpus")
+    parser.add_argument("--xml_ratio", type=float, default=0.5, help="Share of invoices with a companion DIAN XML")
+    parser.add_argument("--attached_ratio", type=float, default=0.5, help="Share of those XML that are AttachedDocument containers")
+    parser.add_argument("--lines", type=int, default=5, help="InvoiceLine elements per XML invoice")
+    parser.add_argument("--padding_kb", type=int, default=0, help="Filler KB per XML (stands in for the signature)")
+    parser.add_argument("--image_side", type=int, default=600, help="Width in pixels of the generated scans")
+    parser.add_argument("--folders", type=int, default=1, help="Spread the corpus over this many subfolders")
+    parser.add_argument("--latency_ms", type=float, default=800, help="Mean generate_content latency")
+    parser.add_argument("--jitter_ms", type=float, default=200, help="Latency jitter (uniform +/-)")
+    parser.add_argument("--upload_ms", type=float, default=300, help="Latency of files.upload")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Probability that a call fails with 429")
+    parser.add_argument("--retry_delay", type=float, default=1.0, help="retryDelay reported with each 429, in seconds")
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help="Probability of a malformed JSON answer")
+    parser.add_argument("--rpm", type=float, default=600, help="Passed to main.py --rpm")
+    parser.add_argument("--concurrency", type=int, default=16, help="Passed to main.py --concurrency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", type=str, default=None, help="Keep the corpus and outputs here (default: temporary, deleted)")
+    parser.add_argument("--keep_corpus", action="store_true", help="Reuse the corpus already in --workdir")
+    parser.add_argument("--json", type=str, default=None, help="Also write the report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show main.py output")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmark(args, main_args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
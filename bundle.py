@@ -0,0 +1,142 @@
+import io
+import os
+import re
+import hashlib
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+from xml_skill import XmlSkill
+from text_skill import TextLayerSkill
+
+# Members that are invoice documents (sent to Vision if no XML covers them)
+DOCUMENT_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+
+
+def is_bundle(file_path: str) -> bool:
+    return file_path.lower().endswith(".zip")
+
+
+def member_label(zip_path: str, member: str) -> str:
+    """Path-like name of a ZIP member, used for display, the store and the manifest."""
+    return os.path.join(zip_path, member)
+
+
+def list_members(zf: zipfile.ZipFile) -> Tuple[List[str], List[str]]:
+    """Returns (xml members, document members), skipping folders and macOS metadata."""
+    xmls, documents = [], []
+    for info in zf.infolist():
+        name = info.filename
+        if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("._"):
+            continue
+        lower = name.lower()
+        if lower.endswith(".xml"):
+            xmls.append(name)
+        elif lower.endswith(DOCUMENT_EXTENSIONS):
+            documents.append(name)
+    return xmls, documents
+
+
+def scan_bundle(zip_path: str, with_hash: bool = False) -> Dict:
+    """
+    Reads a DIAN bundle (ZIP with PDF + AttachedDocument XML) without
+    extracting it to disk: XML members are streamed straight from the
+    archive, PDFs are read into memory only to look for the invoice's CUFE
+    or number in their text layer.
+
+    Runs in a worker process (XML lane). Returns:
+        {"invoices": [(member, xml data, sha256 of the paired document or None)],
+         "pending": [document members no XML accounts for]}
+    Each XML invoice is returned under the member of the document it was
+    paired with (or under its own XML member when unpaired).
+    """
+    xml_skill = XmlSkill()
+    text_skill = TextLayerSkill()
+
+    with zipfile.ZipFile(zip_path) as zf:
+        xml_members, documents = list_members(zf)
+
+        invoices = []
+        for member in xml_members:
+            with zf.open(member) as f:
+                data = xml_skill.extract_stream(f, os.path.basename(member))
+            if data:
+                invoices.append((member, data))
+
+        contents = {}
+        texts = {}
+        if invoices:
+            for member in documents:
+                contents[member] = zf.read(member)
+                if member.lower().endswith(".pdf") and text_skill.available:
+                    try:
+                        texts[member] = text_skill.extract_text(io.BytesIO(contents[member]))
+                    except Exception as e:
+                        print(f"   could not read text of {member} in {os.path.basename(zip_path)}: {e}")
+
+    pairs = pair_documents([data for _, data in invoices], documents, texts)
+
+    result = {"invoices": [], "pending": []}
+    for i, (xml_member, data) in enumerate(invoices):
+        document = pairs.get(i)
+        sha256 = None
+        if document is not None and with_hash:
+            sha256 = hashlib.sha256(contents[document]).hexdigest()
+        result["invoices"].append((document or xml_member, data, sha256))
+
+    paired = set(pairs.values())
+    result["pending"] = [m for m in documents if m not in paired]
+    return result
+
+
+def pair_documents(invoices: List[Dict], documents: List[str], texts: Dict[str, str]) -> Dict[int, str]:
+    """
+    Matches XML invoices to documents by content, not by file name:
+    1. CUFE (96 hex chars) found in the document's text layer.
+    2. Invoice number found in exactly one document's text.
+    3. If exactly one invoice and one document are left (e.g. a scanned
+       PDF without text), they are paired.
+    Returns {invoice index: document member}.
+    """
+    pairs = {}
+    compact = {m: re.sub(r"\s+", "", t).lower() for m, t in texts.items()}
+    flat = {m: re.sub(r"\s+", " ", t) for m, t in texts.items()}
+
+    for i, data in enumerate(invoices):
+        cufe = (data.get("cufe") or "").lower()
+        if len(cufe) < 20:
+            continue
+        for member, text in compact.items():
+            if member not in pairs.values() and cufe in text:
+                pairs[i] = member
+                break
+
+    for i, data in enumerate(invoices):
+        number = data.get("factura_numero")
+        if i in pairs or not number:
+            continue
+        pattern = re.compile(r"(?<![A-Za-z0-9])" + re.escape(number) + r"(?![0-9])")
+        matches = [m for m, text in flat.items() if m not in pairs.values() and pattern.search(text)]
+        if len(matches) == 1:
+            pairs[i] = matches[0]
+
+    left_invoices = [i for i in range(len(invoices)) if i not in pairs]
+    left_documents = [m for m in documents if m not in pairs.values()]
+    if len(left_invoices) == 1 and len(left_documents) == 1:
+        pairs[left_invoices[0]] = left_documents[0]
+
+    return pairs
+
+
+def read_member(zip_path: str, member: str) -> bytes:
+    with zipfile.ZipFile(zip_path) as zf:
+        return zf.read(member)
+
+
+def member_mime_type(member: str) -> Optional[str]:
+    ext = os.path.splitext(member)[1].lower()
+    return {
+        '.pdf': 'application/pdf',
+        '.jpg': 'image/jpeg',
+        '.jpeg': 'image/jpeg',
+        '.png': 'image/png',
+    }.get(ext)
@@ -0,0 +1,117 @@
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+# Hex runs that may hold a CUFE; a prefix such as "fa" or "ad" is hex too
+HEX_RUN = re.compile(r"[0-9a-f]{96,}")
+
+
+def normalize_key(text: str) -> str:
+    """'FE-1234' / 'fe_1234' / 'FE 1234' -> 'fe1234'"""
+    return re.sub(r"[^0-9a-z]", "", str(text).lower())
+
+
+class CompanionIndex:
+    """
+    Index of the XML files found while scanning input_dir, used to find the
+    DIAN XML that belongs to an invoice without probing the filesystem.
+    Keys are the normalized file stem (per directory) and, once the XML
+    files have been parsed (add_invoice), the invoice number and CUFE, so
+    FE-1234.pdf can be matched to ad0900123456000....xml.
+    Each XML is assigned to at most one document.
+    """
+
+    def __init__(self):
+        self.by_stem: Dict[Tuple[str, str], str] = {}
+        self.by_number: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        self.by_cufe: Dict[str, str] = {}
+        self.xml_files: List[str] = []
+        self._registered: Set[str] = set()
+        self.parsed: Set[str] = set()
+        self.assigned: Dict[str, str] = {}
+        self._claimed: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.xml_files)
+
+    def add_xml(self, xml_path: str):
+        """Registers an XML file seen during the directory scan (no I/O)."""
+        if xml_path in self._registered:
+            # Reported again by --watch (rewritten in place)
+            return
+        self._registered.add(xml_path)
+        self.xml_files.append(xml_path)
+        directory, name = os.path.split(xml_path)
+        self.by_stem.setdefault((directory, normalize_key(os.path.splitext(name)[0])), xml_path)
+
+    def add_invoice(self, xml_path: str, data: Dict):
+        """Indexes the content of a parsed XML: invoice number (with NIT) and CUFE."""
+        self.parsed.add(xml_path)
+        number = data.get("factura_numero")
+        if number:
+            nit = normalize_key(str(data.get("nit") or "").split("-")[0]) or None
+            self.by_number.setdefault(normalize_key(number), []).append((xml_path, nit))
+        cufe = str(data.get("cufe") or "").lower()
+        if cufe:
+            self.by_cufe[cufe] = xml_path
+
+    def is_claimed(self, xml_path: str) -> bool:
+        return xml_path in self._claimed
+
+    def unclaimed(self) -> List[str]:
+        """XML files not assigned to any document yet and not parsed."""
+        return [x for x in self.xml_files if x not in self._claimed and x not in self.parsed]
+
+    def lookup(self, file_path: str) -> Optional[str]:
+        """
+        XML for a document, by name only:
+        1. Same directory and same normalized stem (factura.pdf / factura.xml).
+        2. Stem equal to the invoice number of exactly one parsed XML,
+           preferring the same directory.
+        3. Stem containing the CUFE of a parsed XML.
+        """
+        if file_path in self.assigned:
+            return self.assigned[file_path]
+
+        directory, name = os.path.split(file_path)
+        stem = normalize_key(os.path.splitext(name)[0])
+
+        xml_path = self.by_stem.get((directory, stem))
+        if xml_path is None:
+            candidates = [x for x, _ in self.by_number.get(stem, []) if x not in self._claimed]
+            same_dir = [x for x in candidates if os.path.dirname(x) == directory]
+            if len(same_dir) == 1:
+                xml_path = same_dir[0]
+            elif len(candidates) == 1:
+                xml_path = candidates[0]
+        if xml_path is None and self.by_cufe:
+            for run in HEX_RUN.findall(stem):
+                xml_path = next((self.by_cufe[run[i:i + 96]] for i in range(len(run) - 95)
+                                 if run[i:i + 96] in self.by_cufe), None)
+                if xml_path is not None:
+                    break
+
+        return self._assign(file_path, xml_path)
+
+    def lookup_content(self, file_path: str, cufe: Optional[str] = None,
+                       number: Optional[str] = None, nit: Optional[str] = None) -> Optional[str]:
+        """
+        XML for a document by what was read from it (e.g. its PDF text
+        layer): CUFE first, then invoice number, narrowed by the NIT.
+        """
+        xml_path = self.by_cufe.get(str(cufe or "").lower())
+        if xml_path is None and number:
+            candidates = [(x, n) for x, n in self.by_number.get(normalize_key(number), []) if x not in self._claimed]
+            if nit:
+                nit_key = normalize_key(str(nit).split("-")[0])
+                candidates = [(x, n) for x, n in candidates if n is None or n == nit_key]
+            if len(candidates) == 1:
+                xml_path = candidates[0][0]
+        return self._assign(file_path, xml_path)
+
+    def _assign(self, file_path: str, xml_path: Optional[str]) -> Optional[str]:
+        if xml_path is None or xml_path in self._claimed:
+            return None
+        self._claimed.add(xml_path)
+        self.assigned[file_path] = xml_path
+        return xml_path
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import sqlite3
+from typing import Dict, Optional
+
+# Long runs (--watch) evict again after this many puts or this many seconds
+EVICT_EVERY_PUTS = 500
+EVICT_INTERVAL_SECONDS = 3600
+
+
+class ExtractionCache:
+    """
+    Persistent, content-addressed cache of extraction results.
+    Entries are keyed by the SHA-256 of the input file, so a renamed or copied
+    invoice is recognised and never sent to Gemini twice.
+    """
+
+    def __init__(self, db_path: str, max_size_mb: float = 200.0, max_age_days: float = 180.0):
+        self.db_path = db_path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else 0
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else 0
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._evicted_at = 0.0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                sha256 TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                model TEXT,
+                prompt_version TEXT,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+        self.evict()
+
+    def get(self, sha256: str, model: str, prompt_version: str) -> Optional[Dict]:
+        """
+        Returns the cached (mapped, not yet normalized) dict for this hash.
+        Vision results only count as a hit when they were produced with the
+        current model and prompt version; XML results never go stale.
+        """
+        row = self.conn.execute(
+            "SELECT source, model, prompt_version, data, created_at FROM extractions WHERE sha256 = ?",
+            (sha256,),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        source, cached_model, cached_prompt, data, created_at = row
+        expired = self.max_age_seconds and time.time() - created_at > self.max_age_seconds
+        stale = source == "vision" and (cached_model != model or cached_prompt != prompt_version)
+        if expired or stale:
+            self.misses += 1
+            return None
+
+        self.conn.execute("UPDATE extractions SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+        self.conn.commit()
+        self.hits += 1
+        return json.loads(data)
+
+    def put(self, sha256: str, data: Dict, source: str, model: Optional[str] = None,
+            prompt_version: Optional[str] = None):
+        """Stores an extraction result, replacing any previous entry for the hash."""
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        now = time.time()
+        self.conn.execute(
+            """
+            INSERT OR REPLACE INTO extractions
+                (sha256, source, model, prompt_version, data, size, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (sha256, source, model, prompt_version, payload, len(payload), now, now),
+        )
+        self.conn.commit()
+        self._puts += 1
+        if self._puts >= EVICT_EVERY_PUTS or time.monotonic() - self._evicted_at >= EVICT_INTERVAL_SECONDS:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops entries older than max_age_days, then the least recently used
+        entries until the cache fits in max_size_mb.
+        """
+        if self.max_age_seconds:
+            self.conn.execute(
+                "DELETE FROM extractions WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,),
+            )
+
+        if self.max_size_bytes:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+            if total > self.max_size_bytes:
+                rows = self.conn.execute("SELECT sha256, size FROM extractions ORDER BY last_access ASC")
+                to_delete = []
+                for sha256, size in rows:
+                    if total <= self.max_size_bytes:
+                        break
+                    to_delete.append((sha256,))
+                    total -= size
+                self.conn.executemany("DELETE FROM extractions WHERE sha256 = ?", to_delete)
+
+        self.conn.commit()
+        self._puts = 0
+        self._evicted_at = time.monotonic()
+
+    def close(self):
+        self.evict()
+        self.conn.close()
@@ -0,0 +1,231 @@
+import time
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from rate_limiter import RateLimiter
+
+# Key file / GOOGLE_API_KEYS entries of this form use Vertex AI with the
+# project's credentials instead of an API key: vertex:<project>[:<location>]
+VERTEX_PREFIX = "vertex:"
+DEFAULT_VERTEX_LOCATION = "us-central1"
+# A call whose files were uploaded with one key waits at most this long for
+# that key; after that uploading again with a free key is cheaper
+PREFER_WAIT_SECONDS = 15.0
+
+
+def parse_key_entries(text: str) -> List[str]:
+    """API keys / vertex projects separated by commas or newlines; '#' starts a comment."""
+    entries = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        entries.extend(part.strip() for part in line.split(",") if part.strip())
+    # The same key twice would share one quota while being budgeted twice
+    return list(dict.fromkeys(entries))
+
+
+def key_label(entry: str) -> str:
+    """Name shown in logs and summaries (never the whole key)."""
+    if entry.startswith(VERTEX_PREFIX):
+        return entry[len(VERTEX_PREFIX):].split(":", 1)[0]
+    return f"key…{entry[-4:]}"
+
+
+def make_client(entry: str):
+    from google import genai
+
+    if entry.startswith(VERTEX_PREFIX):
+        project, _, location = entry[len(VERTEX_PREFIX):].partition(":")
+        return genai.Client(vertexai=True, project=project, location=location or DEFAULT_VERTEX_LOCATION)
+    return genai.Client(api_key=entry)
+
+
+class KeySlot:
+    """One API key (or project): its client and its own quota budget."""
+
+    def __init__(self, label: str, client, limiter: RateLimiter):
+        self.label = label
+        self.client = client
+        self.limiter = limiter
+        self.in_flight = 0
+        # Calls whose files were uploaded with this key ahead of their lease
+        self.promised = 0
+
+    @property
+    def free(self) -> bool:
+        return self.in_flight < self.limiter.concurrency
+
+
+class KeyPool:
+    """
+    Spreads Gemini calls over several API keys / projects, each with an
+    independent RateLimiter (RPM, TPM, concurrency, 429 cooldown).
+
+    Drop-in for RateLimiter: acquire() hands out a lease on whichever key
+    has budget right now, preferring the least loaded one, and the lease
+    carries that key's client (an uploaded file only exists for the key
+    that uploaded it, so one call never mixes keys). A key cooling down
+    after a 429 simply stops being picked while the others keep working.
+    """
+
+    def __init__(self, slots: List[KeySlot]):
+        if not slots:
+            raise ValueError("KeyPool needs at least one key")
+        self.slots = slots
+        self._lock = asyncio.Lock()
+        # Replaced on every change, so a waiter never misses one (see _notify)
+        self._changed = asyncio.Event()
+
+    @classmethod
+    def from_entries(cls, entries: List[str], rpm: float = 4, tpm: float = 0, concurrency: int = 1,
+                     client=None) -> "KeyPool":
+        """
+        One slot per entry, each with the given per-key budget. client: use
+        this client for every key instead of building one (tests, benchmark).
+        """
+        slots = []
+        for entry in entries:
+            label = key_label(entry)
+            limiter = RateLimiter(rpm=rpm, tpm=tpm, concurrency=concurrency, name=label)
+            slots.append(KeySlot(label, client if client is not None else make_client(entry), limiter))
+        return cls(slots)
+
+    @property
+    def concurrency(self) -> int:
+        return sum(slot.limiter.concurrency for slot in self.slots)
+
+    @property
+    def requests(self) -> int:
+        return sum(slot.limiter.requests for slot in self.slots)
+
+    @property
+    def rate_limited(self) -> int:
+        return sum(slot.limiter.rate_limited for slot in self.slots)
+
+    @property
+    def effective_rpm(self) -> float:
+        return sum(slot.limiter.effective_rpm for slot in self.slots)
+
+    def acquire(self, tokens: int = 0, prefer: Optional[str] = None) -> "KeyLease":
+        """
+        Same protocol as RateLimiter.acquire; the lease also has .client and
+        .label. prefer: label from upload_target(); the call waits for that
+        key, where its files are already uploaded, unless it is cooling down
+        or stays busy for PREFER_WAIT_SECONDS (then any free key will do).
+        """
+        return KeyLease(self, tokens, prefer)
+
+    def upload_target(self) -> Tuple[Optional[str], object]:
+        """
+        (label, client) of the key that a call about to wait for a lease
+        should upload its files with: the least loaded one, counting the
+        calls already promised to each key.
+        """
+        slot = min(self.slots, key=self._load)
+        slot.promised += 1
+        return slot.label, slot.client
+
+    def summary(self, tokens: Optional[Dict[str, Dict]] = None) -> str:
+        """Per-key usage; tokens: {label: {"total": n, ...}} from Telemetry.keys."""
+        now = time.monotonic()
+        lines = []
+        for slot in self.slots:
+            limiter = slot.limiter
+            line = (f"  {slot.label}: {limiter.requests} calls, {limiter.rate_limited} x 429, "
+                    f"rate {limiter.effective_rpm:.1f}/{limiter.rpm:g} RPM")
+            used = (tokens or {}).get(slot.label)
+            if used:
+                line += f", {used.get('total', 0)} tokens"
+            if limiter.cooldown_until > now:
+                line += f", cooling down {limiter.cooldown_until - now:.0f}s"
+            lines.append(line)
+        return "\n".join(lines)
+
+    async def _take(self, tokens: int, prefer: Optional[str] = None) -> KeySlot:
+        deadline = time.monotonic() + PREFER_WAIT_SECONDS if prefer is not None else None
+        while True:
+            # One waiter at a time picks a key (FIFO), but nobody sleeps
+            # holding the lock: a call waiting for its preferred key must not
+            # keep the others from free keys
+            async with self._lock:
+                if deadline is not None and time.monotonic() >= deadline:
+                    prefer = deadline = None
+                wait = None
+                for slot in sorted(self._candidates(prefer), key=self._load):
+                    slot_wait = slot.limiter._reserve(tokens)
+                    if slot_wait <= 0:
+                        slot.in_flight += 1
+                        return slot
+                    wait = slot_wait if wait is None else min(wait, slot_wait)
+                changed = self._changed
+            if deadline is not None:
+                left = max(0.0, deadline - time.monotonic())
+                wait = left if wait is None else min(wait, left)
+            # Sleep until a key's budget refills, or a call ends (a
+            # concurrency slot frees up) or a key is rate limited
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _candidates(self, prefer: Optional[str] = None) -> List[KeySlot]:
+        # A call whose files went to one key waits for that key, unless it is
+        # cooling down after a 429 (then uploading again elsewhere is cheaper)
+        now = time.monotonic()
+        for slot in self.slots:
+            if slot.label == prefer and slot.limiter.cooldown_until <= now:
+                return [slot] if slot.free else []
+        return [slot for slot in self.slots if slot.free]
+
+    @staticmethod
+    def _load(slot: KeySlot) -> Tuple[float, float]:
+        # Least busy first, then the one with the most request budget left
+        return (slot.in_flight + slot.promised) / slot.limiter.concurrency, -slot.limiter._request_tokens
+
+    def _release(self, slot: KeySlot, success: bool):
+        slot.in_flight -= 1
+        if success:
+            slot.limiter._on_success()
+        self._notify()
+
+    def _notify(self):
+        # Wakes every waiter of the current event; later waiters get a new one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class KeyLease:
+    """Lease on one key of a KeyPool for a single API call."""
+
+    def __init__(self, pool: KeyPool, tokens: int, prefer: Optional[str] = None):
+        self.pool = pool
+        self.tokens = tokens
+        self.prefer = prefer
+        self.slot: Optional[KeySlot] = None
+        self._rate_limited = False
+
+    @property
+    def client(self):
+        return self.slot.client
+
+    @property
+    def label(self) -> str:
+        return self.slot.label
+
+    def report_rate_limited(self, retry_delay: Optional[float] = None):
+        self._rate_limited = True
+        self.slot.limiter._on_rate_limited(retry_delay)
+        self.pool._notify()
+
+    async def __aenter__(self) -> "KeyLease":
+        try:
+            self.slot = await self.pool._take(self.tokens, self.prefer)
+        finally:
+            if self.prefer is not None:
+                for slot in self.pool.slots:
+                    if slot.label == self.prefer:
+                        slot.promised -= 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool._release(self.slot, exc_type is None and not self._rate_limited)
+        return False
@@ -2,6 +2,7 @@ import asyncio
 import argparse
 import os
 import sys
+import signal
 import time
 import subprocess
 from dotenv import load_dotenv
@@ -10,132 +11,289 @@ load_dotenv()
 
 # Keep Mac awake while this script is running (only on macOS).
 # This uses `caffeinate -w <pid>` so the assertion ends when this process ends.
-if sys.platform == "darwin":
+# Not in XML lane worker processes, which re-import this module on macOS.
+if sys.platform == "darwin" and __name__ == "__main__":
     try:
         subprocess.Popen(["caffeinate", "-di", "-w", str(os.getpid())])
     except Exception as e:
         print(f"Warning: could not start caffeinate: {e}")
 
 from processor import InvoiceProcessor
-from utils import setup_directories, save_to_excel
+from vision_skill import DEFAULT_MODEL, PROMPT_VERSION
+from near_duplicates import NearDuplicateIndex
+from companion_index import CompanionIndex
+from pipeline import Pipeline, SELECT_PENDING, SELECT_FAILED, SELECT_NEW, SELECT_ALL
+from watcher import DirectoryWatcher
+from extraction_cache import ExtractionCache
+from remote_files import RemoteFileCache
+from response_archive import ResponseArchive
+from rate_limiter import RateLimiter
+from key_pool import KeyPool, parse_key_entries
+from preprocess import Preprocessor
+from result_store import ResultStore
+from manifest import Manifest
+from telemetry import Telemetry
+from utils import setup_directories, get_state_dir
 
-async def main():
+async def main(argv=None, client=None):
+    """
+    argv: command-line arguments (default sys.argv). client: genai client to
+    use instead of a real one (benchmark.py passes a local stand-in).
+    """
     parser = argparse.ArgumentParser(description="Async Invoice Processor")
     parser.add_argument("--input_dir", type=str, default="invoices_input", help="Directory containing invoices")
     parser.add_argument("--output_file", type=str, default="gastos_2026.xlsx", help="Output Excel file")
-    parser.add_argument("--reset", action="store_true", help="Delete existing output file and start from scratch")
-    args = parser.parse_args()
+    parser.add_argument("--reset", action="store_true", help="Delete existing output file and stored results and start from scratch")
+    parser.add_argument("--export_only", action="store_true", help="Only write the Excel file from the stored results and exit")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--retry_failed", action="store_true", help="Only process files whose last attempt failed")
+    selection.add_argument("--only_new", action="store_true", help="Only process files never seen before (or modified since)")
+    parser.add_argument("--hash_check", action="store_true", help="Re-hash files whose mtime changed but size did not, before treating them as modified")
+    parser.add_argument("--no_cache", action="store_true", help="Disable the extraction cache (keyed by file hash)")
+    parser.add_argument("--cache_max_mb", type=float, default=200.0, help="Maximum size of the extraction cache in MB")
+    parser.add_argument("--cache_max_age_days", type=float, default=180.0, help="Discard cached extractions older than this")
+    parser.add_argument("--no_split", action="store_true", help="Treat every PDF as one invoice (do not look for invoice boundaries in multi-invoice bundles)")
+    parser.add_argument("--no_upload_cache", action="store_true", help="Delete every uploaded file right after its call instead of reusing it for retries and re-runs (Gemini keeps uploads 48 h)")
+    parser.add_argument("--rpm", type=float, default=4, help="Gemini requests per minute budget (free tier is ~4), per API key")
+    parser.add_argument("--tpm", type=float, default=0, help="Gemini tokens per minute budget (0 = unlimited), per API key")
+    parser.add_argument("--concurrency", type=int, default=2, help="Maximum Gemini calls in flight, per API key")
+    parser.add_argument("--models", type=str, default=DEFAULT_MODEL, help="Comma-separated Gemini model cascade, cheapest first: a document goes to the next model only if its answer fails validation (NIT DV, totals, dates, CUFE)")
+    parser.add_argument("--near_duplicates", action="store_true", help="Link rescans / re-exports of an invoice already extracted with Vision to its record instead of calling Gemini again")
+    parser.add_argument("--dup_max_distance", type=int, default=24, help="With --near_duplicates, maximum perceptual-hash distance (of 6144 bits) between first-page images")
+    parser.add_argument("--dup_min_similarity", type=float, default=0.95, help="With --near_duplicates, minimum text-layer similarity (0-1)")
+    parser.add_argument("--api_keys_file", type=str, default=None, help="File with several API keys (or vertex:<project>[:<location>]), one per line; calls are spread over them")
+    parser.add_argument("--batch_size", type=int, default=1, help="Invoices packed into each Gemini request (e.g. 5-10 for small single-page invoices)")
+    parser.add_argument("--inline_max_kb", type=int, default=1024, help="Send files up to this size inline instead of uploading them (0 = always upload)")
+    parser.add_argument("--no_text_layer", action="store_true", help="Do not try the PDF text layer before calling Vision")
+    parser.add_argument("--no_preprocess", action="store_true", help="Send files to Gemini exactly as they are on disk")
+    parser.add_argument("--max_image_side", type=int, default=2000, help="Downsample scans/photos so the longest side is at most this many pixels")
+    parser.add_argument("--trim_pages", action="store_true", help="For PDFs with 3+ pages, send only the first (header) and last (totals) page")
+    parser.add_argument("--workers", type=int, default=8, help="Files processed at the same time (Gemini calls are still capped by --concurrency)")
+    parser.add_argument("--xml_workers", type=int, default=0, help="Processes used to parse companion XML files (0 = one per CPU)")
+    parser.add_argument("--tokens_per_request", type=int, default=3000, help="Estimated tokens per Vision call, charged against --tpm")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process invoices as they arrive in input_dir (Ctrl+C to stop)")
+    parser.add_argument("--poll_interval", type=float, default=5.0, help="With --watch, seconds between folder checks when inotify is not available")
+    parser.add_argument("--force_polling", action="store_true", help="With --watch, poll the folder even on Linux (e.g. network shares, where inotify sees no remote changes)")
+    parser.add_argument("--no_archive", action="store_true", help="Do not keep the raw Gemini answers (needed by --replay)")
+    parser.add_argument("--replay", action="store_true", help="Rebuild the results of every file from the archived Gemini answers, without calling the API")
+    parser.add_argument("--metrics_dir", type=str, default=None, help="Where to write trace.jsonl (one line per file) and summary.json (default: <state dir>/metrics)")
+    parser.add_argument("--prometheus_file", type=str, default=None, help="Also write the run summary as a Prometheus textfile (node_exporter textfile collector)")
+    args = parser.parse_args(argv)
+    if args.replay and (args.watch or args.no_archive):
+        parser.error("--replay cannot be combined with --watch or --no_archive")
 
     input_dir = args.input_dir
     output_file = args.output_file
 
-    # Check for API Key
-    key = os.getenv("GOOGLE_API_KEY")
-    if not key:
+    # Results are committed one by one to a local store; the Excel file is
+    # only written from it (at the end of the run or with --export_only).
+    store_path = os.path.join(get_state_dir(output_file), "results.sqlite")
+    manifest_path = os.path.join(get_state_dir(output_file), "manifest.sqlite")
+    if args.reset:
+        for db in (store_path, manifest_path):
+            for path in (output_file, db, db + "-wal", db + "-shm"):
+                if os.path.exists(path):
+                    print(f"Resetting... Deleting existing file: {path}")
+                    os.remove(path)
+
+    store = ResultStore(store_path)
+    if store.count() == 0 and os.path.exists(output_file):
+        # Workbook from a previous version: import its rows once so they are kept
+        try:
+            imported = store.import_excel(output_file)
+            print(f"Imported {imported} rows from existing {output_file}.")
+        except Exception as e:
+            print(f"Could not read existing file, starting fresh: {e}")
+
+    if args.export_only:
+        store.export_excel(output_file)
+        store.close()
+        return
+
+    # Several keys / projects (--api_keys_file or GOOGLE_API_KEYS, comma
+    # separated) each bring their own quota; otherwise the single GOOGLE_API_KEY
+    key_entries = []
+    if args.api_keys_file and not args.replay:
+        with open(args.api_keys_file, encoding="utf-8") as f:
+            key_entries = parse_key_entries(f.read())
+        if not key_entries:
+            print(f"❌  No keys found in {args.api_keys_file}. Exiting.")
+            return
+    elif os.getenv("GOOGLE_API_KEYS") and not args.replay:
+        key_entries = parse_key_entries(os.getenv("GOOGLE_API_KEYS"))
+
+    # Check for API Key (--replay never calls the API)
+    key = key_entries[0] if key_entries else os.getenv("GOOGLE_API_KEY")
+    if not key and not args.replay:
         print("\n🔑  Please enter your Google Gemini API Key (input will be hidden): ")
         from getpass import getpass
         key = getpass("API Key: ").strip()
         
-    if not key:
+    if not key and not args.replay:
         print("❌  No key provided. Exiting.")
         return
 
     # We do NOT save it to .env as requested by user
 
-    if args.reset and os.path.exists(output_file):
-        print(f"Resetting... Deleting existing file: {output_file}")
-        os.remove(output_file)
-
     setup_directories(input_dir)
 
-    # Get list of files
-    files = []
-    for root, _, filenames in os.walk(input_dir):
-        for f in filenames:
-            if f.lower().endswith(('.pdf', '.png', '.jpg', '.jpeg')):
-                files.append(os.path.join(root, f))
+    start_time = time.time()
 
-    if not files:
-        print(f"No PDF or Image files found in {input_dir}")
-        return
+    cache = None
+    # Replay re-derives every result, so previous extractions must not be reused
+    if not args.no_cache and not args.replay:
+        cache_path = os.path.join(get_state_dir(output_file), "extraction_cache.sqlite")
+        cache = ExtractionCache(cache_path, max_size_mb=args.cache_max_mb, max_age_days=args.cache_max_age_days)
 
-    print(f"Found {len(files)} files. Starting processing...")
-    start_time = time.time()
+    # Raw Gemini answers by file hash: lets --replay apply new mapping and
+    # normalization rules without paying for the calls again
+    archive = None
+    if not args.no_archive:
+        archive = ResponseArchive(os.path.join(get_state_dir(output_file), "responses.sqlite"))
 
-    processor = InvoiceProcessor(api_key=key)
-    
-    # Load processed files to avoid re-processing
-    processed_files = set()
-    if os.path.exists(output_file):
-        try:
-            import pandas as pd
-            df = pd.read_excel(output_file)
-            if 'archivo' in df.columns and 'estado' in df.columns:
-                # Only skip files that were SUCCESSFULLY processed
-                processed_files = set(df[df['estado'] == 'EXITOSO']['archivo'].astype(str))
-            elif 'archivo' in df.columns:
-                # Fallback for old format
-                processed_files = set(df['archivo'].astype(str))
-            print(f"Resuming... {len(processed_files)} files already processed.")
-        except Exception as e:
-            print(f"Could not read existing file, starting fresh: {e}")
+    # Perceptual / text fingerprints of the invoices extracted with Vision
+    near_duplicates = None
+    if args.near_duplicates and not args.replay:
+        near_duplicates = NearDuplicateIndex(os.path.join(get_state_dir(output_file), "near_duplicates.sqlite"),
+                                             version=PROMPT_VERSION, max_distance=args.dup_max_distance,
+                                             min_similarity=args.dup_min_similarity)
 
-    # Helper to check if file should be processed
-    files_to_process = []
-    for f in files:
-        if os.path.basename(f) not in processed_files:
-            files_to_process.append(f)
-            
-    skipped_count = len(files) - len(files_to_process)
-    if skipped_count > 0:
-        print(f"Skipping {skipped_count} files already in database.")
-        
-    if not files_to_process:
-        print("All files already processed.")
-        return
+    preprocessor = None
+    if not args.no_preprocess and not args.replay:
+        preprocessor = Preprocessor(max_side=args.max_image_side, trim_pages=args.trim_pages)
 
-    total_files = len(files_to_process)
-    print(f"Starting processing of {total_files} new files...")
-    
-    # Create async tasks with concurrency limit
-    # Free tier limit is very low (approx 2-5 RPM), so we must be very conservative
-    semaphore = asyncio.Semaphore(1) 
-
-    async def safe_process(f):
-        async with semaphore:
-            res = await processor.process_file_with_retry(f) if hasattr(processor, 'process_file_with_retry') else await processor.process_file(f)
-            # Wait to respect rate limits (approx 15s delay ensures < 4 RPM)
-            await asyncio.sleep(15) 
-            return res
-
-    tasks = [safe_process(f) for f in files_to_process]
-    
-    # Process results as they complete
-    results = []
-    pending_save = []
-    completed_count = 0
-    
-    for future in asyncio.as_completed(tasks):
-        res = await future
-        completed_count += 1
-        percentage = (completed_count / total_files) * 100
-        print(f"[{completed_count}/{total_files}] {percentage:.1f}% - Processed")
-
-        if res:
-            results.append(res)
-            pending_save.append(res)
-            
-            # Incremental save every 5 files
-            if len(pending_save) >= 5:
-                print(f"Saving batch of {len(pending_save)} records...")
-                save_to_excel(pending_save, output_file)
-                pending_save = []
+    # Handles of files uploaded to Gemini: retries, the next model of the
+    # cascade and re-runs within the retention window reference them again
+    remote_files = None
+    if not args.no_upload_cache and not args.replay:
+        variant = f"{args.max_image_side}:{int(args.trim_pages)}" if preprocessor is not None else "original"
+        remote_files = RemoteFileCache(os.path.join(get_state_dir(output_file), "remote_files.sqlite"), variant=variant)
+
+    # Filled by the directory scan; XML files are looked up here instead of
+    # being probed with os.path.exists for every invoice
+    companions = CompanionIndex()
+
+    # Per-stage timings, token usage and retry / 429 counts
+    metrics_dir = args.metrics_dir or os.path.join(get_state_dir(output_file), "metrics")
+    telemetry = Telemetry(trace_path=os.path.join(metrics_dir, "trace.jsonl"))
+
+    def write_metrics():
+        telemetry.write_summary(os.path.join(metrics_dir, "summary.json"))
+        if args.prometheus_file:
+            telemetry.write_prometheus(args.prometheus_file)
+
+    if len(key_entries) > 1:
+        # Independent budget and 429 cooldown per key: a key that is rate
+        # limited stops receiving calls while the others keep going
+        limiter = KeyPool.from_entries(key_entries, rpm=args.rpm, tpm=args.tpm,
+                                       concurrency=args.concurrency, client=client)
+        client = limiter.slots[0].client
+        print(f"Spreading Gemini calls over {len(key_entries)} API keys.")
+    else:
+        limiter = RateLimiter(rpm=args.rpm, tpm=args.tpm, concurrency=args.concurrency)
+    processor = InvoiceProcessor(api_key=key, cache=cache, limiter=limiter, client=client,
+                                 tokens_per_request=args.tokens_per_request,
+                                 inline_max_bytes=args.inline_max_kb * 1024,
+                                 use_text_layer=not args.no_text_layer,
+                                 preprocessor=preprocessor,
+                                 companions=companions,
+                                 archive=archive, replay=args.replay,
+                                 telemetry=telemetry,
+                                 models=[m.strip() for m in args.models.split(",") if m.strip()],
+                                 near_duplicates=near_duplicates,
+                                 remote_files=remote_files,
+                                 split_pdfs=not args.no_split)
     
-    # Final save
-    if pending_save:
-        save_to_excel(pending_save, output_file)
-        
-    print("Processing complete.")
+    # Resume: one stat() + manifest lookup per file, keyed by relative path
+    manifest = Manifest(manifest_path, use_hash=args.hash_check)
+
+    selection = SELECT_PENDING
+    if args.replay:
+        # Every file again; new rows supersede the stored ones on export and
+        # files without an archived answer keep their current row. The real
+        # manifest is left as it is (statuses do not change).
+        print(f"Replaying {len(archive)} archived Gemini answers (no API calls).")
+        manifest.close()
+        manifest = Manifest(":memory:")
+        selection = SELECT_ALL
+    elif args.retry_failed:
+        selection = SELECT_FAILED
+    elif args.only_new:
+        selection = SELECT_NEW
+
+    # Scan, resume filter, extraction and persistence run as one streaming
+    # pipeline: the first file is processed while the folder is still being read
+    print(f"Scanning {input_dir} and processing as files are found...")
+    pipeline = Pipeline(processor, store, manifest, companions, input_dir,
+                        selection=selection, batch_size=args.batch_size,
+                        workers=args.workers, xml_workers=args.xml_workers)
+    if args.watch:
+        # Long-running: client, rate limiter, cache and process pool stay warm;
+        # the Excel file is rewritten after every batch that processed something
+        watcher = DirectoryWatcher(input_dir, poll_interval=args.poll_interval,
+                                   use_inotify=not args.force_polling)
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                # Let the batch in progress finish before exiting
+                loop.add_signal_handler(sig, watcher.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        def export(cycle: Pipeline):
+            if cycle.completed:
+                with telemetry.span("excel_export", files=()):
+                    store.export_excel(output_file)
+                write_metrics()
+
+        await pipeline.watch(watcher, on_cycle=export)
+        print("Watch stopped.")
+    else:
+        await pipeline.run()
+
+        if not pipeline.found:
+            print(f"No PDF, Image or ZIP files found in {input_dir}")
+        elif not pipeline.total:
+            print("Nothing to process.")
+        print("Processing complete.")
+
+    # One-shot export of everything stored (previous runs included)
+    with telemetry.span("excel_export", files=()):
+        store.export_excel(output_file)
+    store.close()
+    manifest.close()
+    print(f"Gemini calls: {limiter.requests}, rate limited: {limiter.rate_limited}, "
+          f"final rate: {limiter.effective_rpm:.1f} RPM.")
+    if isinstance(limiter, KeyPool):
+        print(limiter.summary(telemetry.keys))
+
+    if preprocessor is not None and preprocessor.stats["files"]:
+        print(preprocessor.summary())
+
+    if cache is not None:
+        print(f"Extraction cache: {cache.hits} hits, {cache.misses} misses.")
+        cache.close()
+
+    if remote_files is not None:
+        remote_files.close()
+
+    if archive is not None:
+        if args.replay:
+            print(f"Replay: {archive.hits} answers replayed, {archive.misses} files without an archived answer (kept as they were).")
+        archive.close()
+
+    if near_duplicates is not None:
+        print(f"Near-duplicates: {len(near_duplicates.suppressed)} files linked to an earlier invoice "
+              f"({len(near_duplicates)} invoices indexed).")
+        if near_duplicates.suppressed:
+            near_duplicates.write_report(os.path.join(metrics_dir, "near_duplicates.csv"))
+        near_duplicates.close()
+
+    write_metrics()
+    telemetry.close()
+    if telemetry.samples:
+        print(telemetry.format_summary())
+    print(f"Metrics: {metrics_dir}")
     
     elapsed = time.time() - start_time
     print(f"Total time: {elapsed:.2f} seconds")
@@ -0,0 +1,134 @@
+import os
+import time
+import sqlite3
+from typing import Dict, Optional, Tuple
+
+from utils import file_sha256
+
+# File states returned by Manifest.classify
+NEW = "new"
+CHANGED = "changed"
+DONE = "done"
+FAILED = "failed"
+
+
+class Manifest:
+    """
+    Persistent record of every input file seen, keyed by its path relative to
+    the input directory plus size and mtime (and optionally SHA-256).
+    Stores the last status and the number of attempts, so resume / skip /
+    retry decisions cost one dict lookup and one stat() per file.
+    """
+
+    def __init__(self, db_path: str, use_hash: bool = False):
+        self.db_path = db_path
+        # With use_hash, a file whose mtime changed but whose size did not is
+        # re-hashed and only counts as changed if its content really differs
+        self.use_hash = use_hash
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                ruta TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT,
+                estado TEXT,
+                nota TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+        # Loaded once; the manifest is small (one row per file)
+        self.entries: Dict[str, Tuple] = {
+            row[0]: row[1:]
+            for row in self.conn.execute("SELECT ruta, size, mtime_ns, sha256, estado, attempts FROM files")
+        }
+        self._stats: Dict[str, os.stat_result] = {}
+        # Hashes computed by classify, reused by record
+        self._hashes: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def classify(self, ruta: str, file_path: str) -> str:
+        """Returns NEW, CHANGED, DONE or FAILED for the file at file_path."""
+        st = os.stat(file_path)
+        self._stats[ruta] = st
+
+        entry = self.entries.get(ruta)
+        if entry is None:
+            return NEW
+
+        size, mtime_ns, sha256, estado, _ = entry
+        if st.st_size != size:
+            return CHANGED
+        if st.st_mtime_ns != mtime_ns:
+            if not (self.use_hash and sha256 and self._hash(ruta, file_path) == sha256):
+                return CHANGED
+            # Same content, only touched: store the new mtime so the next
+            # run does not hash it again
+            self.conn.execute("UPDATE files SET mtime_ns = ? WHERE ruta = ?", (st.st_mtime_ns, ruta))
+            self.conn.commit()
+            self.entries[ruta] = (size, st.st_mtime_ns) + entry[2:]
+        return DONE if is_successful(estado) else FAILED
+
+    def forget(self, ruta: str):
+        """Drops what classify kept for a file that will not be recorded (not selected)."""
+        self._stats.pop(ruta, None)
+        self._hashes.pop(ruta, None)
+
+    def attempts(self, ruta: str) -> int:
+        entry = self.entries.get(ruta)
+        return entry[4] if entry else 0
+
+    def record(self, ruta: str, file_path: str, estado: Optional[str], nota: Optional[str] = None,
+               sha256: Optional[str] = None):
+        """
+        Stores the outcome of one attempt and commits it. Size and mtime are
+        the ones seen by classify (before processing), so a file edited
+        while it was being processed is picked up again next run.
+        sha256: hash already computed while processing the file, if any
+        (with use_hash the file is only read again when there is none).
+        """
+        st = self._stats.pop(ruta, None) or os.stat(file_path)
+        if not self.use_hash:
+            sha256 = None
+        elif sha256 is None:
+            sha256 = self._hash(ruta, file_path)
+        self._hashes.pop(ruta, None)
+        entry = self.entries.get(ruta)
+        attempts = 1
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            attempts = entry[4] + 1
+
+        self.conn.execute(
+            """
+            INSERT OR REPLACE INTO files (ruta, size, mtime_ns, sha256, estado, nota, attempts, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (ruta, st.st_size, st.st_mtime_ns, sha256, estado, nota, attempts, time.time()),
+        )
+        self.conn.commit()
+        self.entries[ruta] = (st.st_size, st.st_mtime_ns, sha256, estado, attempts)
+
+    def _hash(self, ruta: str, file_path: str) -> str:
+        sha256 = self._hashes.get(ruta)
+        if sha256 is None:
+            sha256 = self._hashes[ruta] = file_sha256(file_path)
+        return sha256
+
+    def close(self):
+        self.conn.close()
+
+
+def is_successful(estado: Optional[str]) -> bool:
+    # EXITOSO, EXITOSO (XML), EXITOSO (TEXTO), ...
+    return str(estado or "").startswith("EXITOSO")
@@ -0,0 +1,313 @@
+import io
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: without Pillow there is no image fingerprint
+    Image = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # Optional: without pypdf PDFs only get an image fingerprint if Pillow can open them
+    PdfReader = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Perceptual hash of the page's ink layout on a HASH_WIDTH x HASH_HEIGHT grid
+# (one bit per cell: darker than the page average). A resized or
+# recompressed copy of a page stays within a few bits, a rescan within a
+# few dozen. The usual 8x8 dHash / pHash puts every invoice of the same
+# template at distance 0; this grid separates invoices whose layout differs
+# (line count, lengths of names and amounts), but two invoices of one
+# template that differ only in a few digits can still hash alike, hence the
+# opt-in flag and the DUPLICADO estado for review.
+HASH_WIDTH = 64
+HASH_HEIGHT = 96
+HASH_BITS = HASH_WIDTH * HASH_HEIGHT
+# A PDF image counts as the scanned page when its height / width ratio is
+# within this fraction of the page's
+PAGE_RATIO_TOLERANCE = 0.1
+# MinHash over character shingles of the first page's text
+SHINGLE = 5
+MINHASH_SIZE = 64
+MIN_SHINGLES = 40
+
+_rng = np.random.default_rng(20240601)
+_MULTIPLIERS = _rng.integers(1, 2 ** 63, size=MINHASH_SIZE, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, size=MINHASH_SIZE, dtype=np.uint64)
+# Set bits per byte value, for Hamming distances over packed hashes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+class Fingerprint(NamedTuple):
+    sha256: Optional[str]
+    phash: Optional[bytes]  # HASH_BITS bits
+    minhash: Optional[bytes]  # MINHASH_SIZE uint32
+
+
+class Match(NamedTuple):
+    archivo: str
+    record: Dict
+    method: str  # "imagen" or "texto"
+    score: float  # Hamming distance (imagen) or estimated Jaccard similarity (texto)
+
+
+def fingerprint(file_path: str, content: Optional[bytes] = None, sha256: Optional[str] = None,
+                text: Optional[str] = None) -> Fingerprint:
+    """
+    Perceptual hash of an image file, or MinHash of a PDF's first-page
+    text layer. content: bytes to use instead of reading file_path (ZIP
+    members); text: first-page text when it was already extracted. Either
+    part is None when it cannot be computed.
+
+    PDFs with text get no perceptual hash: without a renderer only embedded
+    images can be hashed, and in born-digital invoices the largest one is
+    often a logo or template background shared by invoices of different
+    suppliers. A scanned PDF (no text at all) is hashed by its page image
+    instead, when it has the page's proportions (see _scan_hash).
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    phash = minhash = None
+    try:
+        if ext in IMAGE_EXTENSIONS and Image is not None:
+            with Image.open(io.BytesIO(content) if content is not None else file_path) as img:
+                phash = _ink_hash(ImageOps.exif_transpose(img))
+        elif ext == ".pdf" and PdfReader is not None:
+            page = None
+            if text is None:
+                page = PdfReader(io.BytesIO(content) if content is not None else file_path).pages[0]
+                text = page.extract_text() or ""
+            minhash = _minhash(text)
+            if not text.strip() and Image is not None:
+                if page is None:
+                    page = PdfReader(io.BytesIO(content) if content is not None else file_path).pages[0]
+                phash = _scan_hash(page)
+    except Exception as e:
+        print(f"   could not fingerprint {os.path.basename(file_path)}: {e}")
+    return Fingerprint(sha256, phash, minhash)
+
+
+def _scan_hash(page) -> Optional[bytes]:
+    """
+    Ink hash of the raster of a scanned PDF page: its largest embedded
+    image, provided it has the page's proportions (a scanner stores the
+    whole page as one picture; a logo or stamp never fills the page).
+    """
+    largest = None
+    for image in page.images:
+        width, height = image.image.size
+        if largest is None or width * height > largest[0] * largest[1]:
+            largest = (width, height, image.image)
+    if largest is None:
+        return None
+    width, height, img = largest
+    box = page.mediabox
+    page_ratio = float(box.height) / float(box.width)
+    if abs(height / width - page_ratio) > PAGE_RATIO_TOLERANCE * page_ratio:
+        return None
+    return _ink_hash(img)
+
+
+def _ink_hash(img) -> bytes:
+    """One bit per grid cell: is the cell (area average) darker than the whole page."""
+    cells = np.asarray(img.convert("L").resize((HASH_WIDTH, HASH_HEIGHT), Image.BOX), dtype=np.float32)
+    return np.packbits(cells < cells.mean()).tobytes()
+
+
+def _minhash(text: str) -> Optional[bytes]:
+    flat = re.sub(r"\s+", " ", text.lower()).strip()
+    if len(flat) < SHINGLE + MIN_SHINGLES:
+        return None
+    shingles = {flat[i:i + SHINGLE] for i in range(len(flat) - SHINGLE + 1)}
+    base = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    # Multiply-shift hashing; uint64 arithmetic wraps around on purpose
+    with np.errstate(over="ignore"):
+        hashed = (base[:, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)
+    return hashed.min(axis=0).astype(np.uint32).tobytes()
+
+
+class NearDuplicateIndex:
+    """
+    Fingerprints of invoices already extracted with Vision, so the same
+    invoice scanned twice, re-exported from email or photographed at another
+    resolution is linked to the existing record instead of paying for
+    another API call. Exact copies (same SHA-256) are the extraction
+    cache's job; this catches files whose bytes differ.
+
+    A file matches when the Hamming distance between perceptual hashes is at
+    most max_distance (of HASH_BITS bits), or when the estimated
+    Jaccard similarity of the text shingles is at least min_similarity.
+    When both files have both signals, both must agree.
+    Records are stored before normalization, like the extraction cache, and
+    only match within the same version (prompt version).
+    """
+
+    def __init__(self, db_path: str, version: str = "", max_distance: int = 24,
+                 min_similarity: float = 0.95):
+        self.db_path = db_path
+        self.version = version
+        self.max_distance = max_distance
+        self.min_similarity = min_similarity
+        # (archivo, original archivo, method, score) of every file linked this run
+        self.suppressed: List[tuple] = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                sha256 TEXT NOT NULL,
+                version TEXT NOT NULL,
+                archivo TEXT,
+                phash BLOB,
+                minhash BLOB,
+                record TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sha256, version)
+            )
+            """
+        )
+        self.conn.commit()
+
+        self._rows: List[tuple] = []  # (sha256, archivo, record json)
+        self._phash_rows: List[int] = []
+        self._phashes: List[bytes] = []
+        self._minhash_rows: List[int] = []
+        self._minhashes: List[bytes] = []
+        # row -> signal, to check that the other signal agrees on a match
+        self._row_phash: Dict[int, bytes] = {}
+        self._row_minhash: Dict[int, bytes] = {}
+        self._matrices = None
+        for sha256, archivo, phash, minhash, record in self.conn.execute(
+            "SELECT sha256, archivo, phash, minhash, record FROM fingerprints WHERE version = ? ORDER BY created_at",
+            (version,),
+        ):
+            if minhash is not None and ".pdf" in (archivo or "").lower():
+                # Hash of an embedded image of a PDF with text (a logo),
+                # stored by earlier versions (see fingerprint)
+                phash = None
+            self._remember(sha256, archivo, phash, minhash, record)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def find(self, fp: Fingerprint) -> Optional[Match]:
+        """Closest indexed invoice within the thresholds (image first), or None."""
+        if not self._rows or (fp.phash is None and fp.minhash is None):
+            return None
+        phashes, minhashes = self._arrays()
+
+        if fp.phash is not None and len(self._phashes):
+            query = np.frombuffer(fp.phash, dtype=np.uint8)
+            distances = _POPCOUNT[phashes ^ query].sum(axis=1)
+            for best in np.argsort(distances, kind="stable"):
+                if distances[best] > self.max_distance:
+                    break
+                row = self._phash_rows[best]
+                if self._text_disagrees(fp, row):
+                    continue
+                match = self._match(row, "imagen", int(distances[best]), fp)
+                if match is not None:
+                    return match
+
+        if fp.minhash is not None and len(self._minhashes):
+            query = np.frombuffer(fp.minhash, dtype=np.uint32)
+            similarity = (minhashes == query).mean(axis=1)
+            for best in np.argsort(-similarity, kind="stable"):
+                if similarity[best] < self.min_similarity:
+                    break
+                row = self._minhash_rows[best]
+                if self._image_disagrees(fp, row):
+                    continue
+                match = self._match(row, "texto", round(float(similarity[best]), 3), fp)
+                if match is not None:
+                    return match
+        return None
+
+    def add(self, fp: Fingerprint, archivo: str, record: Dict):
+        """Indexes a successfully extracted invoice (record before normalization)."""
+        if not fp.sha256 or (fp.phash is None and fp.minhash is None):
+            return
+        data = json.dumps(record, ensure_ascii=False, default=str)
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO fingerprints (sha256, version, archivo, phash, minhash, record, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fp.sha256, self.version, archivo, fp.phash, fp.minhash, data, time.time()),
+        )
+        self.conn.commit()
+        if cursor.rowcount:
+            self._remember(fp.sha256, archivo, fp.phash, fp.minhash, data)
+
+    def record_suppressed(self, archivo: str, match: Match):
+        self.suppressed.append((archivo, match.archivo, match.method, match.score))
+
+    def write_report(self, path: str):
+        """CSV of the files linked to an earlier invoice in this run."""
+        import csv
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["archivo", "duplicado_de", "metodo", "puntaje"])
+            writer.writerows(self.suppressed)
+
+    def close(self):
+        self.conn.close()
+
+    def _match(self, row: int, method: str, score, fp: Fingerprint) -> Optional[Match]:
+        sha256, archivo, record = self._rows[row]
+        if sha256 == fp.sha256:
+            # Same bytes: the extraction cache answers that, with the real record
+            return None
+        return Match(archivo, json.loads(record), method, score)
+
+    def _text_disagrees(self, fp: Fingerprint, row: int) -> bool:
+        other = self._row_minhash.get(row)
+        if fp.minhash is None or other is None:
+            return False
+        similarity = (np.frombuffer(fp.minhash, dtype=np.uint32) == np.frombuffer(other, dtype=np.uint32)).mean()
+        return similarity < self.min_similarity
+
+    def _image_disagrees(self, fp: Fingerprint, row: int) -> bool:
+        other = self._row_phash.get(row)
+        if fp.phash is None or other is None:
+            return False
+        distance = _POPCOUNT[np.frombuffer(fp.phash, dtype=np.uint8) ^ np.frombuffer(other, dtype=np.uint8)].sum()
+        return distance > self.max_distance
+
+    def _remember(self, sha256, archivo, phash, minhash, record):
+        row = len(self._rows)
+        self._rows.append((sha256, archivo, record))
+        if phash is not None:
+            self._phash_rows.append(row)
+            self._phashes.append(phash)
+            self._row_phash[row] = phash
+        if minhash is not None:
+            self._minhash_rows.append(row)
+            self._minhashes.append(minhash)
+            self._row_minhash[row] = minhash
+        self._matrices = None
+
+    def _arrays(self):
+        # Stacked once per batch of additions; a scan over a few thousand
+        # invoices is a single vectorized XOR / compare
+        if self._matrices is None:
+            phashes = (np.frombuffer(b"".join(self._phashes), dtype=np.uint8).reshape(len(self._phashes), -1)
+                       if self._phashes else None)
+            minhashes = (np.frombuffer(b"".join(self._minhashes), dtype=np.uint32).reshape(len(self._minhashes), -1)
+                         if self._minhashes else None)
+            self._matrices = (phashes, minhashes)
+        return self._matrices
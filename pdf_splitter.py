@@ -0,0 +1,110 @@
+import io
+import re
+from typing import List, NamedTuple, Optional
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # Optional: without pypdf PDFs are never split
+    PdfReader = PdfWriter = None
+
+from text_skill import NUMBER_PATTERNS, find_cufe
+
+# Only labelled invoice numbers mark a boundary: the looser patterns of the
+# text tier also match order numbers and references inside an invoice
+BOUNDARY_NUMBER_PATTERNS = NUMBER_PATTERNS[:2]
+PAGE_MARKER = re.compile(r"\bP[aá]g(?:ina)?\.?\s*(\d{1,3})\s*(?:de|/)\s*\d{1,3}\b", re.IGNORECASE)
+
+
+class Segment(NamedTuple):
+    first_page: int  # 1-based, inclusive
+    last_page: int
+    factura_numero: Optional[str]
+    cufe: Optional[str]
+
+    @property
+    def pages(self) -> str:
+        """Page range as shown in the Excel ("3" or "3-5")."""
+        if self.first_page == self.last_page:
+            return str(self.first_page)
+        return f"{self.first_page}-{self.last_page}"
+
+
+def segment_label(file_path: str, segment: Segment) -> str:
+    """Path-like name of one invoice of a split PDF, used for the store and the manifest."""
+    return f"{file_path}#p{segment.pages}"
+
+
+def segment_archivo(basename: str, segment: Segment) -> str:
+    """Name of one invoice of a split PDF in the Excel, with its page range."""
+    return f"{basename} (págs. {segment.pages})"
+
+
+def page_texts(source, min_pages: int = 2) -> List[str]:
+    """
+    Text layer of every page of a PDF, read once: find_segments looks for
+    boundaries in it, and the text tier and the near-duplicate fingerprint
+    reuse it. source: path or binary stream. Returns [] without reading any
+    text for PDFs with fewer than min_pages pages (nothing to split).
+    """
+    if PdfReader is None:
+        return []
+    reader = PdfReader(source)
+    if len(reader.pages) < min_pages:
+        return []
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def find_segments(texts: List[str]) -> List[Segment]:
+    """
+    Finds where each invoice starts in a PDF that holds several (monthly
+    supplier bundles), from the text layer of every page (page_texts): a
+    page starts a new invoice when it shows a labelled invoice number or a
+    CUFE different from the invoice in progress, or a "Página 1 de N"
+    marker. Pages without markers (item continuations, annexes) stay with
+    the invoice before them.
+    Returns [] when there is no text layer to judge by (scans).
+    """
+    segments: List[Segment] = []
+    found_text = False
+    for index, text in enumerate(texts, start=1):
+        flat = re.sub(r"\s+", " ", text)
+        found_text = found_text or len(flat.strip()) >= 50
+        number = _first_number(flat)
+        cufe = find_cufe(flat)
+        marker = PAGE_MARKER.search(flat)
+
+        current = segments[-1] if segments else None
+        starts = (
+            current is None
+            or (marker is not None and int(marker.group(1)) == 1)
+            or (number is not None and current.factura_numero is not None and number != current.factura_numero)
+            or (cufe is not None and current.cufe is not None and cufe != current.cufe)
+        )
+        if starts:
+            segments.append(Segment(index, index, number, cufe))
+        else:
+            segments[-1] = Segment(current.first_page, index, current.factura_numero or number,
+                                   current.cufe or cufe)
+    return segments if found_text else []
+
+
+def write_segments(source, segments: List[Segment]) -> List[bytes]:
+    """One standalone PDF (bytes) per segment, reading the source once."""
+    reader = PdfReader(source)
+    out = []
+    for segment in segments:
+        writer = PdfWriter()
+        for index in range(segment.first_page - 1, segment.last_page):
+            writer.add_page(reader.pages[index])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        out.append(buffer.getvalue())
+    return out
+
+
+def _first_number(flat: str) -> Optional[str]:
+    for pattern in BOUNDARY_NUMBER_PATTERNS:
+        match = pattern.search(flat)
+        if match:
+            return re.sub(r"\s+", "", match.group(1)).upper()
+    return None
@@ -0,0 +1,386 @@
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from processor import InvoiceProcessor
+from companion_index import CompanionIndex
+from result_store import ResultStore
+from manifest import Manifest, NEW, CHANGED, DONE, FAILED, is_successful
+from bundle import is_bundle, member_label
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.zip')
+
+# Selection modes (see --retry_failed / --only_new)
+SELECT_PENDING = "pending"
+SELECT_FAILED = "failed"
+SELECT_NEW = "new"
+SELECT_ALL = "all"
+
+
+def scan_directory(input_dir: str) -> Iterator[Tuple[List[str], List[str]]]:
+    """
+    Walks input_dir with os.scandir, yielding (documents, xml files) one
+    directory at a time, so processing can start before the walk ends.
+    """
+    stack = [input_dir]
+    while stack:
+        directory = stack.pop()
+        documents, xmls = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    lower = entry.name.lower()
+                    if lower.endswith(DOCUMENT_EXTENSIONS):
+                        documents.append(entry.path)
+                    elif lower.endswith('.xml'):
+                        xmls.append(entry.path)
+        except OSError as e:
+            print(f"Could not read directory {directory}: {e}")
+            continue
+        yield documents, xmls
+
+
+class Pipeline:
+    """
+    Streaming producer/consumer pipeline over bounded asyncio queues:
+
+        scan (os.scandir) -> resume filter (manifest) -> extraction workers
+        (XML lane on a process pool / ZIP bundles / throttled Vision path)
+        -> writer (result store + manifest, one commit per result)
+
+    XML files that no document of their directory claims by name are
+    indexed by invoice number / CUFE as soon as the directory is scanned;
+    Vision-bound documents of that directory wait for it.
+
+    Every queue is bounded, so the scan pauses when the workers fall behind
+    and memory stays flat however many files the folder holds. Results are
+    already normalized by the processor.
+    """
+
+    def __init__(self, processor: InvoiceProcessor, store: ResultStore, manifest: Manifest,
+                 companions: CompanionIndex, input_dir: str, selection: str = SELECT_PENDING,
+                 batch_size: int = 1, workers: int = 8, xml_workers: int = 0,
+                 queue_size: int = 256):
+        self.processor = processor
+        self.store = store
+        self.manifest = manifest
+        self.companions = companions
+        self.input_dir = input_dir
+        self.selection = selection
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.xml_workers = xml_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+
+        # First run with a manifest: trust earlier successes, which were keyed by basename
+        self.legacy_done: Set[str] = store.successful_archivos() if len(manifest) == 0 else set()
+
+        self.counts = {NEW: 0, CHANGED: 0, DONE: 0, FAILED: 0}
+        self.found = 0
+        self.total = 0
+        self.completed = 0
+        self.scanning = True
+        # ZIP bundles and split PDFs are recorded in the manifest once all their invoices are done
+        self.bundles: Dict[str, Dict] = {}
+        # directory -> future resolved once its unclaimed XML files are indexed
+        self.indexing: Dict[str, asyncio.Future] = {}
+
+    async def run(self):
+        """Scans input_dir once and processes everything selected."""
+        with ProcessPoolExecutor(max_workers=self.xml_workers) as pool:
+            await self._cycle(pool, scan_directory(self.input_dir))
+        await self.processor.aclose()
+
+    async def watch(self, watcher, on_cycle=None):
+        """
+        --watch: one full pass over input_dir, then every batch of files
+        reported by the watcher (see watcher.DirectoryWatcher) goes through
+        the same stages, with the same processor, client, rate limiter and
+        process pool. on_cycle(self) runs after each pass (e.g. to export).
+        Returns when the watcher is stopped.
+        """
+        await watcher.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self.xml_workers) as pool:
+                await self._cycle(pool, scan_directory(self.input_dir))
+                if on_cycle is not None:
+                    on_cycle(self)
+                print(f"Watching {self.input_dir} for new invoices ({watcher.mode}). Ctrl+C to stop.")
+                while True:
+                    batch = await watcher.next_batch()
+                    if batch is None:
+                        break
+                    await self._cycle(pool, iter(batch))
+                    if on_cycle is not None:
+                        on_cycle(self)
+        finally:
+            watcher.close()
+            await self.processor.aclose()
+
+    async def _cycle(self, pool: ProcessPoolExecutor, scanner: Iterator[Tuple[List[str], List[str]]]):
+        """Runs all stages over the (documents, xml files) batches of scanner."""
+        self.counts = {NEW: 0, CHANGED: 0, DONE: 0, FAILED: 0}
+        self.found = 0
+        self.total = 0
+        self.completed = 0
+        self.scanning = True
+
+        self.scan_q = asyncio.Queue(self.queue_size)
+        self.xml_q = asyncio.Queue(self.queue_size)
+        self.bundle_q = asyncio.Queue(self.queue_size)
+        self.vision_q = asyncio.Queue(self.queue_size)
+        self.index_q = asyncio.Queue(self.queue_size)
+        self.result_q = asyncio.Queue(self.queue_size)
+
+        self.pool = pool
+        writer = asyncio.ensure_future(self._write())
+        indexer = asyncio.ensure_future(self._index_worker())
+        xml_tasks = [asyncio.ensure_future(self._xml_worker()) for _ in range(self.xml_workers)]
+        bundle_tasks = [asyncio.ensure_future(self._bundle_worker()) for _ in range(2)]
+        vision_tasks = [asyncio.ensure_future(self._vision_worker()) for _ in range(self.workers)]
+
+        await asyncio.gather(self._produce(scanner), self._filter())
+        await asyncio.gather(*xml_tasks, *bundle_tasks, indexer)
+        # XML failures and ZIP members may still have been queued for Vision until here
+        for _ in vision_tasks:
+            await self.vision_q.put(None)
+        await asyncio.gather(*vision_tasks)
+        await self.result_q.put(None)
+        await writer
+
+    async def _produce(self, scanner: Iterator[Tuple[List[str], List[str]]]):
+        """Scan stage: registers XML files in the index and queues documents."""
+        loop = asyncio.get_event_loop()
+        while True:
+            # Directory listings can be slow on network shares; keep them off the loop
+            with self.processor.telemetry.span("scan", files=()):
+                batch = await loop.run_in_executor(None, next, scanner, None)
+            if batch is None:
+                break
+            documents, xmls = batch
+            # XML files of a directory are indexed before its documents are queued
+            for xml_path in xmls:
+                self.companions.add_xml(xml_path)
+            # Claim XML files by name (skipped files included, so their XML is
+            # not parsed for nothing); the rest are indexed by content
+            for file_path in documents:
+                if not is_bundle(file_path):
+                    self.companions.lookup(file_path)
+            unclaimed = [x for x in xmls if not self.companions.is_claimed(x)]
+            if unclaimed:
+                directory = os.path.dirname(xmls[0])
+                self.indexing[directory] = asyncio.get_event_loop().create_future()
+                await self.index_q.put((directory, unclaimed))
+
+            for file_path in documents:
+                self.found += 1
+                await self.scan_q.put(file_path)
+        await self.scan_q.put(None)
+        await self.index_q.put(None)
+
+    async def _index_worker(self):
+        """Indexes unclaimed XML files by invoice number / CUFE, one directory at a time."""
+        while True:
+            entry = await self.index_q.get()
+            if entry is None:
+                return
+            directory, xml_paths = entry
+            try:
+                await self.processor.index_companions(self.pool, xml_paths)
+            finally:
+                self.indexing[directory].set_result(None)
+
+    async def _filter(self):
+        """Resume/selection stage: one stat() + manifest lookup per file, then routing."""
+        while True:
+            file_path = await self.scan_q.get()
+            if file_path is None:
+                break
+
+            ruta = os.path.relpath(file_path, self.input_dir)
+            try:
+                state = self.manifest.classify(ruta, file_path)
+            except OSError as e:
+                # Removed since the scan, or a dangling link: nothing to process
+                print(f"   skipping {ruta}: {e}")
+                continue
+            if state == NEW and os.path.basename(file_path) in self.legacy_done:
+                self.manifest.record(ruta, file_path, "EXITOSO")
+                state = DONE
+            self.counts[state] += 1
+
+            if self.selection == SELECT_ALL:
+                selected = True
+            elif self.selection == SELECT_FAILED:
+                selected = state == FAILED
+            elif self.selection == SELECT_NEW:
+                selected = state in (NEW, CHANGED)
+            else:
+                selected = state != DONE
+            if not selected:
+                self.manifest.forget(ruta)
+                continue
+
+            self.total += 1
+            bundle = is_bundle(file_path)
+            xml_path = None if bundle else self.companions.lookup(file_path)
+            # XML lane: invoices with a companion DIAN XML never touch the
+            # network, so they are parsed on a process pool, outside the rate limiter.
+            if bundle:
+                await self.bundle_q.put(file_path)
+            elif xml_path:
+                await self.xml_q.put(file_path)
+            else:
+                await self.vision_q.put(("file", file_path))
+
+        self.scanning = False
+        print(f"Scan finished: {self.found} files. Manifest: {self.counts[NEW]} new, "
+              f"{self.counts[CHANGED]} modified, {self.counts[DONE]} done, {self.counts[FAILED]} failed.")
+
+        for _ in range(self.xml_workers):
+            await self.xml_q.put(None)
+        for _ in range(2):
+            await self.bundle_q.put(None)
+
+    async def _xml_worker(self):
+        while True:
+            chunk = await self._take(self.xml_q, 64)
+            if not chunk:
+                return
+            results = await self.processor.process_xml_lane(chunk, self.pool)
+            for file_path in chunk:
+                if file_path in results:
+                    await self.result_q.put((file_path, results[file_path], None))
+                else:
+                    # XML did not parse: regular path (text layer / Vision)
+                    await self.vision_q.put(("file", file_path))
+
+    async def _bundle_worker(self):
+        while True:
+            zip_path = await self.bundle_q.get()
+            if zip_path is None:
+                return
+            results, pending = await self.processor.process_bundle_lane([zip_path], self.pool)
+            done, members = results[zip_path], pending[zip_path]
+            # A bundle counts as one file until its contents are known
+            self.total += len(done) + len(members) - 1
+            self.bundles[zip_path] = {"left": len(done) + len(members), "failed": []}
+            for label, res in done:
+                await self.result_q.put((label, res, zip_path))
+            for member in members:
+                await self.vision_q.put(("member", zip_path, member))
+
+    async def _vision_worker(self):
+        # Pacing is handled by the RateLimiter inside the processor: only Vision
+        # calls consume the RPM/TPM budget, cache hits and XML invoices do not.
+        while True:
+            items = await self._take(self.vision_q, self.batch_size)
+            if not items:
+                return
+
+            files = [item[1] for item in items if item[0] == "file"]
+            for file_path in files:
+                # Its directory's XML may match it by invoice number / CUFE
+                pending_index = self.indexing.get(os.path.dirname(file_path))
+                if pending_index is not None:
+                    await pending_index
+            files = [file_path for file_path in files if not await self._split(file_path)]
+            if len(files) > 1:
+                for file_path, res in zip(files, await self.processor.process_batch(files)):
+                    await self.result_q.put((file_path, res, None))
+            elif files:
+                with self.processor.telemetry.working_on(files[0]):
+                    res = await self.processor.process_file(files[0])
+                await self.result_q.put((files[0], res, None))
+
+            # Documents inside a ZIP that no XML covers; read in memory, one per request
+            for _, zip_path, member in (item for item in items if item[0] == "member"):
+                label = member_label(zip_path, member)
+                with self.processor.telemetry.working_on(label):
+                    res = await self.processor.process_member(zip_path, member)
+                await self.result_q.put((label, res, zip_path))
+
+    async def _split(self, file_path: str) -> bool:
+        """
+        A PDF holding several invoices yields one result per invoice; the PDF
+        itself is tracked like a ZIP bundle. Returns False for a single invoice.
+        """
+        segments = await self.processor.split_pdf(file_path)
+        if not segments:
+            return False
+        self.total += len(segments) - 1
+        self.bundles[file_path] = {"left": len(segments), "failed": []}
+        for label, res in await self.processor.process_segments(file_path, segments):
+            await self.result_q.put((label, res, file_path))
+        return True
+
+    async def _take(self, queue: asyncio.Queue, limit: int) -> list:
+        """
+        Waits for one item, then takes whatever else is already queued, up to
+        limit. Returns [] on the end-of-stream marker (which is put back for
+        the other workers if items were taken before it).
+        """
+        item = await queue.get()
+        if item is None:
+            return []
+        items = [item]
+        while len(items) < limit:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                queue.put_nowait(None)
+                break
+            items.append(item)
+        return items
+
+    async def _write(self):
+        """Persistence stage: each result is committed to the store and the manifest."""
+        while True:
+            entry = await self.result_q.get()
+            if entry is None:
+                return
+            try:
+                self._save(*entry)
+            except Exception as e:
+                # e.g. a file deleted while it was processed (--watch): the
+                # writer must keep going for the rest
+                print(f"   could not record {os.path.basename(entry[0])}: {e}")
+
+    def _save(self, file_path: str, res: Optional[dict], bundle: Optional[str]):
+        self.completed += 1
+        if self.scanning:
+            print(f"[{self.completed}/{self.total}+] Processed (still scanning)")
+        else:
+            percentage = (self.completed / max(self.total, 1)) * 100
+            print(f"[{self.completed}/{self.total}] {percentage:.1f}% - Processed")
+
+        ruta = os.path.relpath(file_path, self.input_dir)
+        telemetry = self.processor.telemetry
+        with telemetry.span("persist", files=(file_path,)):
+            if res:
+                self.store.append(res, ruta=ruta)
+            if bundle is None:
+                self.manifest.record(ruta, file_path, res.get("estado") if res else None,
+                                     res.get("nota") if res else None,
+                                     sha256=self.processor.file_hashes.pop(file_path, None))
+        telemetry.finish(file_path, res.get("estado") if res else None,
+                         res.get("nota") if res else None, label=ruta)
+        if bundle is None:
+            return
+
+        state = self.bundles[bundle]
+        state["left"] -= 1
+        if not res or not is_successful(res.get("estado")):
+            # The bundle itself (unreadable / empty ZIP) or one of its documents
+            state["failed"].append(res.get("nota") if file_path == bundle and res else os.path.basename(file_path))
+        if state["left"] == 0:
+            nota = f"Fallidos: {', '.join(state['failed'])}" if state["failed"] else None
+            self.manifest.record(os.path.relpath(bundle, self.input_dir), bundle,
+                                 "FALLIDO" if state["failed"] else "EXITOSO", nota,
+                                 sha256=self.processor.file_hashes.pop(bundle, None))
@@ -0,0 +1,120 @@
+import io
+import os
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: without Pillow images are sent untouched
+    Image = None
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # Optional: without pypdf PDFs are sent untouched
+    PdfReader = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+class Preprocessor:
+    """
+    Shrinks files before they are sent to Gemini: fewer bytes to upload and
+    fewer input tokens, without touching the original file on disk.
+    - Photos/scans: EXIF rotation, grayscale, downsample to max_side, JPEG recompression.
+    - PDFs: recompress embedded scan images the same way and, optionally,
+      keep only the first page (header) and last page (totals).
+    Keeps running totals of bytes before/after in self.stats.
+    """
+
+    def __init__(self, max_side: int = 2000, jpeg_quality: int = 70, grayscale: bool = True,
+                 min_bytes: int = 300 * 1024, trim_pages: bool = False):
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.grayscale = grayscale
+        # Files smaller than this are already cheap; leave them alone
+        self.min_bytes = min_bytes
+        self.trim_pages = trim_pages
+        self.stats = {"files": 0, "reduced": 0, "bytes_before": 0, "bytes_after": 0}
+
+    def prepare(self, file_path: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Returns (new bytes, mime type) when the file could be made smaller,
+        or None to send the original file as is.
+        """
+        size = os.path.getsize(file_path)
+        ext = os.path.splitext(file_path)[1].lower()
+
+        result = None
+        try:
+            if ext in IMAGE_EXTENSIONS and Image is not None and size > self.min_bytes:
+                result = (self._shrink_image(file_path), 'image/jpeg')
+            elif ext == '.pdf' and PdfReader is not None and (size > self.min_bytes or self.trim_pages):
+                data = self._shrink_pdf(file_path, size)
+                if data is not None:
+                    result = (data, 'application/pdf')
+        except Exception as e:
+            print(f"   pre-processing skipped for {os.path.basename(file_path)}: {e}")
+            result = None
+
+        # Only use the new version when it actually saves bytes
+        if result is not None and len(result[0]) >= size:
+            result = None
+
+        new_size = len(result[0]) if result is not None else size
+        self.stats["files"] += 1
+        self.stats["bytes_before"] += size
+        self.stats["bytes_after"] += new_size
+        if result is not None:
+            self.stats["reduced"] += 1
+            print(f"   pre-processed {os.path.basename(file_path)}: {size / 1024:.0f} KB -> {new_size / 1024:.0f} KB")
+        return result
+
+    def summary(self) -> str:
+        before = self.stats["bytes_before"]
+        after = self.stats["bytes_after"]
+        saved = (1 - after / before) * 100 if before else 0.0
+        return (f"Pre-processing: {self.stats['reduced']}/{self.stats['files']} files reduced, "
+                f"{before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB ({saved:.0f}% saved).")
+
+    def _shrink_image(self, file_path: str) -> bytes:
+        with Image.open(file_path) as img:
+            return self._encode(img)
+
+    def _encode(self, img) -> bytes:
+        # Phone photos carry their rotation in EXIF; apply it before resizing
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("L") if self.grayscale else img.convert("RGB")
+        img.thumbnail((self.max_side, self.max_side))
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=self.jpeg_quality, optimize=True)
+        return out.getvalue()
+
+    def _shrink_pdf(self, file_path: str, size: int) -> Optional[bytes]:
+        reader = PdfReader(file_path)
+        writer = PdfWriter()
+
+        pages = list(reader.pages)
+        if self.trim_pages and len(pages) > 2:
+            # Header (issuer, number, CUFE) is on the first page, totals on the last
+            pages = [pages[0], pages[-1]]
+        elif size <= self.min_bytes:
+            return None
+
+        for page in pages:
+            writer.add_page(page)
+
+        if size > self.min_bytes:
+            for page in writer.pages:
+                for image in page.images:
+                    # Recompress embedded scans (the usual reason a PDF is large)
+                    if image.image is not None and max(image.image.size) > 1:
+                        image.replace(self._to_thumbnail(image.image), quality=self.jpeg_quality)
+            writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+
+        out = io.BytesIO()
+        writer.write(out)
+        return out.getvalue()
+
+    def _to_thumbnail(self, img):
+        img = img.convert("L") if self.grayscale else img.convert("RGB")
+        img.thumbnail((self.max_side, self.max_side))
+        return img
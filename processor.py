@@ -1,90 +1,803 @@
+import io
 import os
+import time
 import asyncio
-from vision_skill import VisionSkill
+import hashlib
+from functools import partial
+from typing import Dict, List, Optional, Tuple, Union
+from vision_skill import VisionSkill, PROMPT_VERSION
 from xml_skill import XmlSkill
+from text_skill import TextLayerSkill
+from extraction_cache import ExtractionCache
+from preprocess import Preprocessor
+from key_pool import KeyPool
+from rate_limiter import RateLimiter, is_rate_limit_error, retry_delay_from_error
+from companion_index import CompanionIndex
+from response_archive import ResponseArchive, NotArchived
+from near_duplicates import NearDuplicateIndex, Fingerprint, fingerprint
+from remote_files import RemoteFileCache
+from pdf_splitter import Segment, page_texts, find_segments, write_segments, segment_label, segment_archivo
+from telemetry import Telemetry
+from bundle import scan_bundle, member_label, read_member, member_mime_type
+from utils import file_sha256, validate_invoice_data
+
+# Text-layer totals are exact figures, not a model's reading: only peso
+# rounding is tolerated (validate_invoice_data keeps its 1 peso minimum)
+TEXT_TOLERANCE = 0.0
+
+
+def companion_xml(file_path: str) -> Optional[str]:
+    """
+    Path of the DIAN XML delivered next to the invoice, if any.
+    Assumption: XML file has same basename but .xml extension
+    Used when no CompanionIndex was built (one stat per file).
+    """
+    xml_path = os.path.splitext(file_path)[0] + ".xml"
+    return xml_path if os.path.exists(xml_path) else None
+
+
+def _parse_xml_chunk(items: List[Tuple[str, str]], with_hash: bool) -> List[Tuple[Optional[dict], Optional[str], float]]:
+    """
+    Worker for the XML lane (runs in a separate process): parses each
+    (file_path, xml_path) pair and optionally hashes the invoice file for
+    the extraction cache. Returns [(data or None, sha256 or None, parse seconds)].
+    """
+    skill = XmlSkill()
+    out = []
+    for file_path, xml_path in items:
+        started = time.perf_counter()
+        try:
+            data = skill.extract_data(xml_path)
+        except Exception as e:
+            print(f"   XML parsing failed for {os.path.basename(xml_path)}: {e}")
+            data = None
+        seconds = time.perf_counter() - started
+        sha256 = None
+        if data and with_hash:
+            try:
+                sha256 = file_sha256(file_path)
+            except OSError:
+                pass
+        out.append((data or None, sha256, seconds))
+    return out
+
 
 class InvoiceProcessor:
-    def __init__(self, api_key: str):
-        self.vision = VisionSkill(api_key)
+    def __init__(self, api_key: str, cache: Optional[ExtractionCache] = None,
+                 limiter: Optional[Union[RateLimiter, KeyPool]] = None, tokens_per_request: int = 3000,
+                 max_rate_limit_retries: int = 5, client=None,
+                 inline_max_bytes: int = 1024 * 1024, use_text_layer: bool = True,
+                 preprocessor: Optional[Preprocessor] = None,
+                 companions: Optional[CompanionIndex] = None,
+                 archive: Optional[ResponseArchive] = None, replay: bool = False,
+                 telemetry: Optional[Telemetry] = None, models: Optional[List[str]] = None,
+                 near_duplicates: Optional[NearDuplicateIndex] = None,
+                 remote_files: Optional[RemoteFileCache] = None, split_pdfs: bool = True):
+        # Stage timings, token usage and 429 / retry counts (see telemetry.py)
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.vision = VisionSkill(api_key, client=client, inline_max_bytes=inline_max_bytes,
+                                  preprocessor=preprocessor, archive=archive, offline=replay,
+                                  telemetry=self.telemetry, models=models,
+                                  remote_files=remote_files if not replay else None)
         self.xml_skill = XmlSkill()
+        self.text_skill = TextLayerSkill() if use_text_layer else None
+        self.cache = cache
+        # Only Vision calls go through the limiter; cache hits and XML are free
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.tokens_per_request = tokens_per_request
+        self.max_rate_limit_retries = max_rate_limit_retries
+        # XML files found by the directory scan (None = probe base + ".xml")
+        self.companions = companions
+        # Files whose companion XML already failed in the XML lane
+        self._xml_failed = set()
+        # SHA-256 of the files hashed while processing them, so the manifest
+        # does not read them again (the pipeline's writer takes them)
+        self.file_hashes: Dict[str, str] = {}
+        # Page texts read by split_pdf, reused by the text tier and the
+        # near-duplicate fingerprint instead of parsing the PDF again
+        self._page_texts: Dict[str, List[str]] = {}
+        # Raw Gemini answers, keyed by file hash; with replay they are parsed
+        # again instead of calling Vision (no client, no network)
+        self.archive = archive
+        self.replay = replay
+        # Fingerprints of invoices already extracted with Vision: rescans and
+        # re-exports are linked to the existing record instead of a new call
+        self.near_duplicates = near_duplicates if not replay else None
+        # Look for invoice boundaries in multi-page PDFs (supplier bundles)
+        self.split_pdfs = split_pdfs
 
-    async def process_file(self, file_path: str) -> dict:
+    async def process_file(self, file_path: str) -> Optional[dict]:
         """
         Processes a single file:
+        0. Checks the extraction cache by file hash -> reuse previous result
         1. Checks for companion XML file -> extract via XmlSkill
-        2. If no XML or failure -> extract via VisionSkill (Gemini)
+        1b. PDF text layer -> pattern extraction, kept only if it validates
+        2. If no XML or failure -> extract via VisionSkill (Gemini), moving
+           up the model cascade while the answer fails validation
+        With replay, step 2 parses the archived answer instead, and None is
+        returned when there is none.
         """
+        texts = self._page_texts.pop(file_path, None)
+        result, sha256 = await self._process_local(file_path, texts)
+        if result is not None:
+            return result
+
+        # 1c. Near-duplicate of an invoice already extracted with Vision
+        fp, linked = await self._check_duplicate(file_path, sha256, text=texts[0] if texts else None)
+        if linked is not None:
+            return linked
+
+        # 2. Vision Strategy (Fallback)
         basename = os.path.basename(file_path)
-        print(f"Processing: {basename}...")
+        print("   replaying archived Gemini answer..." if self.replay else "   using Vision API (Gemini)...")
+        hashes = {file_path: sha256}
+        result = (await self._vision_cascade([file_path], hashes, partial(self._extract_vision_batch, hashes=hashes),
+                                             {file_path: fp}))[file_path]
+        if isinstance(result, NotArchived):
+            # --replay: keep whatever the store already has for this file
+            print(f"   {result}, skipped.")
+            return None
+        if isinstance(result, Exception):
+            print(f"Failed to process {file_path}: {result}")
+            return {
+                "archivo": basename,
+                "estado": "FALLIDO",
+                "nota": str(result)
+            }
+        return result
 
-        # 1. Try XML Strategy first
-        # Assumption: XML file has same basename but .xml extension
-        base_no_ext = os.path.splitext(file_path)[0]
-        xml_path = base_no_ext + ".xml"
-        
-        if os.path.exists(xml_path):
-            print(f"   found companion XML: {os.path.basename(xml_path)}")
-            try:
-                # XML parsing is fast/sync, no need for executor usually, 
-                # but good practice to keep main loop free
-                loop = asyncio.get_event_loop()
-                data = await loop.run_in_executor(None, self.xml_skill.extract_data, xml_path)
-                
+    async def process_batch(self, file_paths: List[str]) -> List[Optional[dict]]:
+        """
+        Like process_file for several files, but the ones that need Vision are
+        sent together in batched generate_content calls (one request per batch).
+        """
+        results = {}
+        pending = []
+        hashes = {}
+        fingerprints = {}
+        for file_path in file_paths:
+            with self.telemetry.working_on(file_path):
+                texts = self._page_texts.pop(file_path, None)
+                result, sha256 = await self._process_local(file_path, texts)
+                if result is None:
+                    fingerprints[file_path], result = await self._check_duplicate(
+                        file_path, sha256, text=texts[0] if texts else None)
+            if result is not None:
+                results[file_path] = result
+            else:
+                hashes[file_path] = sha256
+                pending.append(file_path)
+
+        if pending:
+            print(f"   using Vision API (Gemini) for a batch of {len(pending)}...")
+            extracted = await self._vision_cascade(pending, hashes, partial(self._extract_vision_batch, hashes=hashes),
+                                                   fingerprints)
+            for file_path in pending:
+                data = extracted.get(file_path)
+                if isinstance(data, NotArchived):
+                    print(f"   {os.path.basename(file_path)}: {data}, skipped.")
+                    results[file_path] = None
+                elif isinstance(data, Exception):
+                    print(f"Failed to process {file_path}: {data}")
+                    results[file_path] = {
+                        "archivo": os.path.basename(file_path),
+                        "estado": "FALLIDO",
+                        "nota": str(data)
+                    }
+                else:
+                    results[file_path] = data
+
+        return [results[f] for f in file_paths]
+
+    async def process_xml_lane(self, file_paths: List[str], executor=None,
+                               chunk_size: int = 64) -> Dict[str, dict]:
+        """
+        Parses the companion XML of many invoices at once, in chunks on the
+        given executor (a ProcessPoolExecutor in main.py). No API calls and no
+        rate limiting are involved. Returns {file_path: normalized result} for
+        the files whose XML parsed; the rest are left for process_file.
+        """
+        items = [(f, self.find_companion(f)) for f in file_paths]
+        items = [(f, x) for f, x in items if x]
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+        loop = asyncio.get_event_loop()
+        outcomes = await asyncio.gather(
+            *(loop.run_in_executor(executor, _parse_xml_chunk, chunk, self.cache is not None) for chunk in chunks),
+            return_exceptions=True,
+        )
+
+        results = {}
+        for chunk, outcome in zip(chunks, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"   XML lane worker failed ({outcome}), {len(chunk)} files go to the regular path.")
+                continue
+            for (file_path, _), (data, sha256, seconds) in zip(chunk, outcome):
+                self.telemetry.record("xml_parse", seconds, (file_path,))
+                if not data:
+                    self._xml_failed.add(file_path)
+                    continue
+                if sha256:
+                    self.file_hashes[file_path] = sha256
+                self._cache_put(sha256, data, "xml")
+                results[file_path] = self._normalize(data)
+        return results
+
+    async def index_companions(self, executor=None, xml_paths: Optional[List[str]] = None,
+                               chunk_size: int = 64) -> int:
+        """
+        Parses XML files of the companion index (by default all that no
+        document claimed by name), so documents can be matched to them by
+        invoice number or CUFE (name or PDF text layer).
+        Returns how many were indexed.
+        """
+        if self.companions is None:
+            return 0
+        if xml_paths is None:
+            xml_paths = self.companions.unclaimed()
+        items = [(x, x) for x in xml_paths]
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+        loop = asyncio.get_event_loop()
+        outcomes = await asyncio.gather(
+            *(loop.run_in_executor(executor, _parse_xml_chunk, chunk, False) for chunk in chunks),
+            return_exceptions=True,
+        )
+        indexed = 0
+        for chunk, outcome in zip(chunks, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"   XML index worker failed: {outcome}")
+                continue
+            for (xml_path, _), (data, _, seconds) in zip(chunk, outcome):
+                self.telemetry.record("xml_parse", seconds, ())
                 if data:
-                    print(f"   extracted data from XML successfully.")
-                    # XML extraction already returns the mapped dict structure we need
-                    # XML extraction already returns the mapped dict structure we need
-                    return self._normalize(data)
+                    self.companions.add_invoice(xml_path, data)
+                    indexed += 1
+        return indexed
+
+    def find_companion(self, file_path: str) -> Optional[str]:
+        if self.companions is not None:
+            return self.companions.lookup(file_path)
+        return companion_xml(file_path)
+
+    async def process_bundle_lane(self, zip_paths: List[str], executor=None) -> Tuple[Dict[str, List[Tuple[str, dict]]], Dict[str, List[str]]]:
+        """
+        Scans ZIP bundles on the given executor (same pool as the XML lane):
+        XML invoices are extracted in memory and paired with their PDF by
+        content. Returns ({zip_path: [(member label, result)]},
+        {zip_path: [document members still needing process_member]}).
+        A ZIP that cannot be read gets a single FALLIDO result.
+        """
+        loop = asyncio.get_event_loop()
+        outcomes = await asyncio.gather(
+            *(loop.run_in_executor(executor, scan_bundle, z, self.cache is not None) for z in zip_paths),
+            return_exceptions=True,
+        )
+
+        results, pending = {}, {}
+        for zip_path, outcome in zip(zip_paths, outcomes):
+            zip_name = os.path.basename(zip_path)
+            if isinstance(outcome, Exception):
+                print(f"Failed to read bundle {zip_path}: {outcome}")
+                results[zip_path] = [(zip_path, {"archivo": zip_name, "estado": "FALLIDO", "nota": str(outcome)})]
+                pending[zip_path] = []
+                continue
+
+            results[zip_path] = []
+            for member, data, sha256 in outcome["invoices"]:
+                self._cache_put(sha256, data, "xml")
+                result = self._normalize(dict(data))
+                result["archivo"] = f"{zip_name}/{member}"
+                results[zip_path].append((member_label(zip_path, member), result))
+            pending[zip_path] = outcome["pending"]
+            if not results[zip_path] and not pending[zip_path]:
+                results[zip_path] = [(zip_path, {"archivo": zip_name, "estado": "FALLIDO", "nota": "ZIP sin facturas"})]
+            print(f"   {zip_name}: {len(outcome['invoices'])} XML invoices, "
+                  f"{len(outcome['pending'])} documents without XML.")
+        return results, pending
+
+    async def process_member(self, zip_path: str, member: str) -> Optional[dict]:
+        """
+        Like process_file for a document inside a ZIP that no XML covers.
+        The bytes are read from the archive into memory (never to disk) and
+        go through the cache, the PDF text layer and Vision.
+        """
+        label = member_label(zip_path, member)
+        archivo = f"{os.path.basename(zip_path)}/{member}"
+        print(f"Processing: {archivo}...")
+        try:
+            loop = asyncio.get_event_loop()
+            content = await loop.run_in_executor(None, read_member, zip_path, member)
+            with self.telemetry.span("hash"):
+                sha256 = hashlib.sha256(content).hexdigest() if self._needs_hash else None
+        except Exception as e:
+            print(f"Failed to process {label}: {e}")
+            return {"archivo": archivo, "estado": "FALLIDO", "nota": str(e)}
+        return await self._process_content(label, archivo, member, content, member_mime_type(member), sha256)
+
+    async def split_pdf(self, file_path: str) -> List[Segment]:
+        """
+        Invoice boundaries of a PDF that bundles several invoices (see
+        pdf_splitter.find_segments). Returns [] for anything that is a
+        single invoice, or that has a companion XML (one XML, one invoice).
+        Single-page PDFs and files the extraction cache already knows are
+        not read; the page texts read here are kept for the text tier.
+        """
+        if not self.split_pdfs or not file_path.lower().endswith(".pdf"):
+            return []
+        if file_path not in self._xml_failed and self.find_companion(file_path):
+            return []
+        if self.cache is not None and self._needs_hash:
+            try:
+                sha256 = await self._hash_file(file_path)
+            except OSError:
+                return []  # Reported by process_file
+            if self.cache.get(sha256, self.vision.model_key, PROMPT_VERSION):
+                return []
+
+        def read(path: str) -> Tuple[List[str], List[Segment]]:
+            texts = page_texts(path)
+            return texts, find_segments(texts)
+
+        loop = asyncio.get_event_loop()
+        with self.telemetry.span("split"):
+            try:
+                texts, segments = await loop.run_in_executor(None, read, file_path)
             except Exception as e:
-                print(f"   XML parsing failed, falling back to Vision: {e}")
-        
-        # 2. Vision Strategy (Fallback)
+                print(f"   could not look for invoice boundaries in {os.path.basename(file_path)}: {e}")
+                return []
+        if texts:
+            self._page_texts[file_path] = texts
+        return segments if len(segments) > 1 else []
+
+    async def process_segments(self, file_path: str, segments: List[Segment]) -> List[Tuple[str, Optional[dict]]]:
+        """
+        Processes each invoice of a split PDF as a document of its own
+        (cache, text layer, Vision), all segments at once; the limiter paces
+        the Vision calls. Returns [(label, result)] in page order, where the
+        label (path#p<pages>) keys the store and the manifest and archivo
+        shows the page range.
+        """
+        basename = os.path.basename(file_path)
+        print(f"   {basename} holds {len(segments)} invoices, processing them separately...")
+        loop = asyncio.get_event_loop()
+        texts = self._page_texts.pop(file_path, None) or []
+        try:
+            contents = await loop.run_in_executor(None, write_segments, file_path, segments)
+            sha256 = await self._hash_file(file_path) if self._needs_hash else None
+        except Exception as e:
+            print(f"Failed to split {file_path}: {e}")
+            return [(segment_label(file_path, segment),
+                     {"archivo": segment_archivo(basename, segment), "estado": "FALLIDO", "nota": str(e)})
+                    for segment in segments]
+
+        async def process(segment: Segment, content: bytes) -> Tuple[str, Optional[dict]]:
+            label = segment_label(file_path, segment)
+            archivo = segment_archivo(basename, segment)
+            # Stable across runs (the extracted bytes are not): cache, archive and replay keep working
+            key = hashlib.sha256(f"{sha256}#p{segment.pages}".encode()).hexdigest() if sha256 else None
+            print(f"Processing: {archivo}...")
+            with self.telemetry.working_on(label):
+                return label, await self._process_content(label, archivo, basename, content, "application/pdf", key,
+                                                          texts[segment.first_page - 1:segment.last_page])
+
+        return list(await asyncio.gather(*[process(segment, content) for segment, content in zip(segments, contents)]))
+
+    async def _process_content(self, label: str, archivo: str, name: str, content: bytes,
+                               mime_type: Optional[str], sha256: Optional[str],
+                               texts: Optional[List[str]] = None) -> Optional[dict]:
+        """
+        Cache, PDF text layer, near-duplicate index and Vision for a document
+        held in memory (ZIP member, segment of a split PDF). label: its path-
+        like name for telemetry and the Vision call; name: file name whose
+        extension picks the text layer; archivo: shown in the Excel; texts:
+        its page texts, when already read.
+        """
         try:
-            print(f"   using Vision API (Gemini)...")
-            
-            # Since VisionSkill uses blocking network calls (genai lib is sync mostly), 
-            # we should run it in a thread executor to keep asyncio happy.
             loop = asyncio.get_event_loop()
-            data = await loop.run_in_executor(None, self.vision.extract_data, file_path)
-            
-            if not data:
-                print(f"No data extracted from {basename}")
-                return {
-                    "archivo": basename,
-                    "estado": "FALLIDO",
-                    "nota": "No se pudo extraer JSON valido"
-                }
-
-            # Map the fields to match our excel structure
-            mapped_data = {
-                "archivo": basename,
-                "estado": "EXITOSO",
-                "proveedor": data.get("proveedor_nombre"),
-                "nit": data.get("proveedor_nit"),
-                "direccion": data.get("proveedor_direccion"),
-                "telefono": data.get("proveedor_telefono"),
-                "ciudad": data.get("proveedor_ciudad"),
-                "factura_numero": data.get("factura_numero"),
-                "fecha": data.get("fecha_emision"),
-                "fecha_vencimiento": data.get("fecha_vencimiento"),
-                "descripcion": data.get("descripcion_general"),
-                "moneda": data.get("moneda"),
-                "base": data.get("base_imponible"),
-                "impuestos": data.get("impuestos"),
-                "total": data.get("total"),
-                "cufe": data.get("cufe")
-            }
-            
-            
-            return self._normalize(mapped_data)
+            result = None
+            cached = self.cache.get(sha256, self.vision.model_key, PROMPT_VERSION) if sha256 and self.cache is not None else None
+            if cached:
+                print(f"   cache hit ({sha256[:12]}), skipping extraction.")
+                result = self._normalize(cached)
+
+            if result is None and self.text_skill is not None and self.text_skill.available:
+                with self.telemetry.span("text_layer"):
+                    data = await loop.run_in_executor(None, self.text_skill.extract_data, name,
+                                                      io.BytesIO(content), texts)
+                if data:
+                    normalized = self._normalize(dict(data))
+                    problems = validate_invoice_data(normalized, tolerance=TEXT_TOLERANCE)
+                    if not problems:
+                        print(f"   extracted data from PDF text layer successfully.")
+                        self._cache_put(sha256, data, "text")
+                        result = normalized
+
+            fp = None
+            if result is None:
+                fp, result = await self._check_duplicate(label, sha256, content, texts[0] if texts else None)
+
+            if result is None:
+                print("   replaying archived Gemini answer..." if self.replay else "   using Vision API (Gemini)...")
+                payload = (content, mime_type)
+
+                async def extract(labels: List[str], model: Optional[str]) -> Dict[str, object]:
+                    try:
+                        if self.replay:
+                            return {label: self._replay(sha256, model)}
+                        return {label: await self._call_limited(
+                            self.tokens_per_request,
+                            partial(self.vision.extract_data_async, archive_key=sha256, model=model),
+                            label, payload, prefetch=[(label, sha256, payload)])}
+                    except Exception as e:
+                        return {label: e}
+
+                result = (await self._vision_cascade([label], {label: sha256}, extract, {label: fp}))[label]
+                if isinstance(result, Exception):
+                    raise result
+        except NotArchived as e:
+            print(f"   {e}, skipped.")
+            return None
         except Exception as e:
-            print(f"Failed to process {file_path}: {e}")
+            print(f"Failed to process {label}: {e}")
+            result = {"estado": "FALLIDO", "nota": str(e)}
+
+        result["archivo"] = archivo
+        return result
+
+    async def _process_local(self, file_path: str,
+                             texts: Optional[List[str]] = None) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        Steps 0, 1 and 1b of process_file (no API calls). texts: page texts
+        already read by split_pdf.
+        Returns (result or None, sha256 of the file or None).
+        """
+        basename = os.path.basename(file_path)
+        print(f"Processing: {basename}...")
+
+        # 0. Content-addressed cache: same bytes under another name are free
+        sha256 = None
+        if self._needs_hash:
+            try:
+                sha256 = await self._hash_file(file_path)
+                cached = self.cache.get(sha256, self.vision.model_key, PROMPT_VERSION) if self.cache is not None else None
+                if cached:
+                    print(f"   cache hit ({sha256[:12]}), skipping extraction.")
+                    cached["archivo"] = basename
+                    return self._normalize(cached), sha256
+            except OSError as e:
+                print(f"   could not hash file, cache disabled for it: {e}")
+
+        # 1. Try XML Strategy first (unless the XML lane already failed on it)
+        xml_path = self.find_companion(file_path) if file_path not in self._xml_failed else None
+
+        if xml_path:
+            print(f"   found companion XML: {os.path.basename(xml_path)}")
+            result = await self._xml_result(xml_path, sha256)
+            if result is not None:
+                return result, sha256
+
+        # 1b. Born-digital PDFs: read the text layer locally and only trust it
+        # when NIT check digit, totals, date and CUFE are all consistent
+        if self.text_skill is not None and self.text_skill.available:
+            loop = asyncio.get_event_loop()
+            with self.telemetry.span("text_layer"):
+                data = await loop.run_in_executor(None, self.text_skill.extract_data, file_path, None, texts)
+            if data and self.companions is not None and self.companions.parsed:
+                # The text names an invoice whose XML is in the folder under another name
+                xml_path = self.companions.lookup_content(file_path, data.get("cufe"),
+                                                          data.get("factura_numero"), data.get("nit"))
+                if xml_path:
+                    print(f"   matched XML by content: {os.path.basename(xml_path)}")
+                    result = await self._xml_result(xml_path, sha256)
+                    if result is not None:
+                        return result, sha256
+            if data:
+                normalized = self._normalize(dict(data))
+                problems = validate_invoice_data(normalized, tolerance=TEXT_TOLERANCE)
+                if not problems:
+                    print(f"   extracted data from PDF text layer successfully.")
+                    self._cache_put(sha256, data, "text")
+                    return normalized, sha256
+                print(f"   text layer not conclusive ({', '.join(problems)}), using Vision.")
+
+        return None, sha256
+
+    async def _xml_result(self, xml_path: str, sha256: Optional[str]) -> Optional[dict]:
+        try:
+            # XML parsing is fast/sync, no need for executor usually,
+            # but good practice to keep main loop free
+            loop = asyncio.get_event_loop()
+            with self.telemetry.span("xml_parse"):
+                data = await loop.run_in_executor(None, self.xml_skill.extract_data, xml_path)
+
+            if data:
+                print(f"   extracted data from XML successfully.")
+                # XML extraction already returns the mapped dict structure we need
+                self._cache_put(sha256, data, "xml")
+                return self._normalize(data)
+        except Exception as e:
+            print(f"   XML parsing failed, falling back to Vision: {e}")
+        return None
+
+    async def _vision_cascade(self, file_paths: List[str], hashes: Dict[str, Optional[str]],
+                              extract, fingerprints: Optional[Dict[str, Optional[Fingerprint]]] = None) -> Dict[str, object]:
+        """
+        Runs Vision over file_paths with the first (cheapest) model of the
+        cascade, checks each answer with validate_invoice_data and re-runs
+        only the failing ones on the next model. An answer that validates is
+        kept right away; otherwise the strongest model's answer is kept, with
+        the remaining problems in nota. An error on a stronger model keeps the
+        previous answer.
+        extract(paths, model=...) -> {path: raw dict, or Exception}.
+        fingerprints: {path: Fingerprint}; successful answers are added to
+        the near-duplicate index under them.
+        Returns {path: normalized result, or the Exception of the first model}.
+        """
+        models = self.vision.models
+        final: Dict[str, object] = {}
+        pending = list(file_paths)
+        for level, model in enumerate(models):
+            if not pending:
+                break
+            if level:
+                print(f"   {len(pending)} failed validation, escalating to {model}...")
+            extracted = await extract(pending, model=None if level == 0 else model)
+            escalate = []
+            for file_path in pending:
+                data = extracted.get(file_path)
+                if isinstance(data, Exception):
+                    final.setdefault(file_path, data)
+                    continue
+                mapped = self._map_vision(file_path, data)
+                problems = self._vision_problems(mapped)
+                if len(models) > 1:
+                    self.telemetry.tier(model, accepted=not problems)
+                final[file_path] = (mapped, problems)
+                if problems:
+                    escalate.append(file_path)
+            pending = escalate
+
+        for file_path, outcome in final.items():
+            if isinstance(outcome, Exception):
+                continue
+            mapped, problems = outcome
+            if mapped.get("estado") == "EXITOSO":
+                if problems and len(models) > 1:
+                    # Kept with the cached answer, so a cache hit still shows it
+                    mapped["nota"] = f"Validacion: {'; '.join(problems)}"
+                self._cache_put(hashes.get(file_path), mapped, "vision")
+                # Final answer: the uploaded file is not needed for retries any more
+                self.vision.release(hashes.get(file_path))
+                fp = (fingerprints or {}).get(file_path)
+                if fp is not None and self.near_duplicates is not None:
+                    self.near_duplicates.add(fp, mapped["archivo"], mapped)
+                result = self._normalize(dict(mapped))
+            else:
+                result = mapped
+            final[file_path] = result
+        return final
+
+    def _vision_problems(self, mapped: dict) -> List[str]:
+        """Why a Vision answer should go to the next model of the cascade (empty = accept)."""
+        if len(self.vision.models) == 1:
+            return []
+        if mapped.get("estado") != "EXITOSO":
+            return [mapped.get("nota") or "Sin datos"]
+        # Receipts and non-electronic invoices have no CUFE; a present one must be well-formed
+        return validate_invoice_data(self._normalize(dict(mapped)), require_cufe=False)
+
+    def _map_vision(self, file_path: str, data: dict) -> dict:
+        """Maps raw Vision fields to our excel structure (FALLIDO dict when empty)."""
+        basename = os.path.basename(file_path)
+        if not data:
+            print(f"No data extracted from {basename}")
             return {
                 "archivo": basename,
                 "estado": "FALLIDO",
-                "nota": str(e)
+                "nota": "No se pudo extraer JSON valido"
             }
-            
+
+        # Map the fields to match our excel structure
+        mapped_data = {
+            "archivo": basename,
+            "estado": "EXITOSO",
+            "proveedor": data.get("proveedor_nombre"),
+            "nit": data.get("proveedor_nit"),
+            "direccion": data.get("proveedor_direccion"),
+            "telefono": data.get("proveedor_telefono"),
+            "ciudad": data.get("proveedor_ciudad"),
+            "factura_numero": data.get("factura_numero"),
+            "fecha": data.get("fecha_emision"),
+            "fecha_vencimiento": data.get("fecha_vencimiento"),
+            "descripcion": data.get("descripcion_general"),
+            "moneda": data.get("moneda"),
+            "base": data.get("base_imponible"),
+            "impuestos": data.get("impuestos"),
+            "total": data.get("total"),
+            "cufe": data.get("cufe")
+        }
+        return mapped_data
+
+    async def _extract_vision(self, file_path: str, sha256: Optional[str] = None,
+                              model: Optional[str] = None) -> dict:
+        """
+        Runs VisionSkill.extract_data_async under the rate limiter, retrying on
+        429 after the limiter's (server-informed) cooldown. The raw answer is
+        archived under sha256; with replay it is read back from there instead.
+        model: model of the cascade (default the first).
+        """
+        if self.replay:
+            return self._replay(sha256, model)
+        # Native async client: no executor thread is pinned while
+        # the upload, remote processing and generation are in flight.
+        return await self._call_limited(self.tokens_per_request,
+                                        partial(self.vision.extract_data_async, archive_key=sha256, model=model),
+                                        file_path, prefetch=[(file_path, sha256, None)])
+
+    async def _extract_vision_batch(self, file_paths: List[str],
+                                    hashes: Optional[Dict[str, Optional[str]]] = None,
+                                    model: Optional[str] = None) -> Dict[str, object]:
+        """
+        Extracts a batch in one request. If the batched answer is malformed,
+        has the wrong length or the call fails, the batch is split in halves
+        and retried, down to one file per request.
+        Returns {file_path: raw dict, or the Exception for that file}.
+        """
+        with self.telemetry.working_on(*file_paths):
+            return await self._extract_vision_batch_attributed(file_paths, hashes or {}, model)
+
+    async def _extract_vision_batch_attributed(self, file_paths: List[str],
+                                               hashes: Dict[str, Optional[str]],
+                                               model: Optional[str] = None) -> Dict[str, object]:
+        if len(file_paths) == 1 or self.replay:
+            extracted = {}
+            for file_path in file_paths:
+                try:
+                    extracted[file_path] = await self._extract_vision(file_path, hashes.get(file_path), model)
+                except Exception as e:
+                    extracted[file_path] = e
+            return extracted
+
+        try:
+            extracted = await self._call_limited(
+                self.tokens_per_request * len(file_paths),
+                partial(self.vision.extract_batch_async, archive_keys=[hashes.get(f) for f in file_paths],
+                        model=model),
+                file_paths,
+                prefetch=[(f, hashes.get(f), None) for f in file_paths]
+            )
+        except Exception as e:
+            if is_rate_limit_error(e):
+                # Splitting would only multiply requests against an exhausted quota
+                return {f: e for f in file_paths}
+            print(f"   batched extraction failed ({e}), splitting batch of {len(file_paths)}.")
+            extracted = None
+
+        if extracted is not None:
+            return dict(zip(file_paths, extracted))
+
+        middle = len(file_paths) // 2
+        halves = await asyncio.gather(
+            self._extract_vision_batch(file_paths[:middle], hashes, model),
+            self._extract_vision_batch(file_paths[middle:], hashes, model),
+        )
+        return {**halves[0], **halves[1]}
+
+    async def _call_limited(self, tokens: int, func, *args,
+                            prefetch: Optional[List[Tuple[str, Optional[str], Optional[Tuple[bytes, str]]]]] = None):
+        """
+        Awaits func(*args, client=...) while holding a RateLimiter lease,
+        retrying on 429 after the limiter's (server-informed) cooldown. With a
+        KeyPool the lease picks the API key, and a retry may land on another.
+        prefetch: [(file_path, sha256, payload)] to upload while waiting for
+        the lease (see VisionSkill.prefetch); the first attempt prefers the
+        key they were uploaded with.
+        """
+        prefer = self._prefetch(prefetch) if prefetch else None
+        for attempt in range(self.max_rate_limit_retries):
+            if attempt:
+                self.telemetry.count("retries")
+            waiting = time.perf_counter()
+            async with self.limiter.acquire(tokens, prefer=None if attempt else prefer) as lease:
+                self.telemetry.record("throttle", time.perf_counter() - waiting)
+                with self.telemetry.using_key(lease.label):
+                    self.telemetry.count("calls")
+                    try:
+                        return await func(*args, client=lease.client)
+                    except Exception as e:
+                        if not is_rate_limit_error(e):
+                            raise
+                        self.telemetry.count("rate_limited")
+                        lease.report_rate_limited(retry_delay_from_error(e))
+                        if attempt == self.max_rate_limit_retries - 1:
+                            raise
+        return None
+
+    def _prefetch(self, uploads: List[Tuple[str, Optional[str], Optional[Tuple[bytes, str]]]]) -> Optional[str]:
+        """
+        Starts preparing and uploading the files of a call before it waits
+        for the limiter, so uploads overlap the throttle wait and the
+        generate calls in flight. Returns the key label they go to (None
+        when every file goes inline, so any key will do).
+        """
+        label, client = None, None
+        if any(self.vision.may_upload(file_path, payload) for file_path, _, payload in uploads):
+            label, client = self.limiter.upload_target()
+        with self.telemetry.using_key(label):
+            for file_path, sha256, payload in uploads:
+                self.vision.prefetch(file_path, payload, sha256, client)
+        return label
+
+    def _replay(self, sha256: Optional[str], model: Optional[str] = None) -> dict:
+        """
+        Parses the archived raw answer for a file hash (--replay, no API call).
+        For the stronger models of the cascade only their own answer counts.
+        """
+        raw = None
+        if sha256 and self.archive is not None:
+            raw = self.archive.get(sha256, model or self.vision.model_name, PROMPT_VERSION, exact=model is not None)
+        if raw is None:
+            raise NotArchived("no archived Gemini answer")
+        return self.vision.parse_text(raw)
+
+    async def _check_duplicate(self, file_path: str, sha256: Optional[str], content: Optional[bytes] = None,
+                               text: Optional[str] = None) -> Tuple[Optional[Fingerprint], Optional[dict]]:
+        """
+        Fingerprints a file that is about to go to Vision and looks it up in
+        the near-duplicate index (text: first-page text, if already read).
+        Returns (fingerprint or None, linked result or None): a match reuses
+        the earlier record, marked as a duplicate.
+        """
+        if self.near_duplicates is None:
+            return None, None
+        loop = asyncio.get_event_loop()
+        with self.telemetry.span("fingerprint"):
+            fp = await loop.run_in_executor(None, fingerprint, file_path, content, sha256, text)
+            match = self.near_duplicates.find(fp)
+        if match is None:
+            return fp, None
+
+        basename = os.path.basename(file_path)
+        print(f"   near-duplicate of {match.archivo} ({match.method}, {match.score}), skipping Vision.")
+        self.near_duplicates.record_suppressed(basename, match)
+        self.telemetry.count("near_duplicates")
+        linked = dict(match.record)
+        linked.update(archivo=basename, estado="EXITOSO (DUPLICADO)", nota=f"Duplicado de {match.archivo}")
+        return fp, self._normalize(linked)
+
+    async def _hash_file(self, file_path: str) -> str:
+        """SHA-256 of a file, read once per processing (kept in file_hashes)."""
+        sha256 = self.file_hashes.get(file_path)
+        if sha256 is None:
+            loop = asyncio.get_event_loop()
+            with self.telemetry.span("hash"):
+                sha256 = await loop.run_in_executor(None, file_sha256, file_path)
+            self.file_hashes[file_path] = sha256
+        return sha256
+
+    @property
+    def _needs_hash(self) -> bool:
+        # The file hash keys the extraction cache, the response archive, the
+        # near-duplicate index and the uploaded-file handles
+        return (self.cache is not None or self.archive is not None or self.near_duplicates is not None
+                or self.vision.remote_files is not None)
+
+    async def aclose(self):
+        """Finishes background work (e.g. deleting uploaded files) before exit."""
+        await self.vision.aclose()
+
+    def _cache_put(self, sha256: Optional[str], data: dict, source: str):
+        # Store a copy: normalize_data mutates the dict in place, and we want
+        # the cache to hold pre-normalization values so rule changes still apply.
+        if self.cache is None or not sha256:
+            return
+        if source == "vision":
+            self.cache.put(sha256, dict(data), source, self.vision.model_key, PROMPT_VERSION)
+        else:
+            self.cache.put(sha256, dict(data), source)
+
     def _normalize(self, data: dict) -> dict:
         from utils import normalize_data
-        return normalize_data(data)
+        with self.telemetry.span("normalize"):
+            return normalize_data(data)
@@ -0,0 +1,189 @@
+import re
+import time
+import asyncio
+from typing import Optional, Tuple
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED errors raised by the genai SDK (or a fake client)."""
+    if getattr(error, "code", None) == 429:
+        return True
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "ResourceExhausted" in text
+
+
+def retry_delay_from_error(error: Exception) -> Optional[float]:
+    """
+    Extracts the server-suggested retry delay in seconds, if any.
+    Gemini reports it as a google.rpc.RetryInfo detail ("retryDelay": "37s")
+    and/or in the message ("Please retry in 37.2s").
+    """
+    text = f"{getattr(error, 'details', '')} {error}"
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", text)
+    if not match:
+        match = re.search(r"retry in (\d+(?:\.\d+)?)\s*s", text, re.IGNORECASE)
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            return None
+    return None
+
+
+class RateLimiter:
+    """
+    Async token-bucket scheduler for Gemini calls.
+    Enforces requests-per-minute, tokens-per-minute (0 = unlimited) and a
+    concurrency cap. On a 429 it pauses all callers for the server's retry
+    delay (or an exponential backoff) and halves the request rate; each
+    success then recovers the rate additively up to the configured budget.
+    """
+
+    def __init__(self, rpm: float = 4, tpm: float = 0, concurrency: int = 1,
+                 min_rate_fraction: float = 0.1, max_backoff: float = 120.0,
+                 name: Optional[str] = None):
+        # Shown in log lines when several limiters run side by side (key pool)
+        self.name = name
+        self.rpm = float(rpm)
+        self.tpm = float(tpm)
+        self.concurrency = max(1, int(concurrency))
+        self.min_rpm = max(0.1, self.rpm * min_rate_fraction)
+        self.max_backoff = max_backoff
+
+        self.effective_rpm = self.rpm
+        self.cooldown_until = 0.0
+        self.consecutive_429 = 0
+
+        # Buckets start full so the first calls go out immediately
+        self._request_capacity = max(1.0, self.rpm / 60.0)
+        self._request_tokens = self._request_capacity
+        self._token_capacity = self.tpm
+        self._token_tokens = self.tpm
+        self._last_refill = time.monotonic()
+
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._lock = asyncio.Lock()
+
+        self.requests = 0
+        self.rate_limited = 0
+
+    def acquire(self, tokens: int = 0, prefer: Optional[str] = None) -> "RateLimitLease":
+        """
+        prefer: key label to lease if possible (key_pool.KeyPool); a single
+        limiter has one budget, so it is ignored here.
+        Usage:
+            async with limiter.acquire(estimated_tokens) as lease:
+                try:
+                    ...call the API...
+                except Exception as e:
+                    if is_rate_limit_error(e):
+                        lease.report_rate_limited(retry_delay_from_error(e))
+                    raise
+        """
+        return RateLimitLease(self, tokens)
+
+    def upload_target(self) -> Tuple[Optional[str], object]:
+        """(key label, client) that files should be uploaded with ahead of a call: the default client."""
+        return None, None
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_tokens = min(
+            self._request_capacity,
+            self._request_tokens + elapsed * self.effective_rpm / 60.0,
+        )
+        if self.tpm:
+            self._token_tokens = min(
+                self._token_capacity,
+                self._token_tokens + elapsed * self.tpm / 60.0,
+            )
+
+    async def _wait_for_budget(self, tokens: int):
+        async with self._lock:
+            while True:
+                wait = self._reserve(tokens)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Takes one request (and tokens) from the buckets if they are available
+        now and returns 0; otherwise takes nothing and returns the seconds
+        until they should be (cooldown included).
+        """
+        # Tokens larger than the bucket would never fit; charge a full bucket instead
+        tokens = min(tokens, self._token_capacity) if self.tpm else 0
+
+        now = time.monotonic()
+        if now < self.cooldown_until:
+            return self.cooldown_until - now
+
+        self._refill(now)
+        wait = 0.0
+        if self._request_tokens < 1:
+            wait = (1 - self._request_tokens) * 60.0 / self.effective_rpm
+        if self.tpm and self._token_tokens < tokens:
+            wait = max(wait, (tokens - self._token_tokens) * 60.0 / self.tpm)
+
+        if wait <= 0:
+            self._request_tokens -= 1
+            self._token_tokens -= tokens
+            self.requests += 1
+        return wait
+
+    def _on_success(self):
+        self.consecutive_429 = 0
+        if self.effective_rpm < self.rpm:
+            self.effective_rpm = min(self.rpm, self.effective_rpm + self.rpm * 0.1)
+
+    def _on_rate_limited(self, retry_delay: Optional[float]):
+        self.rate_limited += 1
+        self.consecutive_429 += 1
+        self.effective_rpm = max(self.min_rpm, self.effective_rpm / 2)
+
+        if retry_delay is None:
+            retry_delay = min(self.max_backoff, 5.0 * (2 ** (self.consecutive_429 - 1)))
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_delay)
+        # Drain the request bucket so the recovery ramps up from the new rate
+        self._request_tokens = min(self._request_tokens, 0.0)
+        prefix = f"[{self.name}] " if self.name else ""
+        print(f"{prefix}Rate limit hit. Pausing {retry_delay:.1f}s, rate now {self.effective_rpm:.1f} RPM.")
+
+    def adjust_tokens(self, estimated: int, actual: int):
+        """Corrects the TPM bucket once the real token usage of a call is known."""
+        if self.tpm:
+            self._token_tokens -= actual - estimated
+
+
+class RateLimitLease:
+    """Async context manager holding one concurrency slot for a single API call."""
+
+    # Single budget: the caller's own client, no key label (see key_pool.KeyLease)
+    client = None
+    label = None
+
+    def __init__(self, limiter: RateLimiter, tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self._rate_limited = False
+
+    def report_rate_limited(self, retry_delay: Optional[float] = None):
+        self._rate_limited = True
+        self.limiter._on_rate_limited(retry_delay)
+
+    async def __aenter__(self) -> "RateLimitLease":
+        await self.limiter._semaphore.acquire()
+        try:
+            await self.limiter._wait_for_budget(self.tokens)
+        except BaseException:
+            self.limiter._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None and not self._rate_limited:
+            self.limiter._on_success()
+        self.limiter._semaphore.release()
+        return False
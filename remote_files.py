@@ -0,0 +1,102 @@
+import os
+import time
+import sqlite3
+from typing import NamedTuple, Optional
+
+# Gemini keeps uploaded files for 48 hours; used when an upload does not
+# report its expiration_time
+DEFAULT_RETENTION_SECONDS = 48 * 3600
+# A handle this close to expiring is not reused: the file must outlive the call
+REUSE_MARGIN_SECONDS = 15 * 60
+
+
+class RemoteFile(NamedTuple):
+    name: str
+    uri: str
+    mime_type: str
+    expires_at: float
+
+
+class RemoteFileCache:
+    """
+    Handles of files uploaded to the Gemini Files API, keyed by the SHA-256
+    of the local file and the account (API key / project) that uploaded it:
+    an uploaded file only exists for that account. A retry, the next model
+    of the cascade or a later run within the server-side retention window
+    references the uploaded file again instead of uploading it from scratch.
+    variant identifies how the bytes were prepared (preprocessor settings),
+    so a change there uploads again.
+    """
+
+    def __init__(self, db_path: str, variant: str = ""):
+        self.db_path = db_path
+        self.variant = variant
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS remote_files (
+                sha256 TEXT NOT NULL,
+                account TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                name TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                mime_type TEXT,
+                expires_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sha256, account, variant)
+            )
+            """
+        )
+        self.conn.commit()
+        self.evict()
+
+    def get(self, sha256: str, account: str) -> Optional[RemoteFile]:
+        """Handle of a still-live upload of this file by this account, or None."""
+        row = self.conn.execute(
+            "SELECT name, uri, mime_type, expires_at FROM remote_files "
+            "WHERE sha256 = ? AND account = ? AND variant = ?",
+            (sha256, account, self.variant),
+        ).fetchone()
+        if row is None or row[3] - time.time() < REUSE_MARGIN_SECONDS:
+            return None
+        return RemoteFile(*row)
+
+    def put(self, sha256: str, account: str, name: str, uri: str, mime_type: Optional[str],
+            expires_at: Optional[float] = None):
+        now = time.time()
+        self.conn.execute(
+            """
+            INSERT OR REPLACE INTO remote_files
+                (sha256, account, variant, name, uri, mime_type, expires_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (sha256, account, self.variant, name, uri, mime_type,
+             expires_at or now + DEFAULT_RETENTION_SECONDS, now),
+        )
+        self.conn.commit()
+
+    def discard(self, sha256: str, account: Optional[str] = None):
+        """Forgets the handles of a file (one account, or all of them)."""
+        if account is None:
+            self.conn.execute("DELETE FROM remote_files WHERE sha256 = ?", (sha256,))
+        else:
+            self.conn.execute("DELETE FROM remote_files WHERE sha256 = ? AND account = ?", (sha256, account))
+        self.conn.commit()
+
+    def accounts(self, sha256: str) -> list:
+        """[(account, name)] of every upload of this file that has a handle."""
+        return self.conn.execute(
+            "SELECT account, name FROM remote_files WHERE sha256 = ?", (sha256,)
+        ).fetchall()
+
+    def evict(self):
+        """Drops the handles of files the server has already deleted."""
+        self.conn.execute("DELETE FROM remote_files WHERE expires_at < ?", (time.time(),))
+        self.conn.commit()
+
+    def close(self):
+        self.evict()
+        self.conn.close()
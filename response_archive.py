@@ -0,0 +1,80 @@
+import os
+import time
+import zlib
+import sqlite3
+from typing import Optional
+
+
+class NotArchived(LookupError):
+    """--replay found no archived answer for a file that needs Vision."""
+
+
+class ResponseArchive:
+    """
+    Append-only archive of the raw Gemini answers (the JSON text before any
+    parsing, mapping or normalization), zlib-compressed and keyed by the
+    SHA-256 of the input file, the model and the prompt version.
+    Used by --replay to rebuild the output without calling the API, e.g.
+    after a change to normalize_data or to the Vision field mapping.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                sha256 TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                raw BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sha256, model, prompt_version)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def put(self, sha256: str, model: str, prompt_version: str, raw: str):
+        """Stores one raw answer, replacing an older one for the same key."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (sha256, model, prompt_version, raw, created_at) VALUES (?, ?, ?, ?, ?)",
+            (sha256, model, prompt_version, zlib.compress(raw.encode("utf-8"), 6), time.time()),
+        )
+        self.conn.commit()
+        self.stored += 1
+
+    def get(self, sha256: str, model: Optional[str] = None, prompt_version: Optional[str] = None,
+            exact: bool = False) -> Optional[str]:
+        """
+        Raw answer for a file hash. The given model / prompt version are
+        preferred; otherwise the most recent answer for the hash is returned
+        (unless exact, e.g. for the stronger models of a cascade).
+        """
+        row = self.conn.execute(
+            """
+            SELECT raw FROM responses WHERE sha256 = ?
+            AND (? = 0 OR (model = ? AND prompt_version = ?))
+            ORDER BY (model = ? AND prompt_version = ?) DESC, created_at DESC
+            LIMIT 1
+            """,
+            (sha256, int(exact), model, prompt_version, model, prompt_version),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
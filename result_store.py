@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import sqlite3
+from typing import Dict, List, Optional, Set
+
+
+class ResultStore:
+    """
+    Append-only local store for processed invoices (SQLite, one committed row
+    per record). It is the source of truth during a run; the Excel workbook is
+    produced from it in one shot by export_excel, so a crash can never leave
+    a half-written .xlsx behind.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        # WAL + NORMAL: each commit is durable against process crashes and cheap
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ruta TEXT,
+                archivo TEXT,
+                estado TEXT,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_ruta ON results (ruta)")
+        self.conn.commit()
+
+    def append(self, record: Dict, ruta: Optional[str] = None):
+        """Appends one record and commits it immediately."""
+        self.conn.execute(
+            "INSERT INTO results (ruta, archivo, estado, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (
+                ruta,
+                record.get("archivo"),
+                record.get("estado"),
+                json.dumps(record, ensure_ascii=False, default=str),
+                time.time(),
+            ),
+        )
+        self.conn.commit()
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def records(self, latest_only: bool = True) -> List[Dict]:
+        """
+        All stored records in insertion order. With latest_only, a file that
+        was processed several times (e.g. FALLIDO, then EXITOSO) contributes
+        only its last record. Rows without ruta (imported from an old
+        workbook) are always kept.
+        """
+        if latest_only:
+            rows = self.conn.execute(
+                """
+                SELECT data FROM results
+                WHERE ruta IS NULL
+                   OR id IN (SELECT MAX(id) FROM results WHERE ruta IS NOT NULL GROUP BY ruta)
+                ORDER BY id
+                """
+            )
+        else:
+            rows = self.conn.execute("SELECT data FROM results ORDER BY id")
+        return [json.loads(data) for (data,) in rows]
+
+    def successful_archivos(self) -> Set[str]:
+        """Basenames whose latest record is successful (EXITOSO, EXITOSO (XML), ...)."""
+        return {
+            r.get("archivo") for r in self.records()
+            if str(r.get("estado") or "").startswith("EXITOSO") and r.get("archivo")
+        }
+
+    def import_excel(self, filename: str) -> int:
+        """
+        One-time migration: loads the rows of a workbook written by older
+        versions (append-per-batch) so the next export keeps them.
+        """
+        import pandas as pd
+
+        df = pd.read_excel(filename)
+        df = df.astype(object).where(df.notna(), None)
+        rows = df.to_dict(orient="records")
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO results (ruta, archivo, estado, data, created_at) VALUES (NULL, ?, ?, ?, ?)",
+            [
+                (
+                    str(r.get("archivo")) if r.get("archivo") is not None else None,
+                    r.get("estado"),
+                    json.dumps(r, ensure_ascii=False, default=str),
+                    now,
+                )
+                for r in rows
+            ],
+        )
+        self.conn.commit()
+        return len(rows)
+
+    def export_excel(self, filename: str) -> int:
+        """Writes the whole workbook from the store in one go. Returns row count."""
+        from utils import write_excel
+
+        records = self.records()
+        write_excel(records, filename)
+        return len(records)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import contextvars
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+# Files the current task is working on (set by InvoiceProcessor), so spans
+# deep inside VisionSkill are attributed without passing file names around
+current_files: contextvars.ContextVar = contextvars.ContextVar("current_files", default=())
+# API key (label) of the call in progress, for per-key accounting with a key pool
+current_key: contextvars.ContextVar = contextvars.ContextVar("current_key", default=None)
+
+# Summary order of the stages
+STAGES = [
+    "scan", "hash", "xml_parse", "split", "text_layer", "fingerprint", "preprocess", "throttle", "upload",
+    "remote_poll", "generate", "json_parse", "normalize", "persist", "excel_export",
+]
+
+
+class Telemetry:
+    """
+    Per-stage timings, token usage and retry / 429 counts.
+
+    Spans are summed per file and per stage. When a file is finished (its
+    result persisted) one JSON line is appended to trace_path; summary()
+    aggregates the whole run (count, total, p50/p95/max per stage, tokens,
+    outcomes) and can also be written as a Prometheus textfile.
+    Without paths it only keeps the in-memory aggregates.
+    """
+
+    def __init__(self, trace_path: Optional[str] = None):
+        self.trace_path = trace_path
+        self.started = time.time()
+        self.samples: Dict[str, array] = {}
+        self.counters: Dict[str, int] = {}
+        self.tokens: Dict[str, int] = {"prompt": 0, "output": 0, "total": 0}
+        self.outcomes: Dict[str, int] = {}
+        # Per API key (key_pool): calls, 429s and tokens
+        self.keys: Dict[str, Dict[str, int]] = {}
+        # Per model of the Vision cascade: answers checked and accepted
+        self.tiers: Dict[str, Dict[str, int]] = {}
+        self.files = 0
+        self._open: Dict[str, Dict] = {}
+        self._trace = None
+        if trace_path:
+            os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+            self._trace = open(trace_path, "a", encoding="utf-8")
+
+    @contextmanager
+    def working_on(self, *files: str):
+        """Attributes the spans recorded inside the block to files."""
+        token = current_files.set(files)
+        try:
+            yield
+        finally:
+            current_files.reset(token)
+
+    @contextmanager
+    def using_key(self, label: Optional[str]):
+        """Charges the calls, counters and tokens inside the block to an API key."""
+        token = current_key.set(label)
+        try:
+            yield
+        finally:
+            current_key.reset(token)
+
+    @contextmanager
+    def span(self, stage: str, files: Optional[Iterable[str]] = None):
+        """Times the block as one sample of stage (works around awaits too)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started, files)
+
+    def record(self, stage: str, seconds: float, files: Optional[Iterable[str]] = None):
+        """Adds a timing measured elsewhere (e.g. in an XML lane process)."""
+        self.samples.setdefault(stage, array("d")).append(seconds)
+        for entry in self._entries(files):
+            entry["stages"][stage] = entry["stages"].get(stage, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1, files: Optional[Iterable[str]] = None):
+        """Increments a counter (rate_limited, retries, json_failed, ...)."""
+        self.counters[name] = self.counters.get(name, 0) + n
+        key = self._key()
+        if key is not None:
+            key[name] = key.get(name, 0) + n
+        for entry in self._entries(files):
+            entry["counters"][name] = entry["counters"].get(name, 0) + n
+
+    def add_usage(self, usage, files: Optional[Iterable[str]] = None):
+        """Adds the usage_metadata of a generate_content response (split evenly over a batch)."""
+        if usage is None:
+            return
+        counts = {
+            "prompt": getattr(usage, "prompt_token_count", None) or 0,
+            "output": getattr(usage, "candidates_token_count", None) or 0,
+            "total": getattr(usage, "total_token_count", None) or 0,
+        }
+        key = self._key()
+        for kind, n in counts.items():
+            self.tokens[kind] += n
+            if key is not None:
+                key[kind] = key.get(kind, 0) + n
+        entries = self._entries(files)
+        for entry in entries:
+            for kind, n in counts.items():
+                entry["tokens"][kind] = entry["tokens"].get(kind, 0) + n / len(entries)
+
+    def tier(self, model: str, accepted: bool):
+        """Counts one Vision answer of a cascade model and whether it passed validation."""
+        tier = self.tiers.setdefault(model, {"tried": 0, "accepted": 0})
+        tier["tried"] += 1
+        tier["accepted"] += int(accepted)
+
+    def finish(self, file: str, estado: Optional[str], nota: Optional[str] = None,
+               label: Optional[str] = None):
+        """Closes the trace of a file once its result is persisted (label: name shown in the trace)."""
+        self.files += 1
+        key = estado or "SIN_RESULTADO"
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+        entry = self._open.pop(file, None) or self._new_entry()
+        if self._trace is None:
+            return
+        line = {
+            "file": label or file,
+            "estado": estado,
+            "wall_s": round(time.perf_counter() - entry["opened"], 6),
+            "stages": {k: round(v, 6) for k, v in entry["stages"].items()},
+            "tokens": {k: round(v, 1) for k, v in entry["tokens"].items()},
+            "counters": entry["counters"],
+        }
+        if nota:
+            line["nota"] = nota
+        self._trace.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self._trace.flush()
+
+    def summary(self) -> Dict:
+        elapsed = time.time() - self.started
+        stages = {}
+        for stage in sorted(self.samples, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            values = sorted(self.samples[stage])
+            stages[stage] = {
+                "count": len(values),
+                "total_s": round(sum(values), 6),
+                "p50_s": round(_percentile(values, 50), 6),
+                "p95_s": round(_percentile(values, 95), 6),
+                "max_s": round(values[-1], 6),
+            }
+        return {
+            "started_at": self.started,
+            "elapsed_s": round(elapsed, 3),
+            "files": self.files,
+            "files_per_s": round(self.files / elapsed, 3) if elapsed else None,
+            "outcomes": self.outcomes,
+            "stages": stages,
+            "tokens": self.tokens,
+            "counters": self.counters,
+            "keys": self.keys,
+            "tiers": {
+                model: {**t, "hit_rate": round(t["accepted"] / t["tried"], 4) if t["tried"] else None}
+                for model, t in self.tiers.items()
+            },
+        }
+
+    def write_summary(self, path: str) -> Dict:
+        summary = self.summary()
+        _write_atomic(path, json.dumps(summary, indent=2, ensure_ascii=False))
+        return summary
+
+    def write_prometheus(self, path: str):
+        """Prometheus textfile (node_exporter textfile collector format)."""
+        summary = self.summary()
+        out = [
+            "# HELP facturas_stage_seconds Time spent per stage.",
+            "# TYPE facturas_stage_seconds summary",
+        ]
+        for stage, s in summary["stages"].items():
+            out.append(f'facturas_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50_s"]}')
+            out.append(f'facturas_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95_s"]}')
+            out.append(f'facturas_stage_seconds_sum{{stage="{stage}"}} {s["total_s"]}')
+            out.append(f'facturas_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+        out += ["# HELP facturas_tokens_total Gemini tokens reported in usage_metadata.",
+                "# TYPE facturas_tokens_total counter"]
+        out += [f'facturas_tokens_total{{kind="{k}"}} {v}' for k, v in summary["tokens"].items()]
+        out += ["# HELP facturas_events_total Retries, 429s and unparsable answers.",
+                "# TYPE facturas_events_total counter"]
+        out += [f'facturas_events_total{{event="{k}"}} {v}' for k, v in summary["counters"].items()]
+        if summary["keys"]:
+            out += ["# HELP facturas_key_total Calls, 429s and tokens per API key.",
+                    "# TYPE facturas_key_total counter"]
+            out += [f'facturas_key_total{{key="{_label(key)}",kind="{k}"}} {v}'
+                    for key, usage in summary["keys"].items() for k, v in usage.items()]
+        if summary["tiers"]:
+            out += ["# HELP facturas_tier_total Vision answers per cascade model, tried and accepted by validation.",
+                    "# TYPE facturas_tier_total counter"]
+            out += [f'facturas_tier_total{{model="{_label(model)}",kind="{k}"}} {t[k]}'
+                    for model, t in summary["tiers"].items() for k in ("tried", "accepted")]
+        out += ["# HELP facturas_files_total Files persisted, by estado.",
+                "# TYPE facturas_files_total counter"]
+        out += [f'facturas_files_total{{estado="{_label(k)}"}} {v}' for k, v in summary["outcomes"].items()]
+        out += ["# HELP facturas_run_seconds Wall time of the run.",
+                "# TYPE facturas_run_seconds gauge",
+                f"facturas_run_seconds {summary['elapsed_s']}"]
+        _write_atomic(path, "\n".join(out) + "\n")
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        lines = [f"{'stage':<14}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}"]
+        for stage, s in summary["stages"].items():
+            lines.append(f"{stage:<14}{s['count']:>8}{s['total_s']:>10.2f}"
+                         f"{s['p50_s'] * 1000:>10.1f}{s['p95_s'] * 1000:>10.1f}")
+        t = summary["tokens"]
+        lines.append(f"Tokens: {t['prompt']} prompt, {t['output']} output, {t['total']} total.")
+        if summary["tiers"]:
+            lines.append("Model cascade: " + ", ".join(
+                f"{model} {t['accepted']}/{t['tried']} accepted ({t['hit_rate']:.0%})"
+                for model, t in summary["tiers"].items()))
+        if summary["counters"]:
+            lines.append("Events: " + ", ".join(f"{k} {v}" for k, v in sorted(summary["counters"].items())))
+        return "\n".join(lines)
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+    def _key(self) -> Optional[Dict[str, int]]:
+        label = current_key.get()
+        if label is None:
+            return None
+        return self.keys.setdefault(label, {})
+
+    def _entries(self, files: Optional[Iterable[str]]):
+        files = current_files.get() if files is None else tuple(files)
+        entries = []
+        for file in files:
+            entry = self._open.get(file)
+            if entry is None:
+                entry = self._open[file] = self._new_entry()
+            entries.append(entry)
+        return entries
+
+    def _new_entry(self) -> Dict:
+        return {"opened": time.perf_counter(), "stages": {}, "tokens": {}, "counters": {}}
+
+
+def _percentile(values, q: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _write_atomic(path: str, text: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
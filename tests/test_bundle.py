@@ -0,0 +1,80 @@
+import asyncio
+import io
+import random
+import zipfile
+
+import pytest
+
+pytest.importorskip("pypdf")
+
+from benchmark import attached_document_xml, invoice_xml
+from bundle import scan_bundle
+from processor import InvoiceProcessor
+from test_pdf_splitter import _pdf
+from xml_skill import XmlSkill
+
+
+def _invoice(build, number: str, seed: int):
+    text = build(number, random.Random(seed), lines=1)
+    return text, XmlSkill().extract_stream(io.BytesIO(text.encode("utf-8")), f"{number}.xml")
+
+
+def _zip(path, members):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    return str(path)
+
+
+def test_pdfs_are_paired_with_their_xml_by_content(tmp_path):
+    by_cufe, first = _invoice(attached_document_xml, "FE101", 1)
+    by_number, second = _invoice(invoice_xml, "FE102", 2)
+    cufe = first["cufe"]
+    zip_path = _zip(tmp_path / "paquete.zip", {
+        # File names say nothing: the second XML is listed first, the PDFs are numbered
+        "ad0002.xml": by_number,
+        "ad0001.xml": by_cufe,
+        "docs/1.pdf": _pdf([["Factura electronica de venta", f"CUFE: {cufe[:48]}", cufe[48:]]]),
+        "docs/2.pdf": _pdf([["Factura electronica de venta No. FE102", "Total 1.190.000"]]),
+        "docs/3.pdf": _pdf([["Cuenta de cobro 55"]]),
+        "__MACOSX/docs/._1.pdf": b"resource fork",
+    })
+
+    scanned = scan_bundle(zip_path, with_hash=True)
+
+    paired = {member: data["factura_numero"] for member, data, _ in scanned["invoices"]}
+    assert paired == {"docs/1.pdf": "FE101", "docs/2.pdf": "FE102"}
+    assert all(sha256 for _, _, sha256 in scanned["invoices"])
+    assert scanned["pending"] == ["docs/3.pdf"]
+
+
+def test_last_invoice_and_document_are_paired_without_text(tmp_path):
+    text, _ = _invoice(invoice_xml, "FE201", 3)
+    zip_path = _zip(tmp_path / "escaneado.zip", {"factura.xml": text, "escaneo.png": b"not a real scan"})
+
+    scanned = scan_bundle(zip_path)
+
+    assert [(member, sha256) for member, _, sha256 in scanned["invoices"]] == [("escaneo.png", None)]
+    assert scanned["pending"] == []
+
+
+def test_bundle_lane_labels_results_with_the_paired_member(tmp_path):
+    text, _ = _invoice(attached_document_xml, "FE301", 4)
+    zip_path = _zip(tmp_path / "paquete.zip", {
+        "ad.xml": text,
+        "FE301.pdf": _pdf([["Factura electronica de venta No. FE301"]]),
+        "anexo.pdf": _pdf([["Remision de mercancia"]]),
+    })
+    broken = tmp_path / "roto.zip"
+    broken.write_bytes(b"not a zip")
+    processor = InvoiceProcessor("", replay=True)
+
+    results, pending = asyncio.run(processor.process_bundle_lane([zip_path, str(broken)]))
+
+    [(label, result)] = results[zip_path]
+    assert label == str(tmp_path / "paquete.zip" / "FE301.pdf")
+    assert result["archivo"] == "paquete.zip/FE301.pdf"
+    assert result["estado"] == "EXITOSO (XML)"
+    assert pending[zip_path] == ["anexo.pdf"]
+    assert results[str(broken)][0][1]["estado"] == "FALLIDO"
+    assert pending[str(broken)] == []
@@ -0,0 +1,35 @@
+import asyncio
+
+from extraction_cache import ExtractionCache
+from processor import InvoiceProcessor
+from utils import file_sha256
+
+ANSWER = {
+    "proveedor_nombre": "FERRETERIA EL PERNO SAS",
+    "proveedor_nit": "900123456-8",
+    "factura_numero": None,  # fails validation on every model
+    "fecha_emision": "2025-02-01",
+    "base_imponible": 1000.0,
+    "impuestos": 190.0,
+    "total": 1190.0,
+}
+
+
+def test_validation_note_survives_a_cache_hit(tmp_path):
+    path = tmp_path / "factura.png"
+    path.write_bytes(b"not really a picture")
+    sha256 = file_sha256(str(path))
+    processor = InvoiceProcessor("", cache=ExtractionCache(str(tmp_path / "cache.sqlite")), replay=True,
+                                 use_text_layer=False, models=["modelo-rapido", "modelo-fuerte"])
+
+    async def extract(paths, model=None):
+        return {p: dict(ANSWER) for p in paths}
+
+    async def run():
+        first = (await processor._vision_cascade([str(path)], {str(path): sha256}, extract))[str(path)]
+        again = await processor.process_file(str(path))
+        return first, again
+
+    first, again = asyncio.run(run())
+    assert first["nota"].startswith("Validacion: Numero de factura ausente")
+    assert again["nota"] == first["nota"]
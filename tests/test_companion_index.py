@@ -0,0 +1,59 @@
+import os
+
+from companion_index import CompanionIndex
+
+CUFE = "ab" * 48
+
+
+def _index(*xml_paths):
+    index = CompanionIndex()
+    for xml_path in xml_paths:
+        index.add_xml(xml_path)
+    return index
+
+
+def test_same_stem_in_the_same_directory():
+    index = _index(os.path.join("enero", "FE-1234.xml"), os.path.join("febrero", "FE-1234.xml"))
+    assert index.lookup(os.path.join("febrero", "fe_1234.pdf")) == os.path.join("febrero", "FE-1234.xml")
+    assert index.lookup(os.path.join("marzo", "FE-1234.pdf")) is None
+
+
+def test_stem_matching_the_invoice_number_of_a_parsed_xml():
+    xml = os.path.join("in", "ad0900123456000250000001.xml")
+    index = _index(xml)
+    index.add_invoice(xml, {"factura_numero": "FE-1234", "nit": "900123456-8"})
+    assert index.lookup(os.path.join("in", "FE1234.pdf")) == xml
+    # Each XML goes to one document only
+    assert index.lookup(os.path.join("in", "fe-1234 copia.pdf")) is None
+
+
+def test_ambiguous_number_prefers_the_same_directory():
+    here, there = os.path.join("a", "1.xml"), os.path.join("b", "2.xml")
+    index = _index(here, there)
+    for xml in (here, there):
+        index.add_invoice(xml, {"factura_numero": "FE-9"})
+    assert index.lookup(os.path.join("b", "FE9.pdf")) == there
+    assert index.lookup(os.path.join("c", "FE9.pdf")) == here  # the only one left
+
+
+def test_stem_containing_the_cufe():
+    xml = os.path.join("in", "ad.xml")
+    index = _index(xml)
+    index.add_invoice(xml, {"factura_numero": "FE-1", "cufe": CUFE.upper()})
+    assert index.lookup(os.path.join("in", f"factura_{CUFE}.pdf")) == xml
+
+
+def test_content_lookup_by_cufe_then_number_and_nit():
+    by_cufe, ours, theirs = "x1.xml", "x2.xml", "x3.xml"
+    index = _index(by_cufe, ours, theirs)
+    index.add_invoice(by_cufe, {"factura_numero": "FE-5", "cufe": CUFE})
+    index.add_invoice(ours, {"factura_numero": "FE-7", "nit": "900123456-8"})
+    index.add_invoice(theirs, {"factura_numero": "FE-7", "nit": "800555444"})
+
+    assert index.lookup_content("scan.pdf", cufe=CUFE.upper(), number="FE-7") == by_cufe
+    # Same number from two suppliers: only the NIT decides
+    assert index.lookup_content("a.pdf", number="FE-7") is None
+    assert index.lookup_content("a.pdf", number="fe 7", nit="811222333") is None
+    assert index.lookup_content("a.pdf", number="fe 7", nit="900123456-8") == ours
+    assert index.assigned == {"scan.pdf": by_cufe, "a.pdf": ours}
+    assert index.unclaimed() == []
@@ -0,0 +1,57 @@
+import time
+
+import extraction_cache
+from extraction_cache import ExtractionCache
+
+RECORD = {"archivo": "a.pdf", "estado": "EXITOSO", "total": 1000}
+
+
+def _cache(tmp_path, **kwargs) -> ExtractionCache:
+    return ExtractionCache(str(tmp_path / "cache.sqlite"), **kwargs)
+
+
+def test_vision_entries_go_stale_on_model_or_prompt_change(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put("a" * 64, RECORD, "vision", "modelo-1", "v1")
+    assert cache.get("a" * 64, "modelo-1", "v1") == RECORD
+    assert cache.get("a" * 64, "modelo-2", "v1") is None
+    assert cache.get("a" * 64, "modelo-1", "v2") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_local_extractions_do_not_depend_on_the_model(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put("b" * 64, RECORD, "xml")
+    assert cache.get("b" * 64, "modelo-2", "v9") == RECORD
+
+
+def test_old_entries_expire(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, max_age_days=1)
+    cache.put("a" * 64, RECORD, "xml")
+    later = time.time() + 2 * 86400
+    monkeypatch.setattr(extraction_cache.time, "time", lambda: later)
+    assert cache.get("a" * 64, "m", "v") is None
+    cache.evict()
+    assert cache.conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0] == 0
+
+
+def test_size_limit_evicts_least_recently_used(tmp_path):
+    cache = _cache(tmp_path, max_size_mb=0.001)  # ~1 KB
+    record = {"data": "x" * 300}
+    for key in "abc":
+        cache.put(key * 64, record, "xml")
+        time.sleep(0.01)
+    cache.get("a" * 64, "m", "v")  # "a" is now the most recently used
+    cache.put("d" * 64, record, "xml")
+    cache.evict()
+    kept = {row[0][0] for row in cache.conn.execute("SELECT sha256 FROM extractions")}
+    assert kept == {"a", "c", "d"}
+
+
+def test_long_runs_evict_while_putting(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction_cache, "EVICT_EVERY_PUTS", 5)
+    cache = _cache(tmp_path, max_size_mb=0.001)
+    for i in range(20):
+        cache.put(f"{i:064d}", {"data": "x" * 300}, "xml")
+    size = cache.conn.execute("SELECT SUM(size) FROM extractions").fetchone()[0]
+    assert size <= cache.max_size_bytes + 5 * 320
@@ -0,0 +1,48 @@
+import asyncio
+
+import key_pool
+from key_pool import KeyPool
+
+
+def _pool() -> KeyPool:
+    return KeyPool.from_entries(["key-aaaa", "key-bbbb"], rpm=600, concurrency=1, client=object())
+
+
+def _prefer(pool: KeyPool, label: str):
+    # As upload_target() would have done for this key
+    next(slot for slot in pool.slots if slot.label == label).promised += 1
+    return pool.acquire(prefer=label)
+
+
+def test_waiting_for_a_preferred_key_does_not_block_other_calls():
+    async def run():
+        pool = _pool()
+        busy = pool.acquire()
+        await busy.__aenter__()
+        waiter = asyncio.ensure_future(_prefer(pool, busy.label).__aenter__())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        # Another call gets the free key right away
+        other = await asyncio.wait_for(pool.acquire().__aenter__(), timeout=1)
+        assert other.label != busy.label
+
+        await busy.__aexit__(None, None, None)
+        lease = await asyncio.wait_for(waiter, timeout=1)
+        assert lease.label == busy.label
+        assert all(slot.promised == 0 for slot in pool.slots)
+
+    asyncio.run(run())
+
+
+def test_preferred_key_wait_is_bounded(monkeypatch):
+    monkeypatch.setattr(key_pool, "PREFER_WAIT_SECONDS", 0.05)
+
+    async def run():
+        pool = _pool()
+        busy = pool.acquire()
+        await busy.__aenter__()
+        lease = await asyncio.wait_for(_prefer(pool, busy.label).__aenter__(), timeout=1)
+        assert lease.label != busy.label
+
+    asyncio.run(run())
@@ -0,0 +1,52 @@
+import os
+
+import manifest as manifest_module
+from manifest import CHANGED, DONE, NEW, Manifest
+
+
+def _manifest(tmp_path, use_hash=True) -> Manifest:
+    return Manifest(str(tmp_path / "state" / "manifest.sqlite"), use_hash=use_hash)
+
+
+def _touch(path, content: bytes, mtime_ns: int):
+    path.write_bytes(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_recording_and_forgetting_release_the_stat(tmp_path):
+    manifest = _manifest(tmp_path, use_hash=False)
+    path = tmp_path / "a.pdf"
+    path.write_bytes(b"a")
+    assert manifest.classify("a.pdf", str(path)) == NEW
+    manifest.record("a.pdf", str(path), "EXITOSO")
+    assert manifest.classify("a.pdf", str(path)) == DONE
+    manifest.forget("a.pdf")
+    assert manifest._stats == {} and manifest._hashes == {}
+
+
+def test_touched_file_with_same_content_is_hashed_once(tmp_path, monkeypatch):
+    manifest = _manifest(tmp_path)
+    path = tmp_path / "a.pdf"
+    _touch(path, b"same", 1_000_000_000)
+    manifest.classify("a.pdf", str(path))
+    manifest.record("a.pdf", str(path), "EXITOSO")
+
+    _touch(path, b"same", 2_000_000_000)
+    assert manifest.classify("a.pdf", str(path)) == DONE
+    manifest.forget("a.pdf")
+    manifest.close()
+
+    # Next run: the new mtime was stored, so there is nothing to hash
+    reopened = _manifest(tmp_path)
+    monkeypatch.setattr(manifest_module, "file_sha256", lambda file_path: "rehashed")
+    assert reopened.classify("a.pdf", str(path)) == DONE
+
+
+def test_touched_file_with_new_content_is_changed(tmp_path):
+    manifest = _manifest(tmp_path)
+    path = tmp_path / "a.pdf"
+    _touch(path, b"aaaa", 1_000_000_000)
+    manifest.classify("a.pdf", str(path))
+    manifest.record("a.pdf", str(path), "EXITOSO")
+    _touch(path, b"bbbb", 2_000_000_000)
+    assert manifest.classify("a.pdf", str(path)) == CHANGED
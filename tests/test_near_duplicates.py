@@ -0,0 +1,157 @@
+import io
+import random
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+pytest.importorskip("pypdf")
+from PIL import Image, ImageDraw
+
+from near_duplicates import Fingerprint, NearDuplicateIndex, fingerprint
+
+
+def _logo_jpeg() -> bytes:
+    image = Image.new("RGB", (652, 255), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 20, 630, 235), outline="black", width=8)
+    draw.ellipse((40, 40, 220, 215), fill="navy")
+    out = io.BytesIO()
+    image.save(out, "JPEG")
+    return out.getvalue()
+
+
+def _scan_jpeg(lines, quality: int) -> bytes:
+    """A scanned letter page (612x792 points at ~150 dpi) with the invoice printed on it."""
+    image = Image.new("L", (1275, 1650), 255)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((80, 80, 700, 330), fill=60)
+    for row, line in enumerate(lines):
+        draw.text((100, 420 + row * 60), line, fill=0, font_size=36)
+    out = io.BytesIO()
+    image.convert("RGB").save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+def _pdf(lines, logo: bytes, size=(652, 255)) -> bytes:
+    """
+    Single-page letter PDF with a text layer (if lines) and an embedded JPEG:
+    a logo of the given pixel size, or the whole page for a scan.
+    """
+    text = "BT /F1 9 Tf 40 560 Td 12 TL " + " ".join(
+        "({}) Tj T*".format(line.replace("(", "").replace(")", "")) for line in lines) + " ET"
+    placement = "612 0 0 792 0 0" if size[1] > size[0] else "300 0 0 117 40 700"
+    stream = f"q {placement} cm /Im1 Do Q {text if lines else ''}".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Resources << /Font << /F1 4 0 R >> /XObject << /Im1 5 0 R >> >> /Contents 6 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        f"<< /Type /XObject /Subtype /Image /Width {size[0]} /Height {size[1]} /ColorSpace /DeviceRGB ".encode()
+        + b"/BitsPerComponent 8 /Filter /DCTDecode /Length " + str(len(logo)).encode() + b" >>\nstream\n"
+        + logo + b"\nendstream",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def _invoice_lines(seed: int, supplier: str):
+    rng = random.Random(seed)
+    base = rng.randint(100000, 9000000)
+    return [
+        f"{supplier}",
+        f"NIT: {rng.randint(800000000, 999999999)}-{rng.randint(0, 9)}",
+        f"Direccion: Calle {rng.randint(1, 150)} # {rng.randint(1, 99)}-{rng.randint(1, 99)}",
+        f"Factura electronica de venta No. FV-{rng.randint(1000, 999999)}",
+        f"Fecha de Emision: 2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "Cliente: EMPRESA COMPRADORA SAS NIT 901.234.567-8",
+        f"Descripcion: {rng.choice(['Servicio de aseo', 'Arriendo oficina', 'Suministros'])}",
+        f"Subtotal {base:,}".replace(",", "."),
+        f"IVA 19% {int(base * 0.19):,}".replace(",", "."),
+        f"Total a pagar {int(base * 1.19):,}".replace(",", "."),
+        f"CUFE: {''.join(rng.choice('0123456789abcdef') for _ in range(96))}",
+        "Representacion grafica de la factura electronica",
+    ]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "near_duplicates.sqlite"), version="v2")
+    yield index
+    index.close()
+
+
+def _fp(name: str, content: bytes, sha256: str) -> Fingerprint:
+    return fingerprint(name, content=content, sha256=sha256)
+
+
+def test_pdfs_sharing_a_logo_are_not_hashed_by_the_image(index):
+    logo = _logo_jpeg()
+    first = _fp("a.pdf", _pdf(_invoice_lines(1, "S.E. CONSTRUYENDO SAS"), logo), "a" * 64)
+    assert first.phash is None
+    assert first.minhash is not None
+    index.add(first, "a.pdf", {"nit": "1"})
+
+    other = _fp("b.pdf", _pdf(_invoice_lines(2, "ANCLA Y VIENTO LTDA"), logo), "b" * 64)
+    assert index.find(other) is None
+
+
+def test_distinct_invoices_on_the_same_template_do_not_match(index):
+    logo = _logo_jpeg()
+    for seed in range(8):
+        fp = _fp(f"{seed}.pdf", _pdf(_invoice_lines(seed, "DISTRIBUIDORA D1 SAS"), logo), f"{seed:064d}")
+        assert index.find(fp) is None, seed
+        index.add(fp, f"{seed}.pdf", {"factura_numero": str(seed)})
+    assert len(index) == 8
+
+
+def test_reexported_pdf_matches_by_text(index):
+    lines = _invoice_lines(7, "LUZ MEDICA SAS")
+    original = _fp("original.pdf", _pdf(lines, _logo_jpeg()), "1" * 64)
+    index.add(original, "original.pdf", {"factura_numero": "FV-7"})
+
+    # Same text, other bytes (different image compression)
+    reexport = _fp("copia.pdf", _pdf(lines, _logo_jpeg()[:-2] + b"\xff\xd9"), "2" * 64)
+    match = index.find(reexport)
+    assert match is not None
+    assert match.method == "texto"
+    assert match.archivo == "original.pdf"
+
+
+def test_image_match_needs_the_text_to_agree(index):
+    phash = bytes(768)
+    index.add(Fingerprint("1" * 64, phash, bytes(range(256))), "a.png", {"nit": "1"})
+    # Same picture, different text: not a duplicate
+    assert index.find(Fingerprint("2" * 64, phash, bytes(reversed(range(256))))) is None
+    # Same picture, no text to compare
+    assert index.find(Fingerprint("3" * 64, phash, None)).archivo == "a.png"
+
+
+def test_scanned_pdf_is_hashed_by_its_page_image(index):
+    lines = _invoice_lines(3, "TALLER LA 80 SAS")
+    first = _fp("escaneo.pdf", _pdf([], _scan_jpeg(lines, 90), size=(1275, 1650)), "1" * 64)
+    assert first.minhash is None
+    assert first.phash is not None
+    index.add(first, "escaneo.pdf", {"factura_numero": "FV-3"})
+
+    # The same scan saved again at another quality
+    again = _fp("escaneo (1).pdf", _pdf([], _scan_jpeg(lines, 60), size=(1275, 1650)), "2" * 64)
+    match = index.find(again)
+    assert match is not None and match.method == "imagen"
+    assert match.archivo == "escaneo.pdf"
+
+
+def test_pdf_with_only_a_logo_has_no_fingerprint():
+    fp = _fp("logo.pdf", _pdf([], _logo_jpeg()), "4" * 64)
+    assert fp.phash is None and fp.minhash is None
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from utils import normalize_data, normalize_frame
+
+
+def _rowwise(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame([normalize_data(dict(row)) for row in df.to_dict("records")], index=df.index)
+
+
+def _missing_as_none(df: pd.DataFrame) -> pd.DataFrame:
+    # None and NaN are both "missing"; the column dtypes of the two paths differ
+    df = df.astype(object)
+    return df.where(df.notna(), None)
+
+
+def _assert_same(df: pd.DataFrame):
+    expected = _rowwise(df)
+    result = normalize_frame(df)
+    assert sorted(result.columns) == sorted(expected.columns)
+    pd.testing.assert_frame_equal(_missing_as_none(result[expected.columns]), _missing_as_none(expected))
+
+
+def test_matches_normalize_data_on_mixed_values():
+    df = pd.DataFrame({
+        "archivo": [f"f{i}.pdf" for i in range(8)],
+        "base": ["1.234,56", "$ 1,234.56", np.nan, "", 1000, "72,000.00", "14.000", None],
+        "impuestos": [np.nan, "19.000,00", "0", "", 190.0, "$ 13.680", None, "abc"],
+        "total": ["1.468,13", "$ 1,469.13", "0,45", "", np.nan, "85.680,00", 312.5, "2.380.000"],
+        "fecha": ["2025-01-31", "31/01/2025", "", np.nan, "Jan-05-2025", "05-02-2025", None, "2025/13/45"],
+        "fecha_emision": [np.nan, "2025-02-01", "2025-03-15", "15/03/2025", "", None, "2024-12-31", np.nan],
+        "fecha_vencimiento": ["2025-02-28", "", np.nan, "28/02/2025", "Feb-28-2025", None, "x", "2025-02-28"],
+        "nit": ["900.123.456-8", "900123456", np.nan, "", "860,002,464 - 3", None, "ABC-1", 800197268],
+    })
+    _assert_same(df)
+
+
+def test_fecha_column_is_created_only_from_fecha_emision():
+    df = pd.DataFrame({
+        "fecha_emision": ["2025-01-31", np.nan, "", "01/02/2025"],
+        "total": ["1.000", "", np.nan, "$ 2,000.00"],
+    })
+    _assert_same(df)
+
+
+def test_nit_columns_only_when_present():
+    df = pd.DataFrame({"nit": [np.nan, "", None], "base": ["1,5", "", np.nan]})
+    _assert_same(df)
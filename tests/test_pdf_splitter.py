@@ -0,0 +1,85 @@
+import asyncio
+import io
+
+import pytest
+
+pytest.importorskip("pypdf")
+
+import pdf_splitter
+from pdf_splitter import find_segments, page_texts
+from processor import InvoiceProcessor
+
+
+def _pdf(pages) -> bytes:
+    """Text-only PDF, one page per list of lines."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = ("BT /F1 9 Tf 40 780 Td 12 TL " + " ".join(f"({line}) Tj T*" for line in lines) + " ET").encode()
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {len(objects)} 0 R >>".encode())
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def _invoice_page(number: str, page: int = 1, of: int = 1):
+    return [f"Factura electronica de venta No. {number}", "Proveedor de pruebas SAS NIT 900123456-8",
+            f"Pagina {page} de {of}", "Total a pagar 119.000"]
+
+
+def test_single_page_pdf_is_not_read():
+    assert page_texts(io.BytesIO(_pdf([_invoice_page("FV1")]))) == []
+
+
+def test_boundaries_from_invoice_numbers_and_page_markers():
+    pdf = _pdf([_invoice_page("FV1", 1, 2), ["Continuacion de items"], _invoice_page("FV2"),
+                _invoice_page("FV3", 1, 2), _invoice_page("FV3", 2, 2)])
+    segments = find_segments(page_texts(io.BytesIO(pdf)))
+    assert [(s.first_page, s.last_page, s.factura_numero) for s in segments] == [
+        (1, 2, "FV1"), (3, 3, "FV2"), (4, 5, "FV3")]
+
+
+def test_text_tier_reuses_the_pages_read_for_splitting(tmp_path, monkeypatch):
+    path = tmp_path / "dos_paginas.pdf"
+    path.write_bytes(_pdf([_invoice_page("FV1", 1, 2), ["Continuacion de items"]]))
+    processor = InvoiceProcessor("", replay=True)
+    reads = []
+    real = pdf_splitter.PdfReader
+    monkeypatch.setattr(pdf_splitter, "PdfReader", lambda source: reads.append(source) or real(source))
+    monkeypatch.setattr(processor.text_skill, "extract_text", lambda *args: pytest.fail("PDF read again"))
+
+    async def run():
+        assert await processor.split_pdf(str(path)) == []
+        return await processor._process_local(str(path), processor._page_texts.pop(str(path)))
+
+    result, _ = asyncio.run(run())
+    assert result is None  # Not a valid invoice, but the text tier ran on the kept pages
+    assert len(reads) == 1
+
+
+def test_cached_pdf_is_not_split(tmp_path, monkeypatch):
+    from extraction_cache import ExtractionCache
+    from utils import file_sha256
+
+    path = tmp_path / "paquete.pdf"
+    path.write_bytes(_pdf([_invoice_page("FV1"), _invoice_page("FV2")]))
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+    cache.put(file_sha256(str(path)), {"archivo": "paquete.pdf", "estado": "EXITOSO (TEXTO)"}, "text")
+    processor = InvoiceProcessor("", cache=cache, replay=True)
+    monkeypatch.setattr("processor.page_texts", lambda source: pytest.fail("PDF read"))
+
+    assert asyncio.run(processor.split_pdf(str(path))) == []
@@ -0,0 +1,84 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import manifest as manifest_module
+from manifest import Manifest
+from pipeline import Pipeline
+from result_store import ResultStore
+from telemetry import Telemetry
+
+
+def _pipeline(tmp_path, use_hash=False):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    processor = SimpleNamespace(telemetry=Telemetry(), file_hashes={})
+    store = ResultStore(str(tmp_path / "state" / "results.sqlite"))
+    manifest = Manifest(str(tmp_path / "state" / "manifest.sqlite"), use_hash=use_hash)
+    return Pipeline(processor, store, manifest, None, str(input_dir))
+
+
+def _invoice(pipeline, name: str) -> str:
+    path = os.path.join(pipeline.input_dir, name)
+    with open(path, "wb") as f:
+        f.write(name.encode())
+    pipeline.manifest.classify(name, path)
+    return path
+
+
+def _write(pipeline, entries):
+    async def run():
+        pipeline.result_q = asyncio.Queue()
+        for entry in entries + [None]:
+            pipeline.result_q.put_nowait(entry)
+        await pipeline._write()
+
+    asyncio.run(run())
+
+
+def test_writer_keeps_going_when_a_file_disappears(tmp_path):
+    pipeline = _pipeline(tmp_path, use_hash=True)
+    gone = _invoice(pipeline, "gone.pdf")
+    kept = _invoice(pipeline, "kept.pdf")
+    os.remove(gone)
+
+    _write(pipeline, [(gone, {"archivo": "gone.pdf", "estado": "EXITOSO"}, None),
+                      (kept, {"archivo": "kept.pdf", "estado": "EXITOSO"}, None)])
+
+    assert "kept.pdf" in pipeline.manifest.entries
+    assert pipeline.completed == 2
+
+
+def test_manifest_reuses_the_hash_computed_while_processing(tmp_path, monkeypatch):
+    pipeline = _pipeline(tmp_path, use_hash=True)
+    path = _invoice(pipeline, "a.pdf")
+    pipeline.processor.file_hashes[path] = "f" * 64
+
+    def no_rehash(file_path):
+        raise AssertionError(f"{file_path} hashed again")
+
+    monkeypatch.setattr(manifest_module, "file_sha256", no_rehash)
+    _write(pipeline, [(path, {"archivo": "a.pdf", "estado": "EXITOSO"}, None)])
+
+    assert pipeline.manifest.entries["a.pdf"][2] == "f" * 64
+    assert pipeline.processor.file_hashes == {}
+
+
+def test_filter_skips_a_file_that_cannot_be_read(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    os.symlink(os.path.join(pipeline.input_dir, "missing.pdf"), os.path.join(pipeline.input_dir, "broken.pdf"))
+    kept = _invoice(pipeline, "kept.pdf")
+    pipeline.companions = SimpleNamespace(lookup=lambda file_path: None)
+
+    async def run():
+        pipeline.scan_q = asyncio.Queue()
+        for queue in ("xml_q", "bundle_q", "vision_q"):
+            setattr(pipeline, queue, asyncio.Queue())
+        pipeline.xml_workers = 1
+        for entry in [os.path.join(pipeline.input_dir, "broken.pdf"), kept, None]:
+            pipeline.scan_q.put_nowait(entry)
+        await pipeline._filter()
+        return pipeline.vision_q.get_nowait()
+
+    assert asyncio.run(run()) == ("file", kept)
+    assert pipeline.total == 1
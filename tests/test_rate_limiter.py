@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from processor import InvoiceProcessor
+from rate_limiter import RateLimiter, retry_delay_from_error
+
+
+class ResourceExhausted(Exception):
+    """What the genai SDK raises on a 429, reduced to what the limiter reads."""
+
+    code = 429
+
+    def __init__(self, retry_delay: float):
+        super().__init__("429 RESOURCE_EXHAUSTED")
+        self.details = {"error": {"details": [{"retryDelay": f"{retry_delay}s"}]}}
+
+
+class FakeClient:
+    """generate() answers after a short latency; the first call gets a 429."""
+
+    def __init__(self, limiter: RateLimiter, retry_delay: float):
+        self.limiter = limiter
+        self.retry_delay = retry_delay
+        self.starts = []
+        self.rpm_seen = []
+        self.in_flight = self.max_in_flight = 0
+        self.failed_at = None
+
+    async def generate(self, name: str, client=None):
+        self.starts.append(time.monotonic())
+        self.rpm_seen.append(self.limiter.effective_rpm)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if self.failed_at is None:
+                self.failed_at = time.monotonic()
+                raise ResourceExhausted(self.retry_delay)
+            return name
+        finally:
+            self.in_flight -= 1
+
+
+def test_retry_delay_is_read_from_the_error():
+    assert retry_delay_from_error(ResourceExhausted(37)) == 37.0
+
+
+def test_429_pauses_backs_off_and_recovers():
+    limiter = RateLimiter(rpm=600, concurrency=3)
+    processor = InvoiceProcessor("", limiter=limiter, replay=True)
+    fake = FakeClient(limiter, retry_delay=0.3)
+
+    async def run():
+        return await asyncio.gather(*[processor._call_limited(0, fake.generate, f"f{i}") for i in range(8)])
+
+    results = asyncio.run(run())
+
+    assert sorted(results) == [f"f{i}" for i in range(8)]
+    assert limiter.rate_limited == 1
+    assert processor.telemetry.counters["retries"] == 1
+    # The server's retryDelay is honoured: nothing starts during the pause
+    later = [start for start in fake.starts if start > fake.failed_at]
+    assert later and min(later) >= fake.failed_at + 0.3 - 0.01
+    # The rate was halved (600 -> 300 RPM; the calls in flight then add
+    # 10 % each as they succeed), the concurrency cap held...
+    assert fake.rpm_seen[fake.starts.index(min(later))] < 600
+    assert min(fake.rpm_seen) in (300, 360, 420)
+    assert fake.max_in_flight <= 3
+    # ...and each success since has brought it back to the budget
+    assert limiter.effective_rpm == 600
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import remote_files
+from benchmark import FakeGenAI
+from remote_files import RemoteFileCache
+from vision_skill import VisionSkill
+
+SHA = "a" * 64
+
+
+class FilesClient(FakeGenAI):
+    """FakeGenAI that records uploads and deletions; files in `gone` are no longer ACTIVE."""
+
+    def __init__(self):
+        super().__init__(latency_ms=0, jitter_ms=0, upload_ms=0)
+        self.deleted = []
+        self.gone = set()
+
+    async def _get_async(self, name: str):
+        remote = self._remote_file(name)
+        if name in self.gone:
+            remote.state = SimpleNamespace(name="FAILED")
+        return remote
+
+    async def _delete(self, name: str):
+        self.deleted.append(name)
+
+
+def _skill(tmp_path, client, cached=True):
+    handles = RemoteFileCache(str(tmp_path / "remote_files.sqlite")) if cached else None
+    # inline_max_bytes=0: every file goes through the Files API
+    return VisionSkill("key", client=client, inline_max_bytes=0, remote_files=handles)
+
+
+def _picture(tmp_path):
+    path = tmp_path / "factura.png"
+    path.write_bytes(b"\x89PNG not really")
+    return str(path)
+
+
+def test_handles_are_kept_per_account_and_variant(tmp_path):
+    cache = RemoteFileCache(str(tmp_path / "remote_files.sqlite"))
+    cache.put(SHA, "clave1", "files/1", "uri1", "image/png")
+    cache.put(SHA, "clave2", "files/2", "uri2", "image/png", expires_at=time.time() + 60)
+
+    handle = cache.get(SHA, "clave1")
+    assert handle.name == "files/1"
+    # No expiration reported by the upload: the server-side retention
+    assert handle.expires_at > time.time() + remote_files.DEFAULT_RETENTION_SECONDS - 60
+    assert cache.get(SHA, "clave2") is None  # expires during the call
+    assert cache.get(SHA, "clave3") is None
+    assert RemoteFileCache(cache.db_path, variant="gris").get(SHA, "clave1") is None
+
+    cache.discard(SHA, "clave1")
+    assert cache.accounts(SHA) == [("clave2", "files/2")]
+    cache.put(SHA, "clave3", "files/3", "uri3", "image/png", expires_at=time.time() - 1)
+    cache.evict()
+    assert cache.accounts(SHA) == [("clave2", "files/2")]
+
+
+def test_upload_is_reused_by_the_next_call_and_deleted_on_release(tmp_path):
+    client = FilesClient()
+    skill = _skill(tmp_path, client)
+    path = _picture(tmp_path)
+
+    async def run():
+        skill.prefetch(path, archive_key=SHA)
+        await skill.extract_data_async(path, archive_key=SHA)
+        # Next model of the cascade: same file, no second upload
+        await skill.extract_data_async(path, archive_key=SHA, model="modelo-fuerte")
+        assert client.deleted == []
+        skill.release(SHA)
+        await skill.aclose()
+
+    asyncio.run(run())
+    assert client.uploads == 1
+    assert skill.telemetry.counters["uploads_reused"] == 1
+    assert client.deleted == ["files/fake-1"]
+    assert skill.remote_files.accounts(SHA) == []
+
+
+def test_a_later_run_reuses_the_upload_while_it_is_active(tmp_path):
+    client = FilesClient()
+    path = _picture(tmp_path)
+
+    async def extract():
+        skill = _skill(tmp_path, client)
+        await skill.extract_data_async(path, archive_key=SHA)
+        await skill.aclose()
+        skill.remote_files.close()
+
+    asyncio.run(extract())
+    asyncio.run(extract())
+    assert client.uploads == 1
+
+    client.gone.add("files/fake-1")
+    asyncio.run(extract())
+    assert client.uploads == 2
+    assert client.deleted == []
+
+
+def test_without_a_handle_cache_the_upload_is_deleted_after_the_call(tmp_path):
+    client = FilesClient()
+    skill = _skill(tmp_path, client, cached=False)
+    path = _picture(tmp_path)
+
+    async def run():
+        await skill.extract_data_async(path, archive_key=SHA)
+        await skill.aclose()
+
+    asyncio.run(run())
+    assert client.uploads == 1
+    assert client.deleted == ["files/fake-1"]
+
@@ -0,0 +1,32 @@
+from text_skill import TextLayerSkill
+from utils import validate_invoice_data
+
+
+def _totals(text: str):
+    return TextLayerSkill()._pick_totals(" ".join(text.split()))
+
+
+def test_tax_must_follow_its_label():
+    # "IVA 20" is a line code, "Responsable de IVA" is not an amount
+    text = """Responsable de IVA 48 Item IVA 20 Servicio
+              Subtotal 16.100,00 IVA 19% 0,00 Total a pagar 16.100,00"""
+    assert _totals(text) == (16100.0, 0.0, 16100.0)
+
+
+def test_exact_combination_wins_over_one_within_tolerance():
+    # 8.622,40 would fit within 0.5 % of the total; 8.688,40 is exact
+    text = """Subtotal 45.381,03 IVA 19% 8.622,40 Total IVA 8.688,40
+              Total a pagar 54.069,43"""
+    assert _totals(text) == (45381.03, 8688.4, 54069.43)
+
+
+def test_no_exact_combination_falls_back_to_first_candidates():
+    text = "Subtotal 100.000 IVA 19% 19.500 Total a pagar 119.000"
+    assert _totals(text) == (100000.0, 19500.0, 119000.0)
+
+
+def test_text_tolerance_rejects_slack():
+    data = {"factura_numero": "FE-1", "nit": "900123456", "fecha": "01/02/2025",
+            "cufe": "a" * 96, "base": 100000.0, "impuestos": 19500.0, "total": 119000.0}
+    assert validate_invoice_data(data) == []
+    assert validate_invoice_data(data, tolerance=0.0) == ["Base + impuestos no cuadra con el total"]
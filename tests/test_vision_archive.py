@@ -0,0 +1,35 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from response_archive import ResponseArchive
+from vision_skill import PROMPT_VERSION, VisionSkill
+
+
+class FakeModels:
+    def __init__(self, text: str):
+        self.text = text
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        return SimpleNamespace(text=self.text, parsed=None, usage_metadata=None)
+
+
+def test_batched_answers_are_archived_before_to_record(tmp_path):
+    answer = [
+        {"documento": 1, "archivo": "a.png", "factura_numero": "FV1", "fecha_emision": "01/02/2025", "total": 1000},
+        {"documento": 2, "archivo": "b.png", "factura_numero": "FV2", "fecha_emision": "2025-02-03", "total": 2000},
+    ]
+    client = SimpleNamespace(aio=SimpleNamespace(models=FakeModels(json.dumps(answer))))
+    archive = ResponseArchive(str(tmp_path / "responses.sqlite"))
+    skill = VisionSkill("key", client=client, archive=archive)
+    paths = []
+    for name in ("a.png", "b.png"):
+        (tmp_path / name).write_bytes(b"\x89PNG fake")
+        paths.append(str(tmp_path / name))
+
+    records = asyncio.run(skill.extract_batch_async(paths, archive_keys=["a" * 64, "b" * 64]))
+
+    assert records[0]["fecha_emision"] is None  # not ISO: dropped from the record...
+    raw = json.loads(archive.get("a" * 64, skill.model_name, PROMPT_VERSION))
+    assert raw["fecha_emision"] == "01/02/2025"  # ...but kept in the archive for --replay
+    assert skill.parse_text(archive.get("b" * 64, skill.model_name, PROMPT_VERSION)) == records[1]
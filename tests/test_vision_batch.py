@@ -0,0 +1,66 @@
+import asyncio
+
+from processor import InvoiceProcessor
+from rate_limiter import RateLimiter
+
+
+class FakeVision:
+    """Batches of more than two files get a short answer; "roto.pdf" always fails."""
+
+    def __init__(self):
+        self.batches = []
+        self.singles = []
+
+    def may_upload(self, file_path, payload=None):
+        return False
+
+    def prefetch(self, file_path, payload=None, sha256=None, client=None):
+        pass
+
+    async def extract_batch_async(self, file_paths, archive_keys=None, model=None, client=None):
+        self.batches.append(list(file_paths))
+        if "roto.pdf" in file_paths:
+            raise ValueError("malformed batched answer")
+        answers = [{"archivo": f} for f in file_paths]
+        return answers[:-1] if len(file_paths) > 2 else answers
+
+    async def extract_data_async(self, file_path, archive_key=None, model=None, client=None):
+        self.singles.append(file_path)
+        if file_path == "roto.pdf":
+            raise ValueError("no JSON in answer")
+        return {"archivo": file_path}
+
+
+def test_failed_batches_are_split_down_to_single_files():
+    processor = InvoiceProcessor("", client=object(), limiter=RateLimiter(rpm=6000, concurrency=4))
+    processor.vision = FakeVision()
+    files = ["a.pdf", "b.pdf", "c.pdf", "d.pdf", "roto.pdf"]
+
+    extracted = asyncio.run(processor._extract_vision_batch(files))
+
+    assert list(extracted) == files
+    for f in files[:4]:
+        assert extracted[f] == {"archivo": f}
+    assert isinstance(extracted["roto.pdf"], ValueError)
+    # 5 -> wrong length -> [a, b] + [c, d, roto] -> [c] + [d, roto] -> [d] + [roto]
+    assert processor.vision.batches == [files, ["a.pdf", "b.pdf"], ["c.pdf", "d.pdf", "roto.pdf"],
+                                        ["d.pdf", "roto.pdf"]]
+    assert sorted(processor.vision.singles) == ["c.pdf", "d.pdf", "roto.pdf"]
+
+
+def test_rate_limited_batches_are_not_split():
+    class Exhausted(FakeVision):
+        async def extract_batch_async(self, file_paths, archive_keys=None, model=None, client=None):
+            self.batches.append(list(file_paths))
+            raise RuntimeError("429 RESOURCE_EXHAUSTED")
+
+    processor = InvoiceProcessor("", client=object(), limiter=RateLimiter(rpm=6000, concurrency=4),
+                                 max_rate_limit_retries=1)
+    processor.vision = Exhausted()
+    files = ["a.pdf", "b.pdf", "c.pdf"]
+
+    extracted = asyncio.run(processor._extract_vision_batch(files))
+
+    assert all(isinstance(extracted[f], RuntimeError) for f in files)
+    assert processor.vision.batches == [files]
+    assert processor.vision.singles == []
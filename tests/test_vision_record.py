@@ -0,0 +1,19 @@
+from vision_skill import VisionSkill
+
+
+def _skill() -> VisionSkill:
+    return VisionSkill(api_key="", offline=True)
+
+
+def test_iso_dates_are_kept():
+    record = _skill().to_record({"fecha_emision": "2025-02-01", "total": 1000})
+    assert record["fecha_emision"] == "2025-02-01"
+    assert record["total"] == 1000.0
+
+
+def test_unparsable_date_is_cleared_and_counted():
+    skill = _skill()
+    record = skill.to_record({"fecha_emision": "01/02/2025", "fecha_vencimiento": "2025-02-30", "total": 1000})
+    assert record["fecha_emision"] is None
+    assert record["fecha_vencimiento"] is None
+    assert skill.telemetry.counters["date_failed"] == 2
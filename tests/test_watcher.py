@@ -0,0 +1,98 @@
+import asyncio
+import os
+
+import pytest
+
+from watcher import DirectoryWatcher
+
+
+async def _next(watcher, timeout=5.0):
+    return await asyncio.wait_for(watcher.next_batch(), timeout)
+
+
+def test_polling_reports_a_file_once_its_size_stops_changing(tmp_path):
+    (tmp_path / "viejo.pdf").write_bytes(b"already there")
+    path = tmp_path / "nuevo.pdf"
+
+    async def run():
+        watcher = DirectoryWatcher(str(tmp_path), poll_interval=0.1, settle=0.1, use_inotify=False)
+        await watcher.start()
+        assert watcher.mode == "polling"
+        add = watcher._add
+        reported_sizes = []
+
+        def record(paths):
+            reported_sizes.extend(os.path.getsize(p) for p in paths)
+            add(paths)
+
+        watcher._add = record
+        # Still growing at every poll: a slow copy
+        with open(path, "wb") as f:
+            for _ in range(8):
+                f.write(b"x" * 1024)
+                f.flush()
+                await asyncio.sleep(0.05)
+        batch = await _next(watcher)
+        watcher.close()
+        return batch, reported_sizes
+
+    batch, reported_sizes = asyncio.run(run())
+    assert batch == [([str(path)], [])]
+    assert reported_sizes == [8 * 1024]
+
+
+def test_changes_are_debounced_into_one_batch(tmp_path):
+    folder = tmp_path / "proveedor"
+    folder.mkdir()
+
+    async def run(use_inotify):
+        watcher = DirectoryWatcher(str(tmp_path), poll_interval=0.05, settle=0.3, use_inotify=use_inotify)
+        await watcher.start()
+        (folder / "FE-1.pdf").write_bytes(b"%PDF")
+        await asyncio.sleep(0.15)
+        (folder / "FE-1.xml").write_text("<Invoice/>")
+        (folder / "notas.txt").write_text("not watched")
+        batch = await _next(watcher)
+        watcher.stop()
+        stopped = await _next(watcher)
+        watcher.close()
+        return watcher.mode, batch, stopped
+
+    for use_inotify in (False, True):
+        for name in ("FE-1.pdf", "FE-1.xml", "notas.txt"):
+            if (folder / name).exists():
+                os.remove(folder / name)
+        mode, batch, stopped = asyncio.run(run(use_inotify))
+        assert batch == [([str(folder / "FE-1.pdf")], [str(folder / "FE-1.xml")])], mode
+        assert stopped is None
+
+
+def test_inotify_waits_for_the_writer_to_close_the_file(tmp_path):
+    path = tmp_path / "nueva" / "factura.pdf"
+
+    async def run():
+        watcher = DirectoryWatcher(str(tmp_path), settle=0.1)
+        await watcher.start()
+        if watcher.mode != "inotify":
+            watcher.close()
+            return None, None
+        # A folder created after start is watched as well
+        path.parent.mkdir()
+        await asyncio.sleep(0.1)
+        f = open(path, "wb")
+        f.write(b"%PDF half")
+        f.flush()
+        try:
+            early = await _next(watcher, timeout=0.5)
+        except asyncio.TimeoutError:
+            early = None
+        f.close()
+        batch = await _next(watcher)
+        watcher.close()
+        return early, batch
+
+    early, batch = asyncio.run(run())
+    if batch is None:
+        pytest.skip("inotify not available")
+    assert early is None
+    assert batch == [([str(path)], [])]
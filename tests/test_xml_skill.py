@@ -0,0 +1,123 @@
+import os
+import random
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import xml_skill
+from benchmark import attached_document_xml, invoice_xml
+from xml_skill import XmlSkill
+
+
+class FindXmlSkill:
+    """The tree-based parser XmlSkill replaced (ET.parse + find), kept as the reference."""
+
+    def extract_data(self, file_path):
+        root = ET.parse(file_path).getroot()
+        self._strip_namespaces(root)
+        if root.tag.endswith("AttachedDocument"):
+            description = root.find(".//Attachment/ExternalReference/Description")
+            if description is None or not description.text:
+                return {}
+            root = ET.fromstring(description.text.strip())
+            self._strip_namespaces(root)
+            if not root.tag.endswith("Invoice"):
+                return {}
+        elif not root.tag.endswith("Invoice"):
+            return {}
+        return self._parse_invoice(root, os.path.basename(file_path))
+
+    def _strip_namespaces(self, elem):
+        if elem.tag.startswith("{"):
+            elem.tag = elem.tag.split("}", 1)[1]
+        for child in elem:
+            self._strip_namespaces(child)
+
+    def _parse_invoice(self, root, filename):
+        data = {
+            "archivo": filename,
+            "estado": "EXITOSO (XML)",
+            "proveedor": self._get_text(root, ".//AccountingSupplierParty/Party/PartyTaxScheme/RegistrationName"),
+            "nit": self._get_text(root, ".//AccountingSupplierParty/Party/PartyTaxScheme/CompanyID"),
+            "direccion": self._get_text(root, ".//AccountingSupplierParty/Party/PhysicalLocation/Address/AddressLine/Line"),
+            "telefono": self._get_text(root, ".//AccountingSupplierParty/Party/Contact/Telephone"),
+            "ciudad": self._get_text(root, ".//AccountingSupplierParty/Party/PhysicalLocation/Address/CityName"),
+            "factura_numero": self._get_text(root, "./ID"),
+            "fecha_emision": self._get_text(root, ".//IssueDate"),
+            "fecha_vencimiento": self._get_text(root, ".//DueDate"),
+            "descripcion": self._get_text(root, ".//InvoiceLine/Item/Description"),
+            "moneda": self._get_text(root, "./DocumentCurrencyCode"),
+            "base": self._get_float(root, ".//LegalMonetaryTotal/TaxExclusiveAmount"),
+            "impuestos": self._get_float(root, ".//TaxTotal/TaxAmount"),
+            "total": self._get_float(root, ".//LegalMonetaryTotal/PayableAmount"),
+            "cufe": self._get_text(root, "./UUID"),
+        }
+        if not data["descripcion"]:
+            data["descripcion"] = "Factura de Venta"
+        return data
+
+    def _get_text(self, root, path):
+        el = root.find(path)
+        return el.text.strip() if el is not None and el.text else None
+
+    def _get_float(self, root, path):
+        text = self._get_text(root, path)
+        if text:
+            try:
+                return float(text)
+            except ValueError:
+                return 0.0
+        return 0.0
+
+
+PLAIN_INVOICE = """<?xml version="1.0" encoding="UTF-8"?>
+<Invoice>
+  <cac:OrderReference xmlns:cac="x"><ID>OC-77</ID></cac:OrderReference>
+  <ID>FE-12</ID>
+  <IssueDate>2025-03-04</IssueDate>
+  <AccountingSupplierParty><Party><PartyTaxScheme>
+    <RegistrationName> FERRETERIA EL PERNO SAS </RegistrationName><CompanyID>900123456</CompanyID>
+  </PartyTaxScheme></Party></AccountingSupplierParty>
+  <TaxTotal><TaxAmount>190</TaxAmount></TaxTotal>
+  <LegalMonetaryTotal><TaxExclusiveAmount>mil</TaxExclusiveAmount><PayableAmount>1190.00</PayableAmount></LegalMonetaryTotal>
+</Invoice>
+"""
+
+CREDIT_NOTE = """<?xml version="1.0" encoding="UTF-8"?>
+<CreditNote xmlns="urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2"><ID>NC-1</ID></CreditNote>
+"""
+
+
+def _corpus(directory):
+    rng = random.Random(11)
+    docs = {"plain.xml": PLAIN_INVOICE, "credit_note.xml": CREDIT_NOTE}
+    for i in range(6):
+        docs[f"invoice_{i}.xml"] = invoice_xml(f"FE{i}", rng, lines=i, padding_kb=i % 3)
+        docs[f"attached_{i}.xml"] = attached_document_xml(f"AD{i}", rng, lines=i, padding_kb=i % 2)
+    paths = []
+    for name, text in docs.items():
+        path = directory / name
+        path.write_text(text, encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("use_lxml", [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(xml_skill.lxml_etree is None, reason="lxml not installed")),
+])
+def test_streaming_parser_matches_the_find_based_one(tmp_path, use_lxml):
+    skill = XmlSkill(use_lxml=use_lxml)
+    reference = FindXmlSkill()
+    for path in _corpus(tmp_path):
+        assert skill.extract_data(path) == reference.extract_data(path), os.path.basename(path)
+
+
+def test_plain_invoice_fields(tmp_path):
+    path = tmp_path / "plain.xml"
+    path.write_text(PLAIN_INVOICE, encoding="utf-8")
+    data = XmlSkill().extract_data(str(path))
+    assert data["factura_numero"] == "FE-12"  # not the nested order reference
+    assert data["proveedor"] == "FERRETERIA EL PERNO SAS"
+    assert (data["base"], data["impuestos"], data["total"]) == (0.0, 190.0, 1190.0)
+    assert data["descripcion"] == "Factura de Venta"
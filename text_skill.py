@@ -0,0 +1,255 @@
+import os
+import re
+from itertools import product
+from typing import Dict, List, Optional
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # Optional: without pypdf the text-layer tier is skipped
+    PdfReader = None
+
+# Amounts in either Colombian (14.000,00) or US (72,000.00) notation
+AMOUNT = r"(\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)"
+DATE = r"(\d{4}-\d{2}-\d{2}|\d{2}[/-]\d{2}[/-]\d{4}|[A-Za-z]{3}-\d{2}-\d{4})"
+
+TOTAL_PATTERNS = [
+    re.compile(r"(?:total\s+a\s+pagar|total\s+neto\s+factura|total\s+factura|valor\s+total|neto\s+a\s+pagar)"
+               r"\s*(?:\(=\))?[^\d]{0,40}?" + AMOUNT, re.IGNORECASE),
+]
+BASE_PATTERNS = [
+    re.compile(r"(?:sub\s*total|subtot\.?|total\s+bruto(?:\s+factura)?|valor\s+antes\s+de\s+i\.?v\.?a\.?|base\s+gravable)"
+               r"[^\d]{0,20}?" + AMOUNT, re.IGNORECASE),
+]
+# Only an amount right after its label counts ("IVA 19% 190.000,00", "Total
+# impuesto: $ 0,00"): a bare "IVA" anywhere in the text also precedes item
+# codes, rates and "valor antes de IVA" bases
+TAX_PATTERNS = [
+    re.compile(r"(?:total\s+impuestos?|total\s+i\.?v\.?a\.?|valor\s+i\.?v\.?a\.?|(?<!de\s)\bi\.?v\.?a\.?"
+               r"(?:\s*\d{1,2}(?:[.,]\d+)?\s*%)?)"
+               r"[\s:=$()]{0,8}?" + AMOUNT + r"(?![\d%])", re.IGNORECASE),
+]
+# A tax only "matches" when base + impuestos equals the total up to peso rounding
+ROUNDING = 1.0
+NUMBER_PATTERNS = [
+    re.compile(r"N[uú]mero\s+de\s+Factura\s*:?\s*((?=[A-Z0-9-]*\d)[A-Z0-9]+(?:-\s?[A-Z0-9]+)?)", re.IGNORECASE),
+    re.compile(r"Factura\s+electr[oó]nica\s+de\s+venta\s+No\.?\s*:?\s*([A-Z]{1,6}[\s-]?\d+)", re.IGNORECASE),
+    re.compile(r"\bNo\.\s*([A-Z]{2,6}-\d+)"),
+    re.compile(r"^\s*([A-Z]{2,6}\s?\d{2,})\b"),
+]
+ISSUE_DATE_PATTERNS = [
+    re.compile(r"(?:Fecha\s+de\s+Emisi[oó]n|Fecha\s+(?:de\s+)?expedici[oó]n|Expedici[oó]n|Fecha\s+(?:de\s+)?factura)"
+               r"[^\d]{0,30}?" + DATE, re.IGNORECASE),
+]
+DUE_DATE_PATTERNS = [
+    re.compile(r"(?:Fecha\s+(?:de\s+)?vencimiento|Vencimiento)[^\d]{0,30}?" + DATE, re.IGNORECASE),
+]
+NIT_PATTERN = re.compile(
+    r"\bN\.?I\.?T\.?(?:\s+del\s+Emisor)?\s*[:.]?\s*(\d{1,3}(?:[.,]\d{3}){2,3}|\d{6,10})(?:\s*-\s*(\d)\b)?",
+    re.IGNORECASE,
+)
+CUFE_LABEL = re.compile(r"\bCU[FD]E\b", re.IGNORECASE)
+HEX96 = re.compile(r"(?<![0-9a-fA-F])[0-9a-fA-F]{96}(?![0-9a-fA-F])")
+SUPPLIER_PATTERN = re.compile(r"Raz[oó]n\s+Social\s*:\s*(.{2,120}?)\s+Nombre\s+Comercial", re.IGNORECASE)
+ADDRESS_PATTERN = re.compile(r"Direcci[oó]n\s*:\s*(.{3,80}?)\s+(?:Actividad|Tel[eé]fono|Correo|Municipio)", re.IGNORECASE)
+PHONE_PATTERN = re.compile(r"Tel[eé]fono\s*/\s*M[oó]vil\s*:\s*(\d[\d ]{6,})", re.IGNORECASE)
+CITY_PATTERN = re.compile(r"Municipio\s*/\s*Ciudad\s*:\s*(.{2,40}?)\s+(?:Responsabilidad|R[eé]gimen|Direcci)", re.IGNORECASE)
+CURRENCY_PATTERN = re.compile(r"\b(COP|USD|EUR)\b")
+
+MONTHS = {
+    "jan": "01", "ene": "01", "feb": "02", "mar": "03", "apr": "04", "abr": "04",
+    "may": "05", "jun": "06", "jul": "07", "aug": "08", "ago": "08", "sep": "09",
+    "oct": "10", "nov": "11", "dec": "12", "dic": "12",
+}
+
+
+class TextLayerSkill:
+    """
+    Skill to extract invoice data locally from the text layer of born-digital
+    PDFs (DIAN electronic invoices carry CUFE, NIT, dates and totals as text).
+    The caller must validate the result before trusting it.
+    """
+
+    def __init__(self):
+        self.available = PdfReader is not None
+        if not self.available:
+            print("WARNING: pypdf not installed, PDF text-layer extraction disabled.")
+
+    def extract_data(self, file_path: str, source=None, pages: Optional[List[str]] = None) -> Dict:
+        """
+        Returns a dict in the processor's output structure, or {} when the
+        file has no usable text layer. source: optional binary stream to read
+        instead of file_path (in-memory ZIP members). pages: text of every
+        page when it was already extracted (pdf_splitter.page_texts); the
+        PDF is then not read again.
+        """
+        if not self.available or not file_path.lower().endswith(".pdf"):
+            return {}
+
+        if pages:
+            text = "\n".join(pages[i] for i in _head_and_tail(len(pages)))
+        else:
+            try:
+                text = self.extract_text(source if source is not None else file_path)
+            except Exception as e:
+                print(f"   could not read PDF text layer: {e}")
+                return {}
+
+        if len(text.strip()) < 50:
+            return {}
+        return self.parse_text(text, os.path.basename(file_path))
+
+    def extract_text(self, file_path, max_pages: int = 2) -> str:
+        """
+        Text of the first page plus the last page (header and totals), which
+        is enough for invoices and keeps long PDFs cheap.
+        file_path may also be a binary stream.
+        """
+        reader = PdfReader(file_path)
+        return "\n".join(reader.pages[i].extract_text() or "" for i in _head_and_tail(len(reader.pages), max_pages))
+
+    def parse_text(self, text: str, filename: str) -> Dict:
+        """Pattern-based field extraction over the raw text layer."""
+        flat = re.sub(r"\s+", " ", text)
+
+        nit = None
+        nit_match = NIT_PATTERN.search(flat)
+        if nit_match:
+            nit = re.sub(r"[.,]", "", nit_match.group(1))
+            if nit_match.group(2):
+                nit = f"{nit}-{nit_match.group(2)}"
+
+        base, impuestos, total = self._pick_totals(flat)
+
+        return {
+            "archivo": filename,
+            "estado": "EXITOSO (TEXTO)",
+            "proveedor": self._first(SUPPLIER_PATTERN, flat) or self._supplier_near_nit(text),
+            "nit": nit,
+            "direccion": self._first(ADDRESS_PATTERN, flat),
+            "telefono": self._first(PHONE_PATTERN, flat),
+            "ciudad": self._first(CITY_PATTERN, flat),
+            "factura_numero": self._invoice_number(text, flat),
+            "fecha_emision": self._date(ISSUE_DATE_PATTERNS, flat),
+            "fecha_vencimiento": self._date(DUE_DATE_PATTERNS, flat),
+            "descripcion": None,
+            # DIAN electronic invoices are in pesos unless stated otherwise
+            "moneda": self._first(CURRENCY_PATTERN, flat) or "COP",
+            "base": base,
+            "impuestos": impuestos,
+            "total": total,
+            "cufe": self._cufe(flat),
+        }
+
+    def _first(self, pattern: re.Pattern, text: str) -> Optional[str]:
+        match = pattern.search(text)
+        return re.sub(r"\s+", " ", match.group(1)).strip() if match else None
+
+    def _invoice_number(self, text: str, flat: str) -> Optional[str]:
+        for pattern in NUMBER_PATTERNS:
+            match = pattern.search(text if pattern.pattern.startswith("^") else flat)
+            if match:
+                return re.sub(r"\s+", "", match.group(1))
+        return None
+
+    def _date(self, patterns: List[re.Pattern], flat: str) -> Optional[str]:
+        for pattern in patterns:
+            match = pattern.search(flat)
+            if match:
+                return self._iso_date(match.group(1))
+        return None
+
+    def _iso_date(self, value: str) -> str:
+        # "Feb-06-2026" -> "2026-02-06"; other formats are handled by normalize_data
+        match = re.match(r"([A-Za-z]{3})-(\d{2})-(\d{4})", value)
+        if match and match.group(1).lower() in MONTHS:
+            return f"{match.group(3)}-{MONTHS[match.group(1).lower()]}-{match.group(2)}"
+        return value
+
+    def _cufe(self, flat: str) -> Optional[str]:
+        return find_cufe(flat)
+
+    def _supplier_near_nit(self, text: str) -> Optional[str]:
+        lines = [l.strip() for l in text.splitlines() if l.strip()]
+        for i, line in enumerate(lines):
+            # Only a label followed by an actual number (skips "CC / NIT:" headers)
+            match = NIT_PATTERN.search(line)
+            if not match:
+                continue
+            before = re.sub(r"\s+", " ", line[:match.start()]).strip(" :-")
+            if len(before) >= 3:
+                return before
+            if i > 0:
+                return re.sub(r"\s+", " ", lines[i - 1])
+            return None
+        return None
+
+    def _pick_totals(self, flat: str):
+        """
+        Collects every labelled candidate for base, taxes and total and keeps
+        the combination with the smallest residual |base + impuestos - total|
+        (ties go to the candidates found first), provided it is exact up to
+        peso rounding. Falls back to the first candidate of each (validation
+        will reject it).
+        """
+        totals = self._amounts(TOTAL_PATTERNS, flat)
+        bases = self._amounts(BASE_PATTERNS, flat)
+        taxes = self._amounts(TAX_PATTERNS, flat)
+        if 0.0 not in taxes:
+            taxes.append(0.0)  # Exempt invoices show no tax line
+
+        combinations = [(abs(base + tax - total), base, tax, total)
+                        for total, base, tax in product(totals, bases, taxes) if total > 0]
+        if combinations:
+            residual, base, tax, total = min(combinations, key=lambda c: c[0])
+            if residual <= ROUNDING:
+                return base, tax, total
+
+        return (bases[0] if bases else None, taxes[0], totals[0] if totals else None)
+
+    def _amounts(self, patterns: List[re.Pattern], flat: str) -> List[float]:
+        values = []
+        for pattern in patterns:
+            for match in pattern.finditer(flat):
+                value = parse_amount(match.group(1))
+                if value is not None and value not in values:
+                    values.append(value)
+        return values
+
+
+def _head_and_tail(count: int, max_pages: int = 2) -> List[int]:
+    """Indexes of the first max_pages - 1 pages plus the last one."""
+    pages = list(range(count))
+    if len(pages) > max_pages:
+        pages = pages[:max_pages - 1] + pages[-1:]
+    return pages
+
+
+def find_cufe(flat: str) -> Optional[str]:
+    """CUFE/CUDE (96 hex characters) in whitespace-collapsed text, lowercased."""
+    # The CUFE is sometimes wrapped over several lines, so look at the
+    # characters following each CUFE/CUDE label with whitespace removed
+    for label in CUFE_LABEL.finditer(flat):
+        window = re.sub(r"\s+", "", flat[label.end():label.end() + 160])
+        match = HEX96.search(window)
+        if match:
+            return match.group(0).lower()
+    match = HEX96.search(flat)
+    return match.group(0).lower() if match else None
+
+
+def parse_amount(text: str) -> Optional[float]:
+    """
+    Parses an amount written with either separator convention: the last
+    separator followed by one or two digits is the decimal point.
+    Example: "14.000,00" -> 14000.0, "72,000.00" -> 72000.0, "40.000" -> 40000.0
+    """
+    text = text.strip()
+    match = re.match(r"^(.*?)[.,](\d{1,2})$", text)
+    if match:
+        integer, decimals = match.groups()
+    else:
+        integer, decimals = text, "0"
+    integer = re.sub(r"[.,]", "", integer)
+    if not integer.isdigit():
+        return None
+    return float(f"{integer}.{decimals}")
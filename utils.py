@@ -1,5 +1,8 @@
 import os
 import re
+import hashlib
+from datetime import datetime
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 from typing import List, Dict
@@ -9,6 +12,53 @@ def setup_directories(input_dir: str):
         os.makedirs(input_dir)
         print(f"Created input directory: {input_dir}")
 
+def get_state_dir(output_file: str) -> str:
+    """
+    Directory next to the output file where local state (cache, etc.) lives.
+    """
+    state_dir = os.path.join(os.path.dirname(os.path.abspath(output_file)), ".facturas_state")
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+def file_sha256(file_path: str) -> str:
+    """
+    Returns the hex SHA-256 of a file's contents, read in 1 MB chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Column order of the output workbook
+EXCEL_COLUMNS = [
+    "archivo", "estado", "proveedor", "nit", "factura_numero",
+    "fecha", "fecha_vencimiento", "descripcion",
+    "moneda", "base", "impuestos", "total",
+    "direccion", "telefono", "ciudad", "cufe",
+    "nit_dv_calculado", "nit_dv_extraido", "nota"
+]
+
+def _to_frame(data_list: List[Dict]) -> pd.DataFrame:
+    df = pd.DataFrame(data_list)
+    # Add missing cols if any
+    for c in EXCEL_COLUMNS:
+        if c not in df.columns:
+            df[c] = None
+    return df[EXCEL_COLUMNS]
+
+def write_excel(data_list: List[Dict], filename: str):
+    """
+    Writes the complete workbook in one pass (used by the final export).
+    Writes to a temporary file first and renames it over the target, so an
+    interrupted export never leaves a corrupted .xlsx behind.
+    """
+    df = _to_frame(data_list)
+    tmp_name = filename + ".tmp.xlsx"
+    df.to_excel(tmp_name, index=False)
+    os.replace(tmp_name, filename)
+    print(f"Exported {len(df)} rows to {filename}")
+
 def save_to_excel(data_list: List[Dict], filename: str):
     """
     Appends list of invoice data dictionaries to Excel.
@@ -17,20 +67,7 @@ def save_to_excel(data_list: List[Dict], filename: str):
     if not data_list:
         return
 
-    df_new = pd.DataFrame(data_list)
-    # Ensure column order
-    cols = [
-        "archivo", "estado", "proveedor", "nit", "factura_numero", 
-        "fecha", "fecha_vencimiento", "descripcion", 
-        "moneda", "base", "impuestos", "total", 
-        "direccion", "telefono", "ciudad", "cufe", 
-        "nit_dv_calculado", "nit_dv_extraido", "nota"
-    ]
-    # Add missing cols if any
-    for c in cols:
-        if c not in df_new.columns:
-            df_new[c] = None
-    df_new = df_new[cols]
+    df_new = _to_frame(data_list)
 
     if not os.path.exists(filename):
         # Create new
@@ -216,6 +253,47 @@ def correct_suspicious_low_total(value, threshold: float = 500.0):
     return value
 
 
+def validate_invoice_data(data: Dict, require_cufe: bool = True, tolerance: float = 0.005) -> List[str]:
+    """
+    Consistency checks on a normalized invoice dict.
+    Returns a list of problems (empty when the invoice looks right):
+    - NIT is numeric and its extracted DV (if any) matches calculate_nit_verification_digit
+    - base + impuestos ≈ total (within tolerance, at least 1 peso)
+    - fecha parses as DD/MM/YYYY
+    - CUFE is 96 hex characters (mandatory when require_cufe)
+    - there is an invoice number
+    """
+    problems = []
+
+    if not data.get("factura_numero"):
+        problems.append("Numero de factura ausente")
+
+    nit = str(data.get("nit") or "")
+    if not (nit.isdigit() and 6 <= len(nit) <= 10):
+        problems.append("NIT invalido")
+    elif data.get("nit_dv_extraido") and data.get("nit_dv_extraido") != data.get("nit_dv_calculado"):
+        problems.append("DV del NIT no coincide")
+
+    total = data.get("total") or 0.0
+    base = data.get("base") or 0.0
+    impuestos = data.get("impuestos") or 0.0
+    if total <= 0:
+        problems.append("Total ausente")
+    elif abs(base + impuestos - total) > max(1.0, total * tolerance):
+        problems.append("Base + impuestos no cuadra con el total")
+
+    try:
+        datetime.strptime(str(data.get("fecha") or ""), "%d/%m/%Y")
+    except ValueError:
+        problems.append("Fecha invalida")
+
+    cufe = str(data.get("cufe") or "")
+    if (require_cufe or cufe) and not re.fullmatch(r"[0-9a-fA-F]{96}", cufe):
+        problems.append("CUFE invalido")
+
+    return problems
+
+
 def deduplicate_invoice_rows(df: pd.DataFrame, key_column: str = "archivo") -> pd.DataFrame:
     """
     Removes duplicate rows by key_column (e.g. archivo), keeping the row with the most non-null values.
@@ -294,3 +372,176 @@ def normalize_data(data: Dict) -> Dict:
              data['nit_dv_calculado'] = "?"
 
     return data
+
+
+# DIAN weights for the NIT check digit, aligned to the right of the number
+NIT_WEIGHTS = np.array([71, 67, 59, 53, 47, 43, 41, 37, 29, 23, 19, 17, 13, 7, 3])
+_NUMBER_SEPARATORS = str.maketrans({".": None, ",": "."})
+
+
+def _truthy(series: pd.Series) -> np.ndarray:
+    """bool(value) for every cell (None and "" are false, NaN is true)."""
+    return series.to_numpy(dtype=object).astype(bool)
+
+
+def _as_text(series: pd.Series) -> pd.Series:
+    """str(value) for every cell, as an object column."""
+    values = series.to_numpy(dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+        # Usual case: only the missing cells need str() ("None" / "nan")
+        missing = pd.isna(values)
+        if missing.any():
+            values = values.copy()
+            values[missing] = [str(v) for v in values[missing]]
+    else:
+        values = values.astype(str)
+    return pd.Series(values, index=series.index, dtype=object)
+
+
+def _per_unique(text: pd.Series, func) -> pd.Series:
+    """
+    Applies func (text column -> column) once per distinct value and maps
+    the results back: NITs, dates and amounts repeat a lot across rows.
+    """
+    codes, uniques = pd.factorize(text)
+    result = func(pd.Series(uniques, dtype=object)).to_numpy()
+    return pd.Series(result[codes], index=text.index)
+
+
+def _parse_numbers(text: pd.Series) -> pd.Series:
+    """clean_colombian_number for text values."""
+    text = text.str.replace(r"[^\d.,-]", "", regex=True)
+    # Dots are thousands separators whenever present; commas are the decimal point
+    text = text.str.translate(_NUMBER_SEPARATORS)
+    try:
+        return pd.Series(text.to_numpy(dtype=object).astype(float), index=text.index)
+    except ValueError:
+        pass
+    # Whatever float() rejects (e.g. "", "1.2.3", "5-") is 0.0
+    valid = text.str.fullmatch(r"-?(?:\d+\.?\d*|\.\d+)").to_numpy(dtype=bool)
+    parsed = np.zeros(len(text))
+    parsed[valid] = text[valid].to_numpy(dtype=object).astype(float)
+    return pd.Series(parsed, index=text.index)
+
+
+def _format_dates(text: pd.Series) -> pd.Series:
+    """format_date_colombian for text values."""
+    text = text.str.strip()
+    iso = text.str.extract(r"^(\d{4})[-/](\d{2})[-/](\d{2})")
+    dmy = text.str.extract(r"^(\d{2})[-/](\d{2})[-/](\d{4})")
+    out = text.where(dmy[0].isna(), dmy[0] + "/" + dmy[1] + "/" + dmy[2])
+    return out.where(iso[0].isna(), iso[2] + "/" + iso[1] + "/" + iso[0])
+
+
+def _nit_verification_digits(numbers: pd.Series) -> pd.Series:
+    """
+    calculate_nit_verification_digit for NIT numbers (without DV): each
+    number is left-padded to 15 digits and the mod-11 sums are one
+    matrix product with NIT_WEIGHTS.
+    """
+    out = np.full(len(numbers), "?", dtype=object)
+    ascii_digits = numbers.str.fullmatch(r"[0-9]+").to_numpy(dtype=bool)
+    fits = ascii_digits & (numbers.str.len() <= 15).to_numpy(dtype=bool)
+    if fits.any():
+        padded = "".join(numbers[fits].str.zfill(15)).encode("ascii")
+        digits = np.frombuffer(padded, dtype=np.uint8).reshape(-1, 15).astype(np.int64) - ord("0")
+        remainder = (digits @ NIT_WEIGHTS) % 11
+        out[fits] = np.where(remainder > 1, 11 - remainder, remainder).astype(str)
+    # Non-ASCII digits that str.isdigit() accepts: rare, keep the scalar path
+    other = ~ascii_digits & numbers.str.isdigit().to_numpy(dtype=bool)
+    if other.any():
+        out[other] = numbers[other].map(calculate_nit_verification_digit).to_numpy()
+    return pd.Series(out, index=numbers.index)
+
+
+def _split_nits(raw: pd.Series) -> pd.DataFrame:
+    """clean_nit + split into number / extracted DV / calculated DV, for text values."""
+    raw = raw.str.strip().str.replace(".", "", regex=False).str.replace(" ", "", regex=False).str.replace(",", "", regex=False)
+    parts = raw.str.split("-")
+    numbers = parts.str[0]
+    return pd.DataFrame({
+        "nit": numbers,
+        "nit_dv_extraido": parts.str[-1].where(raw.str.contains("-", regex=False), None),
+        "nit_dv_calculado": _nit_verification_digits(numbers),
+    })
+
+
+def _clean_number_column(series: pd.Series) -> pd.Series:
+    """clean_colombian_number over a column."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    values = series.to_numpy(dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+        # Only NaN cells are numbers (kept as NaN); None is 0.0
+        is_number = pd.isna(values)
+        is_number[is_number] = [isinstance(v, float) for v in values[is_number]]
+    else:
+        is_number = np.array([isinstance(v, (int, float)) for v in values], dtype=bool)
+    out = np.zeros(len(series))
+    out[is_number] = series[is_number].astype(float)
+    rest = series.notna().to_numpy() & ~is_number
+    if rest.any():
+        out[rest] = _per_unique(_as_text(series[rest]), _parse_numbers).to_numpy()
+    return pd.Series(out, index=series.index)
+
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    normalize_data for a whole DataFrame at once (e.g. a historical workbook
+    after a rule change). The same rules are applied column by column with
+    pandas string methods, once per distinct value, and the NIT check digit
+    is computed with NumPy. Gives the same values as normalize_data on each
+    row of df.to_dict("records").
+    Returns a new DataFrame; df is not modified.
+    """
+    df = df.copy()
+    if df.empty:
+        return df
+    all_rows = np.ones(len(df), dtype=bool)
+
+    # Ensure fecha is set from fecha_emision when missing (e.g. from XML)
+    fecha_rows = all_rows
+    if "fecha_emision" in df.columns:
+        fill = _truthy(df["fecha_emision"])
+        if "fecha" in df.columns:
+            fill &= ~_truthy(df["fecha"])
+        elif fill.any():
+            # Rows without fecha_emision do not get the column (as in normalize_data)
+            df["fecha"] = np.nan
+            fecha_rows = fill
+        if fill.any():
+            df["fecha"] = df["fecha"].astype(object)
+            df.loc[fill, "fecha"] = df.loc[fill, "fecha_emision"]
+
+    # numeric fields
+    for field in ["base", "impuestos", "total"]:
+        if field in df.columns:
+            df[field] = _clean_number_column(df[field])
+
+    # Heuristic: correct suspiciously low total (decimal error)
+    if "total" in df.columns:
+        total = df["total"]
+        df["total"] = total.where(~((total > 0) & (total < 500.0)), total * 1000)
+
+    # date fields
+    for field in ["fecha", "fecha_vencimiento", "fecha_emision"]:
+        if field in df.columns:
+            rows = fecha_rows if field == "fecha" else all_rows
+            column = df.loc[rows, field]
+            formatted = _per_unique(_as_text(column), _format_dates).where(_truthy(column), "")
+            df[field] = df[field].astype(object)
+            df.loc[rows, field] = formatted
+
+    # nit field: number, DV after the hyphen (if any) and calculated DV
+    if "nit" in df.columns:
+        rows = _truthy(df["nit"])
+        if rows.any():
+            text = _as_text(df.loc[rows, "nit"])
+            codes, uniques = pd.factorize(text)
+            split = _split_nits(pd.Series(uniques, dtype=object))
+            for field in ["nit", "nit_dv_extraido", "nit_dv_calculado"]:
+                df[field] = (df[field] if field in df.columns else np.nan)
+                df[field] = df[field].astype(object)
+                df.loc[rows, field] = split[field].to_numpy()[codes]
+
+    return df
@@ -1,159 +1,560 @@
+import io
 import os
-import time
+import asyncio
 import json
-import ast
-import re
+from datetime import date
 from google import genai
 from google.genai import types
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+from telemetry import Telemetry, current_key
+from remote_files import RemoteFileCache
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# Bump whenever the extraction prompt changes, so cached results produced
+# with an older prompt are not reused.
+PROMPT_VERSION = "v2"
+
+# Declared response schema: (field, kind, description). Gemini is constrained
+# to exactly these keys and types, so the answer is parsed once with no repair.
+# kind: "string", "number" or "date" (string, ISO YYYY-MM-DD).
+INVOICE_FIELDS = [
+    ("proveedor_nombre", "string", "Nombre legal del emisor."),
+    ("proveedor_nit", "string", "NIT, RUT, CUIT o identificación fiscal del emisor."),
+    ("proveedor_direccion", "string", "Dirección física."),
+    ("proveedor_telefono", "string", "Teléfono de contacto."),
+    ("proveedor_ciudad", "string", "Ciudad del emisor."),
+    ("factura_numero", "string", "Número consecutivo de la factura."),
+    ("fecha_emision", "date", "Fecha de la factura, YYYY-MM-DD."),
+    ("fecha_vencimiento", "date", "Fecha de pago/vencimiento, YYYY-MM-DD."),
+    ("descripcion_general", "string", "Resumen breve de qué se está cobrando (ej. \"Servicios de aseo\")."),
+    ("moneda", "string", "Código ISO: COP, USD, EUR, etc."),
+    ("base_imponible", "number", "Subtotal antes de impuestos."),
+    ("impuestos", "number", "Valor total de IVA u otros impuestos."),
+    ("total", "number", "Valor total a pagar."),
+    ("cufe", "string", "CUFE o CUDE (Código Único de Facturación Electrónica)."),
+]
+
+# Batched answers also carry the document marker they belong to
+BATCH_FIELDS = [
+    ("documento", "integer", "El número <n> del marcador del documento."),
+    ("archivo", "string", "El nombre de archivo del marcador."),
+]
+
+
+def _field_schema(kind: str, description: str) -> types.Schema:
+    if kind == "number":
+        return types.Schema(type=types.Type.NUMBER, nullable=True, description=description)
+    if kind == "integer":
+        return types.Schema(type=types.Type.INTEGER, description=description)
+    if kind == "date":
+        # No "date" format in Gemini schemas; the shape is asked for and checked on parse
+        return types.Schema(type=types.Type.STRING, nullable=True, description=description)
+    return types.Schema(type=types.Type.STRING, nullable=True, description=description)
+
+
+def _object_schema(fields) -> types.Schema:
+    names = [name for name, _, _ in fields]
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties={name: _field_schema(kind, description) for name, kind, description in fields},
+        required=names,
+        property_ordering=names,
+    )
+
+
+INVOICE_SCHEMA = _object_schema(INVOICE_FIELDS)
+BATCH_SCHEMA = types.Schema(type=types.Type.ARRAY, items=_object_schema(BATCH_FIELDS + INVOICE_FIELDS))
+
+# Comprehensive prompt for full data extraction (the fields come from the schema)
+EXTRACTION_PROMPT = """
+Eres un asistente administrativo experto y meticuloso. Analiza este documento (factura/recibo)
+y extrae sus datos según el esquema. Usa null si no encuentras un valor.
+"""
+
+# Prompt for several invoices in one request; each document is preceded by
+# a "DOCUMENTO <n>" marker so the answers can be demultiplexed.
+BATCH_EXTRACTION_PROMPT = """
+Eres un asistente administrativo experto y meticuloso. Recibiste {count} documentos (facturas/recibos),
+cada uno precedido por una línea "DOCUMENTO <n> - archivo: <nombre>".
+Cada documento es una factura independiente: no mezcles datos entre documentos.
+Devuelve exactamente {count} objetos según el esquema, uno por documento y en el mismo orden.
+Usa null si no encuentras un valor.
+"""
+
+def _is_inline(part) -> bool:
+    return isinstance(part, types.Part) and part.inline_data is not None
+
 
 class VisionSkill:
     """
     Skill to extract invoice data using Google Gemini 2.0 Flash (or latest).
     """
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client=None, inline_max_bytes: int = 1024 * 1024, preprocessor=None,
+                 archive=None, offline: bool = False, telemetry: Optional[Telemetry] = None,
+                 models: Optional[List[str]] = None, remote_files: Optional[RemoteFileCache] = None):
         self.api_key = api_key
-        if not self.api_key:
+        if not self.api_key and not offline:
             # We will handle the missing key gracefully here to allow the script to load,
-            # but extract_data will fail if not set.
+            # but extraction will fail if not set.
             print("WARNING: GOOGLE_API_KEY not set.")
         
-        self.client = genai.Client(api_key=self.api_key)
-        self.model_name = "gemini-2.0-flash" 
+        # A pre-built client can be injected (e.g. a local fake that injects 429s).
+        # Offline (--replay) there is no client at all, so nothing can reach the network.
+        if offline:
+            self.client = None
+        else:
+            self.client = client if client is not None else genai.Client(api_key=self.api_key)
+        # Model cascade, cheapest first: InvoiceProcessor re-runs a document on
+        # the next model only when the previous answer fails validation
+        self.models = list(models) if models else [DEFAULT_MODEL]
+        self.model_name = self.models[0]
+        self.poll_interval = 2 # seconds between remote processing checks
+        # Files up to this size are sent inline in the request instead of going
+        # through files.upload + PROCESSING polls (0 disables the fast path)
+        self.inline_max_bytes = inline_max_bytes
+        # Optional preprocess.Preprocessor that shrinks scans/photos before sending
+        self.preprocessor = preprocessor
+        # Optional response_archive.ResponseArchive for the raw answers (see --replay)
+        self.archive = archive
+        # Stage timings / token usage, attributed to the files being worked on
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        # Optional remote_files.RemoteFileCache: uploads are kept (until the
+        # invoice is extracted) and referenced again by retries and re-runs
+        self.remote_files = remote_files
+        self._pending_deletes = set()
+        # file_path -> (account, client, task) of uploads started by prefetch()
+        self._prefetched: Dict[str, Tuple[str, object, asyncio.Future]] = {}
+        # Client of each account that uploaded something, to delete it in release()
+        self._clients: Dict[str, object] = {}
+        # (sha256, account) handles known to be live in this run
+        self._live = set()
 
-    def extract_data(self, file_path: str) -> Dict:
+    async def extract_data_async(self, file_path: str, payload: Optional[Tuple[bytes, str]] = None,
+                                 archive_key: Optional[str] = None, client=None,
+                                 model: Optional[str] = None) -> Dict:
         """
-        Uploads file to Gemini and requests JSON extraction.
+        Uploads (or inlines) a file and requests JSON extraction, on the SDK's
+        async client (client.aio): upload, remote-processing polls and
+        generation never block a thread, so many invoices can be in flight
+        without a thread pool.
+        payload: (bytes, mime type) to send instead of reading file_path,
+        which is then only used as display name (in-memory ZIP members).
+        archive_key: SHA-256 of the file; the raw answer is archived under it.
+        client: client of the API key to use (key pool); default self.client.
+        model: model of the cascade to use; default the first one.
         """
         if not self.api_key:
              print("Error: GOOGLE_API_KEY is missing. Cannot process file.")
              return {}
 
+        client = client or self.client
+        model = model or self.model_name
+        remote_names = []
+        try:
+            part = await self._prepare_part_async(file_path, remote_names, payload, client, archive_key)
+
+            print("Generating extraction...")
+
+            # Rate limits (429) are not retried here: the caller's RateLimiter
+            # owns backoff, so it can honor the server's retry delay and slow
+            # down every in-flight request, not just this one
+            with self.telemetry.span("generate"):
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=[part, EXTRACTION_PROMPT],
+                    config=self._generation_config()
+                )
+            self.telemetry.add_usage(getattr(response, "usage_metadata", None))
+            return self._parse_response(response, archive_key, model)
+
+        except Exception as e:
+            self._log_error(file_path, e)
+            raise e
+        finally:
+            self._schedule_delete(remote_names, client)
+
+    async def extract_batch_async(self, file_paths: List[str],
+                                  archive_keys: Optional[List[Optional[str]]] = None,
+                                  client=None, model: Optional[str] = None) -> Optional[List[Dict]]:
+        """
+        Packs several invoices into a single generate_content call.
+        Returns one dict per input, in the same order, or None when the
+        model's array is malformed, has the wrong length or cannot be matched
+        back to the inputs (the caller then splits the batch).
+        archive_keys: file hashes; each document's object of the answer is
+        archived on its own, so it can be replayed like a single answer.
+        client, model: as in extract_data_async (all documents go through one key).
+        """
+        if not self.api_key:
+             print("Error: GOOGLE_API_KEY is missing. Cannot process file.")
+             return [{} for _ in file_paths]
+
+        client = client or self.client
+        model = model or self.model_name
+        remote_names = []
+        try:
+            # Let every upload settle before raising, so none is left undeleted
+            parts = await asyncio.gather(
+                *[self._prepare_part_async(f, remote_names, client=client, archive_key=k)
+                  for f, k in zip(file_paths, archive_keys or [None] * len(file_paths))],
+                return_exceptions=True
+            )
+            for part in parts:
+                if isinstance(part, Exception):
+                    raise part
+
+            contents = []
+            for i, (file_path, part) in enumerate(zip(file_paths, parts), start=1):
+                contents.append(f"DOCUMENTO {i} - archivo: {os.path.basename(file_path)}")
+                contents.append(part)
+            contents.append(BATCH_EXTRACTION_PROMPT.format(count=len(file_paths)))
+
+            print(f"Generating batched extraction for {len(file_paths)} documents...")
+            with self.telemetry.span("generate"):
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=self._generation_config(batch=True)
+                )
+            self.telemetry.add_usage(getattr(response, "usage_metadata", None))
+            items = self._split_batch_response(response, file_paths)
+            if items is None:
+                return None
+            if archive_keys:
+                # The model's own object per document, as the single-file
+                # path archives the raw text: replay re-applies to_record
+                for key, item in zip(archive_keys, items):
+                    self._archive(key, json.dumps(item, ensure_ascii=False), model)
+            return [self.to_record(item) for item in items]
+        finally:
+            self._schedule_delete(remote_names, client)
+
+    @property
+    def model_key(self) -> str:
+        """Identifies the model configuration in the extraction cache (the whole cascade)."""
+        return ">".join(self.models)
+
+    def prefetch(self, file_path: str, payload: Optional[Tuple[bytes, str]] = None,
+                 archive_key: Optional[str] = None, client=None):
+        """
+        Starts preparing a file (pre-processing, upload and remote
+        processing) in the background while its call still waits for the
+        rate limiter, so upload latency hides behind other invoices'
+        generate calls. The call picks the result up (an upload only when it
+        runs under the same account, the current telemetry key).
+        """
+        if self.client is None or file_path in self._prefetched:
+            return
+        account = self._account()
+        client = client or self.client
+        task = asyncio.ensure_future(self._prepare(file_path, payload, client, archive_key, account))
+        self._prefetched[file_path] = (account, client, task)
+
+    def may_upload(self, file_path: str, payload: Optional[Tuple[bytes, str]] = None) -> bool:
+        """False when the file will surely go inline (pre-processing only shrinks it)."""
+        return self.client is not None and not self._can_inline(file_path, payload)
+
+    def release(self, sha256: Optional[str]):
+        """
+        Deletes the uploads of a file whose extraction is final: from now on
+        the extraction cache answers for it, so the handles are not needed.
+        """
+        if self.remote_files is None or not sha256:
+            return
+        for account, name in self.remote_files.accounts(sha256):
+            client = self._clients.get(account)
+            if client is not None:
+                self._schedule_delete([name], client)
+            self._live.discard((sha256, account))
+        self.remote_files.discard(sha256)
+
+    async def aclose(self):
+        """Waits for prefetched uploads and background deletions of uploaded files to finish."""
+        leftovers = [self._prefetched.pop(file_path) for file_path in list(self._prefetched)]
+        prepared = await asyncio.gather(*[task for _, _, task in leftovers], return_exceptions=True)
+        for (_, client, _), result in zip(leftovers, prepared):
+            if not isinstance(result, BaseException) and result[1]:
+                self._schedule_delete([result[1]], client)
+        if self._pending_deletes:
+            await asyncio.gather(*self._pending_deletes, return_exceptions=True)
+
+    def _can_inline(self, file_path: str, payload: Optional[Tuple[bytes, str]] = None) -> bool:
+        if not self.inline_max_bytes:
+            return False
+        if payload is not None:
+            return len(payload[0]) <= self.inline_max_bytes
+        if self._get_mime_type(file_path) == 'application/octet-stream':
+            return False
         try:
-            mime_type = self._get_mime_type(file_path)
-            
-            # Comprehensive prompt for full data extraction
-            prompt = """
-            Eres un asistente administrativo experto y meticuloso. Analiza este documento (factura/recibo).
-            Tu objetivo es extraer la mayor cantidad de información posible.
-            
-            Extrae los siguientes datos en formato JSON estrictamente válido.
-            
-            Campos requeridos (usa null si no encuentras el valor):
-            - proveedor_nombre (string): Nombre legal del emisor.
-            - proveedor_nit (string): NIT, RUT, CUIT o identificación fiscal del emisor. Intenta encontrarlo.
-            - proveedor_direccion (string): Dirección física.
-            - proveedor_telefono (string): Teléfono de contacto.
-            - proveedor_ciudad (string): Ciudad del emisor.
-            
-            - factura_numero (string): Número consecutivo de la factura.
-            - fecha_emision (string): Fecha de la factura (YYYY-MM-DD).
-            - fecha_vencimiento (string): Fecha de pago/vencimiento (YYYY-MM-DD).
-            
-            - descripcion_general (string): Resumen breve de qué se está cobrando (ej. "Servicios de aseo", "Mantenimiento", "Compra papelería").
-            
-            - moneda (string): COP, USD, EUR, etc.
-            - base_imponible (float): Subtotal antes de impuestos.
-            - impuestos (float): Valor total de IVA u otros impuestos.
-            - total (float): Valor total a pagar.
-            - cufe (string): CUFE o CUDE (Código Único de Facturación Electrónica). Cadena larga alfanumérica.
-
-            Devuelve SOLO el objeto JSON, nada de markdown ni explicaciones.
-            """
+            return os.path.getsize(file_path) <= self.inline_max_bytes
+        except OSError:
+            return False
+
+    def _inline_part(self, file_path: str, payload: Optional[Tuple[bytes, str]] = None) -> types.Part:
+        if payload is not None:
+            return types.Part.from_bytes(data=payload[0], mime_type=payload[1])
+        with open(file_path, "rb") as f:
+            data = f.read()
+        return types.Part.from_bytes(data=data, mime_type=self._get_mime_type(file_path))
+
+    def _upload_args(self, file_path: str, payload: Optional[Tuple[bytes, str]] = None) -> Dict:
+        """Arguments for files.upload: the path itself, or the pre-processed bytes."""
+        if payload is None:
+            return {"file": file_path}
+        return {
+            "file": io.BytesIO(payload[0]),
+            "config": types.UploadFileConfig(
+                mime_type=payload[1],
+                display_name=os.path.basename(file_path)
+            ),
+        }
+
+    async def _prepare_part_async(self, file_path: str, remote_names: List[str],
+                                  payload: Optional[Tuple[bytes, str]] = None, client=None,
+                                  archive_key: Optional[str] = None):
+        """
+        Returns the request part for a file: inline bytes for small files,
+        otherwise an uploaded (and processed) remote file. Without a handle
+        cache the remote name is appended to remote_names so the caller can
+        delete it afterwards. Uses the prefetch() of the file when there is one.
+        archive_key: SHA-256 of the file, the handle cache key.
+        """
+        client = client or self.client
+        account = self._account()
+        prefetched = self._prefetched.pop(file_path, None)
+        if prefetched is not None:
+            prefetch_account, prefetch_client, task = prefetched
+            if prefetch_account == account:
+                part, remote_name = await task
+                if remote_name:
+                    remote_names.append(remote_name)
+                return part
+            # The key pool leased another key than the one the file went to:
+            # inline bytes still work, an upload does not (the handle cache
+            # keeps it for that key, or it is deleted)
+            try:
+                part, remote_name = await task
+            except Exception:
+                part, remote_name = None, None
+            if remote_name:
+                self._schedule_delete([remote_name], prefetch_client)
+            if _is_inline(part):
+                return part
 
+        part, remote_name = await self._prepare(file_path, payload, client, archive_key, account)
+        if remote_name:
+            remote_names.append(remote_name)
+        return part
+
+    async def _prepare(self, file_path: str, payload: Optional[Tuple[bytes, str]], client,
+                       archive_key: Optional[str], account: str):
+        """
+        (part, remote name to delete after the call or None). A live cached
+        upload of the file is referenced instead of uploading it again.
+        Files are shrunk by the preprocessor first when one is configured.
+        """
+        cached = archive_key is not None and self.remote_files is not None
+        if cached:
+            part = await self._reuse_upload(archive_key, account, client)
+            if part is not None:
+                return part, None
+
+        if payload is None and self.preprocessor is not None:
+            # Pillow/pypdf work is CPU-bound; keep it off the event loop
+            loop = asyncio.get_running_loop()
+            with self.telemetry.span("preprocess"):
+                payload = await loop.run_in_executor(None, self.preprocessor.prepare, file_path)
+
+        if self._can_inline(file_path, payload):
+            return self._inline_part(file_path, payload), None
+
+        myfile = await self._upload_async(file_path, payload, client)
+        uri = getattr(myfile, "uri", None)
+        if not cached or not uri:
+            return myfile, myfile.name
+        expiration = getattr(myfile, "expiration_time", None)
+        self.remote_files.put(archive_key, account, myfile.name, uri, getattr(myfile, "mime_type", None),
+                              expiration.timestamp() if expiration else None)
+        self._clients[account] = client
+        self._live.add((archive_key, account))
+        return myfile, None
+
+    async def _reuse_upload(self, sha256: str, account: str, client) -> Optional[types.Part]:
+        """Part referencing a cached upload, checked to still be ACTIVE when it comes from an earlier run."""
+        handle = self.remote_files.get(sha256, account)
+        if handle is None:
+            return None
+        if (sha256, account) not in self._live:
             try:
-                print(f"Uploading {os.path.basename(file_path)} to Google GenAI...")
-            except UnicodeEncodeError:
-                print(f"Uploading {os.path.basename(file_path).encode('utf-8', 'replace').decode('utf-8')} to Google GenAI...")
-            
-            # Upload file
-            myfile = self.client.files.upload(file=file_path)
-            
-            # Polling to wait for processing (mostly for PDFs)
+                remote = await client.aio.files.get(name=handle.name)
+                live = remote.state.name == "ACTIVE"
+            except Exception:
+                live = False
+            if not live:
+                self.remote_files.discard(sha256, account)
+                return None
+            self._live.add((sha256, account))
+        self._clients[account] = client
+        self.telemetry.count("uploads_reused")
+        return types.Part.from_uri(file_uri=handle.uri, mime_type=handle.mime_type)
+
+    async def _upload_async(self, file_path: str, payload: Optional[Tuple[bytes, str]] = None, client=None):
+        """Uploads a file and waits (without blocking) until Gemini has processed it."""
+        self._log_upload(file_path)
+        client = client or self.client
+
+        with self.telemetry.span("upload"):
+            myfile = await client.aio.files.upload(**self._upload_args(file_path, payload))
+
+        with self.telemetry.span("remote_poll"):
             while myfile.state.name == "PROCESSING":
                 print("Processing file remotely...")
-                time.sleep(2)
-                myfile = self.client.files.get(name=myfile.name)
+                await asyncio.sleep(self.poll_interval)
+                myfile = await client.aio.files.get(name=myfile.name)
 
-            if myfile.state.name == "FAILED":
-                raise ValueError("Gemini File processing failed.")
+        if myfile.state.name == "FAILED":
+            raise ValueError("Gemini File processing failed.")
+        return myfile
 
-            print("Generating extraction...")
-            
-            # Simple retry mechanism for Rate Limits
-            max_retries = 3
-            base_delay = 10 # seconds
-            
-            for attempt in range(max_retries):
+    @staticmethod
+    def _account() -> str:
+        # Key pool label of the call in progress (see InvoiceProcessor._call_limited)
+        return current_key.get() or "default"
+
+    def _schedule_delete(self, remote_names: List[str], client=None):
+        """Deletes uploaded files in the background so cleanup never delays a result."""
+        for name in remote_names:
+            task = asyncio.ensure_future(self._delete_remote(name, client or self.client))
+            self._pending_deletes.add(task)
+            task.add_done_callback(self._pending_deletes.discard)
+
+    async def _delete_remote(self, name: str, client):
+        try:
+            await client.aio.files.delete(name=name)
+        except Exception as e:
+            print(f"Could not delete remote file {name}: {e}")
+
+    def _generation_config(self, batch: bool = False) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=BATCH_SCHEMA if batch else INVOICE_SCHEMA,
+        )
+
+    def _parse_response(self, response, archive_key: Optional[str] = None,
+                        model: Optional[str] = None) -> Dict:
+        """
+        Turns a schema-constrained generate_content response into a typed
+        record (see to_record). Returns {} when the answer is not valid.
+        """
+        if response.text:
+            self._archive(archive_key, response.text, model)
+        return self.parse_text(response.text, getattr(response, "parsed", None))
+
+    def parse_text(self, text: Optional[str], parsed=None) -> Dict:
+        """
+        Same as _parse_response for raw answer text (e.g. from the archive).
+        parsed: the value the SDK already decoded from text, if any.
+        """
+        data = self._load_json(text, parsed)
+        if not isinstance(data, dict):
+            if data is not None:
+                self.telemetry.count("json_failed")
+                print(f"Answer does not match the invoice schema: {str(text)[:100]}...")
+            return {}
+        return self.to_record(data)
+
+    def to_record(self, data: Dict) -> Dict:
+        """
+        Keeps the schema fields only, with numbers as float and dates as ISO
+        strings (None when missing). Values the schema did not constrain are
+        left for normalize_data. A date that is not AAAA-MM-DD is dropped and
+        counted as date_failed: day and month can no longer be told apart,
+        and the empty field fails validation (next model of the cascade).
+        An answer with no values at all gives {}.
+        """
+        record = {}
+        for name, kind, _ in INVOICE_FIELDS:
+            value = data.get(name)
+            if value is None or value == "":
+                record[name] = None
+            elif kind == "number" and isinstance(value, (int, float)) and not isinstance(value, bool):
+                record[name] = float(value)
+            elif kind == "date" and isinstance(value, str):
                 try:
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=[myfile, prompt],
-                        config=types.GenerateContentConfig(
-                            response_mime_type="application/json"
-                        )
-                    )
-                    break
-                except Exception as e:
-                    if "429" in str(e) or "ResourceExhausted" in str(e):
-                        if attempt == max_retries - 1:
-                            raise e
-                        
-                        sleep_time = base_delay * (2 ** attempt) + (time.time() % 1)
-                        print(f"Rate limit hit. Retrying in {sleep_time:.2f}s...")
-                        time.sleep(sleep_time)
-                    else:
-                        raise e
-            
-            # Response handling for google-genai
-            # It might return a parsed object if response_mime_type is JSON, or text.
-            # With google-genai and response_mime_type="application/json", it often validates JSON.
-            
-            if not response.text:
-                print("Empty response from model.")
-                return {}
-
-            text_response = response.text.strip()
-            # Cleanup just in case
-            import re
-            
-            # Extract JSON block using regex
-            json_match = re.search(r'\{.*\}|\[.*\]', text_response, re.DOTALL)
-            if json_match:
-                text_response = json_match.group(0)
-            
+                    record[name] = date.fromisoformat(value.strip()).isoformat()
+                except ValueError:
+                    self.telemetry.count("date_failed")
+                    record[name] = None
+            else:
+                record[name] = value
+        return record if any(value is not None for value in record.values()) else {}
+
+    def _split_batch_response(self, response, file_paths: List[str]) -> Optional[List[Dict]]:
+        """
+        Demultiplexes a batched response into the raw per-file objects (in
+        file_paths order, without documento / archivo), or None if unusable.
+        """
+        data = self._load_json(response.text, getattr(response, "parsed", None))
+        if not isinstance(data, list) or len(data) != len(file_paths):
+            count = len(data) if isinstance(data, list) else "no array"
+            print(f"Batched response unusable ({count} items for {len(file_paths)} documents).")
+            return None
+
+        results: List[Optional[Dict]] = [None] * len(file_paths)
+        for item in data:
+            if not isinstance(item, dict):
+                return None
             try:
-                data = json.loads(text_response)
-            except json.JSONDecodeError:
-                # Fallback 1: try to clean common markdown issues if raw load fails
-                cleaned = text_response.replace("```json", "").replace("```", "").strip()
-                try:
-                    data = json.loads(cleaned)
-                except json.JSONDecodeError:
-                    # Fallback 2: python literal eval (handles single quotes)
-                    try:
-                        data = ast.literal_eval(cleaned)
-                    except (ValueError, SyntaxError):
-                        print(f"Failed to parse JSON even with fallbacks: {text_response[:100]}...")
-                        return {}
-
-            # Handle list response (sometimes model returns [{}])
-            if isinstance(data, list):
-                if data:
-                    data = data[0]
-                else:
-                    return {}
-            
-            return data
+                index = int(item.pop("documento")) - 1
+            except (KeyError, TypeError, ValueError):
+                return None
+            archivo = item.pop("archivo", None)
+            if not 0 <= index < len(file_paths) or results[index] is not None:
+                return None
+            if archivo and archivo != os.path.basename(file_paths[index]):
+                print(f"Batched response mixed up documents ({archivo} tagged as #{index + 1}).")
+                return None
+            results[index] = item
+        return results
 
-        except Exception as e:
+    def _archive(self, key: Optional[str], raw: str, model: Optional[str] = None):
+        if self.archive is not None and key:
+            self.archive.put(key, model or self.model_name, PROMPT_VERSION, raw)
+
+    def _load_json(self, text: Optional[str], parsed=None):
+        """
+        The JSON value (dict or list) of an answer, or None. The schema makes
+        the model emit plain JSON, so there is one parse and no repair: an
+        unparsable answer is counted as json_failed.
+        """
+        with self.telemetry.span("json_parse"):
+            if isinstance(parsed, (dict, list)):
+                return parsed
+            if not text:
+                self.telemetry.count("json_failed")
+                print("Empty response from model.")
+                return None
             try:
-                print(f"Error extracting data from {file_path} with Gemini: {e}")
-            except UnicodeEncodeError:
-                 safe_path = file_path.encode('utf-8', 'replace').decode('utf-8')
-                 print(f"Error extracting data from {safe_path} with Gemini: {e}")
-            raise e
+                return json.loads(text)
+            except json.JSONDecodeError as e:
+                self.telemetry.count("json_failed")
+                print(f"Failed to parse JSON ({e}): {text[:100]}...")
+                return None
+
+    def _log_upload(self, file_path: str):
+        try:
+            print(f"Uploading {os.path.basename(file_path)} to Google GenAI...")
+        except UnicodeEncodeError:
+            print(f"Uploading {os.path.basename(file_path).encode('utf-8', 'replace').decode('utf-8')} to Google GenAI...")
+
+    def _log_error(self, file_path: str, e: Exception):
+        try:
+            print(f"Error extracting data from {file_path} with Gemini: {e}")
+        except UnicodeEncodeError:
+             safe_path = file_path.encode('utf-8', 'replace').decode('utf-8')
+             print(f"Error extracting data from {safe_path} with Gemini: {e}")
 
     def _get_mime_type(self, path: str) -> str:
         ext = os.path.splitext(path)[1].lower()
@@ -0,0 +1,265 @@
+import os
+import sys
+import struct
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from pipeline import DOCUMENT_EXTENSIONS
+
+# inotify constants (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event: int wd; uint32 mask, cookie, len; char name[len]
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _is_watched(name: str) -> bool:
+    return name.lower().endswith(DOCUMENT_EXTENSIONS + ('.xml',))
+
+
+class _Inotify:
+    """Minimal recursive inotify binding over libc (no extra dependency)."""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.ctypes = ctypes
+        self.dirs: Dict[int, str] = {}
+
+    def add_tree(self, root: str) -> List[str]:
+        """Watches root and every directory below it. Returns the files already there."""
+        files = []
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                raise OSError(self.ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self.dirs[wd] = directory
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif _is_watched(entry.name):
+                            files.append(entry.path)
+            except OSError:
+                continue
+        return files
+
+    def read(self) -> Tuple[List[str], bool]:
+        """
+        Drains pending events. Returns (paths of written / moved-in files,
+        overflow) where overflow means events were lost and the tree must be
+        rescanned. Directories created or moved in are watched right away and
+        their current files reported.
+        """
+        paths, overflow = [], False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                directory = self.dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # Files copied into a new folder may land before its watch exists
+                        paths.extend(self.add_tree(path))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and _is_watched(name):
+                    # IN_CREATE alone is skipped: the file is still being written
+                    paths.append(path)
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """
+    Reports invoices (and XML files) created, modified or moved into
+    input_dir while the process keeps running, for --watch.
+
+    On Linux it uses inotify: only files that were closed after writing or
+    moved in are reported, so half-copied files are never picked up. Other
+    platforms (or when inotify is not available, e.g. the watch limit is
+    reached) fall back to polling size + mtime every poll_interval seconds;
+    a file is reported once its size and mtime stopped changing between
+    two polls.
+
+    Changes are collected until settle seconds pass without new ones, so a
+    PDF and its XML copied together arrive in the same batch.
+    """
+
+    def __init__(self, root: str, poll_interval: float = 5.0, settle: float = 2.0,
+                 use_inotify: bool = True):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.use_inotify = use_inotify and sys.platform.startswith("linux")
+        self.mode = None
+
+        self._pending: Dict[str, None] = {}
+        self._inotify: Optional[_Inotify] = None
+        self._poller: Optional[asyncio.Task] = None
+        # Polling: last (size, mtime) seen and last one reported, per path
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._reported: Dict[str, Tuple[int, int]] = {}
+
+    async def start(self):
+        """
+        Starts watching. Call before the catch-up scan, so files arriving
+        during it are not missed (files reported twice are skipped by the
+        manifest).
+        """
+        self._changed = asyncio.Event()
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_event_loop()
+
+        if self.use_inotify:
+            try:
+                self._inotify = _Inotify()
+                await loop.run_in_executor(None, self._inotify.add_tree, self.root)
+                loop.add_reader(self._inotify.fd, self._on_inotify)
+                self.mode = "inotify"
+                return
+            except (OSError, AttributeError) as e:
+                print(f"inotify not available ({e}), polling every {self.poll_interval:g}s.")
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+
+        self._seen = await loop.run_in_executor(None, self._snapshot)
+        self._reported = dict(self._seen)
+        self._poller = asyncio.ensure_future(self._poll())
+        self.mode = "polling"
+
+    def stop(self):
+        """Makes next_batch return None (safe to call from a signal handler)."""
+        self._stopped.set()
+
+    async def next_batch(self) -> Optional[List[Tuple[List[str], List[str]]]]:
+        """
+        Waits for changes and returns them grouped by directory, in the
+        same (documents, xml files) shape as pipeline.scan_directory.
+        Returns None once stop() was called.
+        """
+        while True:
+            if not self._pending:
+                self._changed.clear()
+                stop = asyncio.ensure_future(self._stopped.wait())
+                change = asyncio.ensure_future(self._changed.wait())
+                await asyncio.wait([stop, change], return_when=asyncio.FIRST_COMPLETED)
+                stop.cancel()
+                change.cancel()
+            if self._stopped.is_set():
+                return None
+
+            # Debounce: wait until the folder has been quiet for settle seconds
+            count = -1
+            while count != len(self._pending) and not self._stopped.is_set():
+                count = len(self._pending)
+                await asyncio.sleep(self.settle)
+
+            paths, self._pending = list(self._pending), {}
+            grouped: Dict[str, Tuple[List[str], List[str]]] = {}
+            for path in paths:
+                if not os.path.isfile(path):
+                    continue
+                documents, xmls = grouped.setdefault(os.path.dirname(path), ([], []))
+                (xmls if path.lower().endswith(".xml") else documents).append(path)
+            if grouped:
+                return list(grouped.values())
+
+    def close(self):
+        if self._inotify is not None:
+            asyncio.get_event_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    def _on_inotify(self):
+        try:
+            paths, overflow = self._inotify.read()
+        except OSError as e:
+            print(f"Watcher error: {e}")
+            return
+        if overflow:
+            print("Watcher event queue overflowed, rescanning input folder.")
+            paths = list(self._snapshot())
+        self._add(paths)
+
+    async def _poll(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                current = await loop.run_in_executor(None, self._snapshot)
+            except OSError as e:
+                print(f"Watcher error: {e}")
+                continue
+            stable = [
+                path for path, sig in current.items()
+                if self._seen.get(path) == sig and self._reported.get(path) != sig
+            ]
+            for path in stable:
+                self._reported[path] = current[path]
+            self._seen = current
+            self._add(stable)
+
+    def _add(self, paths: List[str]):
+        for path in paths:
+            self._pending[path] = None
+        if self._pending:
+            self._changed.set()
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """(size, mtime_ns) of every invoice / XML file under root."""
+        snapshot = {}
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif _is_watched(entry.name):
+                            st = entry.stat()
+                            snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        return snapshot
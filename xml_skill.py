@@ -1,96 +1,210 @@
 import xml.etree.ElementTree as ET
+import io
 import os
-from typing import Dict, Optional
+import re
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # Optional: the standard library parser is used instead
+    lxml_etree = None
+
+CBC = "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+CAC = "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+
+# (field, anchored, path). Anchored paths start at the document root ("./ID"),
+# the others match anywhere (".//TaxTotal/TaxAmount"); the first match wins,
+# like ElementTree's find(). Prefixes: "cac:" / "cbc:" namespaces.
+INVOICE_FIELDS = [
+    ("proveedor", False, "cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName"),
+    ("nit", False, "cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID"),
+    ("direccion", False, "cac:AccountingSupplierParty/cac:Party/cac:PhysicalLocation/cac:Address/cac:AddressLine/cbc:Line"),
+    ("telefono", False, "cac:AccountingSupplierParty/cac:Party/cac:Contact/cbc:Telephone"),
+    ("ciudad", False, "cac:AccountingSupplierParty/cac:Party/cac:PhysicalLocation/cac:Address/cbc:CityName"),
+    ("factura_numero", True, "cbc:ID"),
+    ("fecha_emision", False, "cbc:IssueDate"),
+    ("fecha_vencimiento", False, "cbc:DueDate"),
+    ("descripcion", False, "cac:InvoiceLine/cac:Item/cbc:Description"),  # First item description
+    ("moneda", True, "cbc:DocumentCurrencyCode"),
+    ("base", False, "cac:LegalMonetaryTotal/cbc:TaxExclusiveAmount"),
+    ("impuestos", False, "cac:TaxTotal/cbc:TaxAmount"),
+    ("total", False, "cac:LegalMonetaryTotal/cbc:PayableAmount"),
+    ("cufe", True, "cbc:UUID"),
+]
+# AttachedDocument: the actual Invoice is inside cbc:Description as CDATA string
+ATTACHED_FIELDS = [
+    ("embedded", False, "cac:Attachment/cac:ExternalReference/cbc:Description"),
+]
+FLOAT_FIELDS = ("base", "impuestos", "total")
+
+XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+def _compile(fields: List[Tuple[str, bool, str]], qualified: bool) -> Dict[str, List[Tuple[str, bool, Tuple[str, ...]]]]:
+    """
+    Turns the path specs into tuples of tags, indexed by their last tag so
+    each closing element costs one dict lookup. With qualified=False the
+    tags are plain local names (for documents without namespaces).
+    """
+    namespaces = {"cbc": CBC, "cac": CAC}
+    index = {}
+    for field, anchored, path in fields:
+        tags = []
+        for step in path.split("/"):
+            prefix, local = step.split(":")
+            tags.append(f"{{{namespaces[prefix]}}}{local}" if qualified else local)
+        index.setdefault(tags[-1], []).append((field, anchored, tuple(tags)))
+    return index
+
+
+INVOICE_PATHS = {True: _compile(INVOICE_FIELDS, True), False: _compile(INVOICE_FIELDS, False)}
+ATTACHED_PATHS = {True: _compile(ATTACHED_FIELDS, True), False: _compile(ATTACHED_FIELDS, False)}
+
 
 class XmlSkill:
     """
     Skill to extract invoice data from UBL 2.1 XML files (DIAN Colombia Standard).
+    Streams the document with iterparse and collects every field in one pass,
+    stopping once the totals (and the first line's description) have been
+    seen. Uses lxml when installed, otherwise xml.etree.
     """
 
+    def __init__(self, use_lxml: Optional[bool] = None):
+        # None = lxml if available
+        self.use_lxml = lxml_etree is not None if use_lxml is None else use_lxml and lxml_etree is not None
+
     def extract_data(self, file_path: str) -> Dict:
         """
         Parses an XML file and returns a dictionary with extracted fields.
         Returns None or empty dict if parsing fails or not a valid invoice.
         """
         try:
-            tree = ET.parse(file_path)
-            root = tree.getroot()
-
-            # Handle namespaces by stripping them for easier searching
-            # This is a pragmatic, non-validating approach
-            self._strip_namespaces(root)
-
-            # Check if it's an AttachedDocument (container) or Invoice directly
-            if root.tag.endswith('AttachedDocument'):
-                # The actual Invoice is inside cbc:Description as CDATA string
-                # path: AttachedDocument -> Attachment -> ExternalReference -> Description
-                # Since we stripped namespaces, we search by tag name
-                description = root.find(".//Attachment/ExternalReference/Description")
-                if description is not None and description.text:
-                    # Parse the inner XML
-                    try:
-                        inner_xml = description.text.strip()
-                        inner_root = ET.fromstring(inner_xml)
-                        self._strip_namespaces(inner_root)
-                        return self._parse_invoice(inner_root, os.path.basename(file_path))
-                    except ET.ParseError as e:
-                        print(f"Error parsing inner XML in {os.path.basename(file_path)}: {e}")
-                        # Print snippet for debugging
-                        print(f"Snippet: {inner_xml[:100]}...")
-                        return {}
-            elif root.tag.endswith('Invoice'):
-                 return self._parse_invoice(root, os.path.basename(file_path))
-            
-            # If we reach here, it might be a different dict type or failed to find invoice
+            with open(file_path, "rb") as f:
+                return self.extract_stream(f, os.path.basename(file_path))
+        except Exception as e:
+            print(f"Error parsing XML {file_path}: {e}")
+            return {}
+
+    def extract_stream(self, source, filename: str) -> Dict:
+        """
+        Same as extract_data for an open binary stream (e.g. a ZIP member).
+        filename is used for the "archivo" field and messages.
+        """
+        try:
+            kind, values = self._stream(source)
+
+            if kind == "AttachedDocument":
+                inner_xml = values.get("embedded")
+                if not inner_xml:
+                    return {}
+                # Parse the inner XML straight from the text buffer
+                try:
+                    inner = XML_DECLARATION.sub("", inner_xml.strip(), count=1).encode("utf-8")
+                    kind, values = self._stream(io.BytesIO(inner))
+                except (ET.ParseError, SyntaxError) as e:
+                    print(f"Error parsing inner XML in {filename}: {e}")
+                    # Print snippet for debugging
+                    print(f"Snippet: {inner_xml.strip()[:100]}...")
+                    return {}
+
+            if kind == "Invoice":
+                return self._to_invoice(values, filename)
+
+            # If we reach here, it might be a different doc type or failed to find invoice
             return {}
 
         except Exception as e:
-            print(f"Error parsing XML {file_path}: {e}")
+            print(f"Error parsing XML {filename}: {e}")
             return {}
 
-    def _strip_namespaces(self, elem):
-        """Removes namespaces from element tags in-place."""
-        if elem.tag.startswith("{"):
-            elem.tag = elem.tag.split("}", 1)[1]
-        for child in elem:
-            self._strip_namespaces(child)
+    def _iterparse(self, source):
+        if self.use_lxml:
+            # huge_tree: embedded invoices with signatures can exceed lxml's default text limit
+            return lxml_etree.iterparse(source, events=("start", "end"), huge_tree=True,
+                                        resolve_entities=False, no_network=True)
+        return ET.iterparse(source, events=("start", "end"))
+
+    def _stream(self, source) -> Tuple[Optional[str], Dict[str, str]]:
+        """
+        Single pass over the document. Returns (root local name, {field: text})
+        where the fields depend on the root: Invoice or AttachedDocument.
+        """
+        stack = []
+        values = {}
+        kind = None
+        paths = {}
+        wanted = 0
+        totals_seen = False
+        first_line_done = False
+
+        for event, elem in self._iterparse(source):
+            tag = elem.tag
+            if not isinstance(tag, str):
+                continue  # comments / processing instructions (lxml)
 
-    def _parse_invoice(self, root: ET.Element, filename: str) -> Dict:
-        """Extracts fields from a raw Invoice element tree."""
+            if event == "start":
+                if not stack:
+                    local = tag.rsplit("}", 1)[-1]
+                    qualified = tag.startswith("{")
+                    if local == "AttachedDocument":
+                        kind, paths = local, ATTACHED_PATHS[qualified]
+                    elif local.endswith("Invoice"):
+                        kind, paths = "Invoice", INVOICE_PATHS[qualified]
+                    else:
+                        return None, {}
+                    wanted = sum(len(v) for v in paths.values())
+                stack.append(tag)
+                continue
+
+            for field, anchored, path in paths.get(tag, ()):
+                if field in values:
+                    continue
+                depth = len(path)
+                if anchored and len(stack) != depth + 1:
+                    continue
+                if tuple(stack[-depth:]) == path:
+                    text = elem.text.strip() if elem.text else None
+                    if text:
+                        values[field] = text
+
+            stack.pop()
+            local = tag.rsplit("}", 1)[-1]
+            if kind == "Invoice" and len(stack) == 1:
+                if local == "LegalMonetaryTotal":
+                    totals_seen = True
+                elif local == "InvoiceLine":
+                    first_line_done = True
+            # Free what has been read (signatures, long line lists)
+            elem.clear()
+
+            if len(values) == wanted:
+                break
+            if kind == "AttachedDocument" and "embedded" in values:
+                break
+            # Totals come after every header field in UBL order; the only
+            # later field is the first InvoiceLine's description
+            if totals_seen and ("descripcion" in values or first_line_done):
+                break
+
+        return kind, values
+
+    def _to_invoice(self, values: Dict[str, str], filename: str) -> Dict:
+        """Builds the output dict from the collected field texts."""
         data = {
             "archivo": filename,
             "estado": "EXITOSO (XML)",
-            "proveedor": self._get_text(root, ".//AccountingSupplierParty/Party/PartyTaxScheme/RegistrationName"),
-            "nit": self._get_text(root, ".//AccountingSupplierParty/Party/PartyTaxScheme/CompanyID"),
-            "direccion": self._get_text(root, ".//AccountingSupplierParty/Party/PhysicalLocation/Address/AddressLine/Line"),
-            "telefono": self._get_text(root, ".//AccountingSupplierParty/Party/Contact/Telephone"),
-            "ciudad": self._get_text(root, ".//AccountingSupplierParty/Party/PhysicalLocation/Address/CityName"),
-            
-            "factura_numero": self._get_text(root, "./ID"),
-            "fecha_emision": self._get_text(root, ".//IssueDate"),
-            "fecha_vencimiento": self._get_text(root, ".//DueDate"),
-            
-            "descripcion": self._get_text(root, ".//InvoiceLine/Item/Description"), # First item description
-            
-            "moneda": self._get_text(root, "./DocumentCurrencyCode"),
-            "base": self._get_float(root, ".//LegalMonetaryTotal/TaxExclusiveAmount"),
-            "impuestos": self._get_float(root, ".//TaxTotal/TaxAmount"),
-            "total": self._get_float(root, ".//LegalMonetaryTotal/PayableAmount"),
-            "cufe": self._get_text(root, "./UUID")
         }
-        
+        for field, _, _ in INVOICE_FIELDS:
+            value = values.get(field)
+            data[field] = self._to_float(value) if field in FLOAT_FIELDS else value
+
         # Fallback for description if empty
         if not data["descripcion"]:
              data["descripcion"] = "Factura de Venta"
-             
-        return data
 
-    def _get_text(self, root, path) -> Optional[str]:
-        el = root.find(path)
-        return el.text.strip() if el is not None and el.text else None
+        return data
 
-    def _get_float(self, root, path) -> Optional[float]:
-        text = self._get_text(root, path)
+    def _to_float(self, text: Optional[str]) -> float:
         if text:
             try:
                 return float(text)